@@ -1,25 +1,50 @@
-from typing import Dict
+import hashlib
+import json
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Tuple
 
 import frappe
-from frappe import _
+from frappe import _, _dict
+from frappe.utils import cstr
 from frappe.utils.nestedset import get_root_of
 
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_integration_log.ecommerce_integration_log import (
+	clear_on_rollback,
+)
+
+
+class CustomerIdentity(NamedTuple):
+	"""ERPNext customer of an ecommerce customer, see `get_customer_identity`."""
+
+	customer: str
+	# latest address of every address type, {address_type: address}
+	addresses: Dict[str, _dict]
+
 
 class EcommerceCustomer:
+	# address fields fetched with customer identity, used for detecting changed addresses.
+	address_fields: Tuple[str, ...] = ()
+
 	def __init__(self, customer_id: str, customer_id_field: str, integration: str):
 		self.customer_id = customer_id
 		self.customer_id_field = customer_id_field
 		self.integration = integration
 
+	def get_identity(self) -> Optional[CustomerIdentity]:
+		return get_customer_identity(self.customer_id_field, self.customer_id, self.address_fields)
+
 	def is_synced(self) -> bool:
 		"""Check if customer on Ecommerce site is synced with ERPNext"""
 
-		return bool(frappe.db.exists("Customer", {self.customer_id_field: self.customer_id}))
+		return bool(self.get_identity())
+
+	def get_customer_name(self) -> Optional[str]:
+		identity = self.get_identity()
+		return identity.customer if identity else None
 
 	def get_customer_doc(self):
 		"""Get ERPNext customer document."""
-		if self.is_synced():
-			return frappe.get_last_doc("Customer", {self.customer_id_field: self.customer_id})
+		if customer := self.get_customer_name():
+			return frappe.get_doc("Customer", customer)
 		else:
 			raise frappe.DoesNotExistError()
 
@@ -39,39 +64,121 @@ class EcommerceCustomer:
 
 		customer.flags.ignore_mandatory = True
 		customer.insert(ignore_permissions=True)
+		clear_customer_identity(self.customer_id_field, self.customer_id)
+
+	def get_customer_address(self, address_type: str) -> Optional[_dict]:
+		"""Get latest address of type with `address_fields`, without loading the document."""
+		identity = self.get_identity()
+		if identity:
+			return identity.addresses.get(address_type)
 
 	def get_customer_address_doc(self, address_type: str):
-		try:
-			customer = self.get_customer_doc().name
-			addresses = frappe.get_all("Address", {"link_name": customer, "address_type": address_type})
-			if addresses:
-				address = frappe.get_last_doc("Address", {"name": addresses[0].name})
-				return address
-		except frappe.DoesNotExistError:
-			return None
+		if address := self.get_customer_address(address_type):
+			return frappe.get_doc("Address", address.name)
 
 	def create_customer_address(self, address: Dict[str, str]) -> None:
 		"""Create address from dictionary containing fields used in Address doctype of ERPNext."""
 
-		customer_doc = self.get_customer_doc()
+		customer = self.get_customer_doc().name
 
 		frappe.get_doc(
 			{
 				"doctype": "Address",
 				**address,
-				"links": [{"link_doctype": "Customer", "link_name": customer_doc.name}],
+				"links": [{"link_doctype": "Customer", "link_name": customer}],
 			}
 		).insert(ignore_mandatory=True)
+		clear_customer_identity(self.customer_id_field, self.customer_id)
+
+	def update_customer_address(self, address_type: str, values: Dict[str, Any]) -> bool:
+		"""Update latest address of type, address is saved only if any of the values changed.
+
+		Returns False if customer doesn't have an address of the type."""
+		address = self.get_customer_address(address_type)
+		if not address:
+			return False
+
+		if get_address_fingerprint(address, values) == get_address_fingerprint(values, values):
+			return True
+
+		address_doc = frappe.get_doc("Address", address.name)
+		address_doc.update(values)
+		address_doc.flags.ignore_mandatory = True
+		address_doc.save()
+		clear_customer_identity(self.customer_id_field, self.customer_id)
+		return True
 
 	def create_customer_contact(self, contact: Dict[str, str]) -> None:
 		"""Create contact from dictionary containing fields used in Address doctype of ERPNext."""
 
-		customer_doc = self.get_customer_doc()
+		customer = self.get_customer_doc().name
 
 		frappe.get_doc(
 			{
 				"doctype": "Contact",
 				**contact,
-				"links": [{"link_doctype": "Customer", "link_name": customer_doc.name}],
+				"links": [{"link_doctype": "Customer", "link_name": customer}],
 			}
 		).insert(ignore_mandatory=True)
+
+
+def get_customer_identity(
+	customer_id_field: str, customer_id: str, address_fields: Sequence[str] = ()
+) -> Optional[CustomerIdentity]:
+	"""Get ERPNext customer and its addresses with a single query.
+
+	Result is kept for the rest of the job, until `clear_customer_identity` is called
+	or work is rolled back."""
+	identities = frappe.flags.setdefault("ecommerce_customer_identities", {})
+	clear_on_rollback("ecommerce_customer_identities")
+	key = (customer_id_field, cstr(customer_id), tuple(address_fields))
+
+	if key not in identities:
+		identities[key] = _fetch_customer_identity(customer_id_field, customer_id, address_fields)
+	return identities[key]
+
+
+def clear_customer_identity(customer_id_field: str, customer_id: str) -> None:
+	identities = frappe.flags.ecommerce_customer_identities or {}
+	for key in list(identities):
+		if key[:2] == (customer_id_field, cstr(customer_id)):
+			del identities[key]
+
+
+def _fetch_customer_identity(
+	customer_id_field: str, customer_id: str, address_fields: Sequence[str]
+) -> Optional[CustomerIdentity]:
+	address_columns = "".join(
+		f", address.`{field}`" for field in address_fields if field not in ("name", "address_type")
+	)
+
+	rows = frappe.db.sql(
+		f"""
+			SELECT customer.name AS customer, address.name, address.address_type {address_columns}
+			FROM `tabCustomer` customer
+			LEFT JOIN `tabDynamic Link` link
+				ON link.parenttype = 'Address' AND link.link_doctype = 'Customer'
+				AND link.link_name = customer.name
+			LEFT JOIN `tabAddress` address ON address.name = link.parent
+			WHERE customer.`{customer_id_field}` = %s
+			ORDER BY customer.creation DESC, address.modified DESC
+		""",
+		(customer_id,),
+		as_dict=True,
+	)
+	if not rows:
+		return None
+
+	customer = rows[0].customer
+	addresses = {}
+	for row in rows:
+		if row.customer == customer and row.name and row.address_type not in addresses:
+			addresses[row.address_type] = row
+
+	return CustomerIdentity(customer, addresses)
+
+
+def get_address_fingerprint(address: Dict[str, Any], fields) -> str:
+	"""Hash of address values of fields, values are compared as strings."""
+	values = [cstr(address.get(field)) for field in sorted(fields)]
+	return hashlib.sha1(json.dumps(values).encode()).hexdigest()
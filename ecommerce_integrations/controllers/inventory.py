@@ -1,14 +1,20 @@
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 import frappe
 from frappe import _dict
-from frappe.utils import now,get_datetime, format_time, formatdate, getdate, nowdate
+from frappe.utils import cint, create_batch, now
 from frappe.utils.nestedset import get_descendants_of
 
-import erpnext
-from erpnext.stock.utils import (get_incoming_rate)
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_inventory_ledger.ecommerce_inventory_ledger import (
+	get_ledger_name,
+)
 
-def get_inventory_levels(warehouses: Tuple[str], integration: str) -> List[_dict]:
+LEDGER_DOCTYPE = "Ecommerce Inventory Ledger"
+
+
+def get_inventory_levels(
+	warehouses: Tuple[str], integration: str, include_cost: bool = False
+) -> List[_dict]:
 	"""
 	Get list of dict containing items for which the inventory needs to be updated on Integeration.
 
@@ -16,42 +22,65 @@ def get_inventory_levels(warehouses: Tuple[str], integration: str) -> List[_dict
 	so ensure that if you sync the inventory with integration, you have also
 	updated `inventory_synced_on` field in related Ecommerce Item.
 
-	returns: list of _dict containing ecom_item, item_code, integration_item_code, variant_id, actual_qty, warehouse, reserved_qty
+	If `include_cost` is set, cost is the rate at which whole stock of the item
+	would go out of the warehouse, i.e. stock value / qty of the Bin. This is
+	what `get_incoming_rate` returns for such outgoing entry with both moving
+	average and FIFO valuation, without a query per item. Otherwise cost is 0.
+
+	returns: list of _dict containing ecom_item, item_code, integration_item_code, variant_id, inventory_item_id, actual_qty, warehouse, reserved_qty, cost, last_synced_cost
 	"""
-	data = frappe.db.sql(
+	return _get_inventory_levels(
+		f"""bin.warehouse in ({', '.join('%s' for _ in warehouses)})
+			AND bin.modified > ei.inventory_synced_on""",
+		warehouses,
+		integration,
+		include_cost,
+	)
+
+
+def get_inventory_levels_of_items(
+	item_warehouses: List[Tuple[str, str]], integration: str, include_cost: bool = False
+) -> List[_dict]:
+	"""Get inventory levels of specified (item_code, warehouse) pairs, irrespective of last sync time.
+
+	Returned data is same as `get_inventory_levels`."""
+	data = []
+	for batch in create_batch(list(set(item_warehouses)), 500):
+		data.extend(
+			_get_inventory_levels(
+				f"(bin.item_code, bin.warehouse) in ({', '.join(['(%s, %s)'] * len(batch))})",
+				tuple(value for pair in batch for value in pair),
+				integration,
+				include_cost,
+			)
+		)
+	return data
+
+
+def _get_inventory_levels(condition: str, values: Tuple, integration: str, include_cost: bool):
+	cost = (
+		"""CASE
+				WHEN bin.valuation_rate <= 0 THEN 0
+				WHEN bin.actual_qty > 0 AND bin.stock_value > 0 THEN bin.stock_value / bin.actual_qty
+				ELSE bin.valuation_rate
+			END"""
+		if include_cost
+		else "0"
+	)
+
+	return frappe.db.sql(
 		f"""
-			SELECT ei.name as ecom_item,0 as cost, bin.item_code as item_code, integration_item_code, variant_id, actual_qty, warehouse, reserved_qty
+			SELECT ei.name as ecom_item, bin.item_code as item_code, integration_item_code, variant_id, inventory_item_id, actual_qty, warehouse, reserved_qty,
+			ei.last_synced_cost as last_synced_cost, {cost} as cost
 			FROM `tabEcommerce Item` ei
 				JOIN tabBin bin
 				ON ei.erpnext_item_code = bin.item_code
-			WHERE bin.warehouse in ({', '.join('%s' for _ in warehouses)})
-				AND bin.modified > ei.inventory_synced_on
+			WHERE {condition}
 				AND ei.integration = %s
 		""",
-		values=warehouses + (integration,),
+		values=values + (integration,),
 		as_dict=1,
 	)
-	
-	setting = frappe.get_doc('Shopify Setting')
-	times=get_datetime()
-	posting_time=times.strftime("%H:%M:%S")
-	posting_date=getdate(nowdate())
-	raise_error_if_no_rate=False
-	for dt in data:
-		cost=0
-		valrate=frappe.db.get_value('Stock Ledger Entry',{'item_code':dt.item_code,'warehouse':dt.warehouse,'docstatus':1},'valuation_rate') or 0
-		if valrate:
-			cost = get_incoming_rate({
-							"item_code": dt.item_code,
-							"warehouse": dt.warehouse,
-							"posting_date": posting_date,
-							"posting_time": posting_time,
-							"qty": -1 * dt.actual_qty,
-							'company':setting.company
-						},raise_error_if_no_rate) or valrate
-		dt.cost=cost or 0 
-		
-	return data
 
 
 def get_inventory_levels_of_group_warehouse(warehouse: str, integration: str):
@@ -68,6 +97,7 @@ def get_inventory_levels_of_group_warehouse(warehouse: str, integration: str):
 			SELECT ei.name as ecom_item, bin.item_code as item_code,
 				integration_item_code,
 				variant_id,
+				inventory_item_id,
 				sum(actual_qty) as actual_qty,
 				sum(reserved_qty) as reserved_qty,
 				max(bin.modified) as last_updated,
@@ -102,3 +132,85 @@ def update_inventory_sync_status(ecommerce_item, time=None):
 		time = now()
 
 	frappe.db.set_value("Ecommerce Item", ecommerce_item, "inventory_synced_on", time)
+
+
+def bulk_update_inventory_sync_status(ecommerce_items: List[str], time=None) -> None:
+	"""Update `inventory_synced_on` timestamp of multiple Ecommerce Items.
+
+	Same as `update_inventory_sync_status` but with one UPDATE statement per chunk of items."""
+	modified = now()
+	if time is None:
+		time = modified
+
+	for batch in create_batch(list(set(ecommerce_items)), 1000):
+		frappe.db.sql(
+			f"""
+				UPDATE `tabEcommerce Item`
+				SET inventory_synced_on = %s, modified = %s, modified_by = %s
+				WHERE name in ({', '.join(['%s'] * len(batch))})
+			""",
+			values=(time, modified, frappe.session.user, *batch),
+		)
+
+
+def filter_unchanged_inventory(
+	inventory_levels: List[_dict], warehouse_map: Dict[str, str]
+) -> Tuple[List[_dict], List[_dict]]:
+	"""Split inventory levels into (changed, unchanged) ones.
+
+	Bin is modified by reservations, reposts etc. without any change in quantity,
+	a level is unchanged if the same quantity was last pushed to the integration
+	warehouse (see `update_inventory_ledger`).
+
+	warehouse_map: ERPNext warehouse to integration warehouse mapping."""
+	names = [get_ledger_name(d.ecom_item, warehouse_map[d.warehouse]) for d in inventory_levels]
+
+	synced_qty = {}
+	for batch in create_batch(names, 1000):
+		synced_qty.update(
+			frappe.get_all(
+				LEDGER_DOCTYPE, filters={"name": ("in", batch)}, fields=["name", "qty"], as_list=True
+			)
+		)
+
+	changed, unchanged = [], []
+	for name, d in zip(names, inventory_levels):
+		if name in synced_qty and cint(synced_qty[name]) == cint(d.actual_qty):
+			unchanged.append(d)
+		else:
+			changed.append(d)
+
+	return changed, unchanged
+
+
+def update_inventory_ledger(
+	inventory_levels: List[_dict], integration: str, warehouse_map: Dict[str, str], time=None
+) -> None:
+	"""Record quantity pushed to integration for successfully synced inventory levels."""
+	if not inventory_levels:
+		return
+
+	if time is None:
+		time = now()
+
+	user = frappe.session.user
+	rows = []
+	for d in inventory_levels:
+		integration_warehouse = warehouse_map[d.warehouse]
+		name = get_ledger_name(d.ecom_item, integration_warehouse)
+		rows.append(
+			(name, time, time, user, user, d.ecom_item, integration, integration_warehouse, cint(d.actual_qty), time)
+		)
+
+	for batch in create_batch(rows, 500):
+		frappe.db.sql(
+			f"""
+				INSERT INTO `tab{LEDGER_DOCTYPE}`
+					(name, creation, modified, owner, modified_by,
+					ecommerce_item, integration, integration_warehouse, qty, synced_on)
+				VALUES {", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(batch))}
+				ON DUPLICATE KEY UPDATE
+					qty = VALUES(qty), synced_on = VALUES(synced_on), modified = VALUES(modified)
+			""",
+			values=[value for row in batch for value in row],
+		)
@@ -0,0 +1,54 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+
+from ecommerce_integrations.controllers.customer import EcommerceCustomer
+from ecommerce_integrations.shopify.constants import CUSTOMER_ID_FIELD, MODULE_NAME
+
+
+class TestEcommerceCustomer(unittest.TestCase):
+	def setUp(self):
+		frappe.flags.ecommerce_customer_identities = None
+		self.customer = EcommerceCustomer("_test_ecommerce_customer", CUSTOMER_ID_FIELD, MODULE_NAME)
+		self.customer.address_fields = ("address_line1", "city")
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_customer_identity(self):
+		self.assertFalse(self.customer.is_synced())
+
+		self.customer.sync_customer("Test Ecommerce Customer", "_Test Customer Group")
+		for address_type, city in (("Billing", "Mumbai"), ("Shipping", "Pune")):
+			self.customer.create_customer_address(
+				{"address_type": address_type, "address_line1": "Line 1", "city": city, "country": "India"}
+			)
+
+		with patch.object(frappe.db, "sql", wraps=frappe.db.sql) as sql:
+			identity = self.customer.get_identity()
+			self.assertEqual(identity.customer, self.customer.get_customer_name())
+			self.assertEqual(sql.call_count, 1)
+
+		self.assertEqual(identity.customer, self.customer.get_customer_doc().name)
+		self.assertEqual(identity.addresses["Billing"].city, "Mumbai")
+		self.assertEqual(identity.addresses["Shipping"].city, "Pune")
+
+	def test_skip_unchanged_address(self):
+		self.customer.sync_customer("Test Ecommerce Customer", "_Test Customer Group")
+		self.customer.create_customer_address(
+			{"address_type": "Billing", "address_line1": "Line 1", "city": "Mumbai", "country": "India"}
+		)
+
+		with patch("frappe.model.document.Document.save") as save:
+			self.assertTrue(
+				self.customer.update_customer_address("Billing", {"address_line1": "Line 1", "city": "Mumbai"})
+			)
+			save.assert_not_called()
+
+		self.customer.update_customer_address("Billing", {"address_line1": "Line 1", "city": "Delhi"})
+		self.assertEqual(self.customer.get_customer_address("Billing").city, "Delhi")
+		self.assertFalse(self.customer.update_customer_address("Shipping", {"city": "Delhi"}))
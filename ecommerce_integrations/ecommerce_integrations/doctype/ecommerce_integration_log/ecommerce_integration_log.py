@@ -1,20 +1,45 @@
 # Copyright (c) 2021, Frappe and contributors
 # For license information, please see LICENSE
 
+import base64
+import gzip
 import json
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
 
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.query_builder import Interval
-from frappe.query_builder.functions import Now
-from frappe.utils import strip_html
+from frappe.utils import add_days, cint, now_datetime, strip_html, today
 from frappe.utils.data import cstr
 
+# request and response payloads are stored compressed, marked by this prefix.
+COMPRESSED_PREFIX = "zlib:"
+# shorter payloads are stored as is, compressing them doesn't save much.
+COMPRESSION_THRESHOLD = 1024
+PAYLOAD_FIELDS = ("request_data", "response_data")
+
+# retention, see `clear_logs`
+RETENTION_CHUNK_SIZE = 5000
+# seconds to wait between deleting chunks, lets replicas and other writers catch up.
+RETENTION_PAUSE = 1
+# logs which weren't successful are kept for this many days, deleted only if archiving is enabled.
+DEFAULT_ARCHIVE_DAYS = 365
+
 
 class EcommerceIntegrationLog(Document):
+	def onload(self):
+		# payloads are decompressed only when log is opened
+		for field in PAYLOAD_FIELDS:
+			self.set(field, _format_payload(decompress_payload(self.get(field))))
+
 	def validate(self):
 		self._set_title()
+		for field in PAYLOAD_FIELDS:
+			self.set(field, compress_payload(self.get(field)))
 
 	def _set_title(self):
 		title = None
@@ -31,10 +56,91 @@ class EcommerceIntegrationLog(Document):
 
 	@staticmethod
 	def clear_old_logs(days=90):
-		table = frappe.qb.DocType("Ecommerce Integration Log")
-		frappe.db.delete(
-			table, filters=((table.modified < (Now() - Interval(days=days)))) & (table.status == "Success")
+		"""Called by Log Settings."""
+		clear_logs(days)
+
+
+def on_doctype_update():
+	# used by retention for finding old logs of a status
+	frappe.db.add_index("Ecommerce Integration Log", ["status", "modified"])
+
+
+def clear_logs(days: int = 90) -> None:
+	"""Delete successful logs older than `days` in chunks.
+
+	If `ecommerce_log_archive` is set in site config, deleted logs are first
+	archived to a gzipped JSONL file in private files and logs of other
+	statuses are deleted too, after `ecommerce_log_archive_days` (default 365)."""
+	archive = cint(frappe.conf.get("ecommerce_log_archive"))
+	archive_file = _get_archive_file() if archive else None
+
+	_clear_logs_of_status("Success", days, archive_file)
+
+	if archive:
+		archive_days = cint(frappe.conf.get("ecommerce_log_archive_days")) or DEFAULT_ARCHIVE_DAYS
+		statuses = frappe.db.sql_list("SELECT DISTINCT status FROM `tabEcommerce Integration Log`")
+		for status in statuses:
+			if status != "Success":
+				_clear_logs_of_status(status, archive_days, archive_file)
+
+	if archive_file and os.path.exists(archive_file):
+		_create_archive_file_doc(archive_file)
+		frappe.db.commit()
+
+
+def _clear_logs_of_status(status: Optional[str], days: int, archive_file: Optional[str]) -> None:
+	cutoff = add_days(now_datetime(), -days)
+
+	while True:
+		names = frappe.db.sql_list(
+			f"""
+				SELECT name FROM `tabEcommerce Integration Log`
+				WHERE status <=> %s AND modified < %s
+				ORDER BY modified
+				LIMIT {RETENTION_CHUNK_SIZE}
+			""",
+			(status, cutoff),
 		)
+		if not names:
+			break
+
+		if archive_file:
+			_archive_logs(names, archive_file)
+
+		frappe.db.delete("Ecommerce Integration Log", {"name": ("in", names)})
+		frappe.db.commit()
+
+		if len(names) < RETENTION_CHUNK_SIZE:
+			break
+		time.sleep(RETENTION_PAUSE)
+
+
+def _archive_logs(names: List[str], archive_file: str) -> None:
+	logs = frappe.get_all("Ecommerce Integration Log", filters={"name": ("in", names)}, fields=["*"])
+
+	# every chunk is a separate gzip member, concatenated members are a valid gzip file.
+	with gzip.open(archive_file, "at", encoding="utf-8") as f:
+		for log in logs:
+			for field in PAYLOAD_FIELDS:
+				log[field] = decompress_payload(log[field])
+			f.write(json.dumps(log, default=str) + "\n")
+
+
+def _get_archive_file() -> str:
+	file_name = f"ecommerce_integration_log_{today()}_{frappe.generate_hash(length=6)}.jsonl.gz"
+	return frappe.get_site_path("private", "files", file_name)
+
+
+def _create_archive_file_doc(archive_file: str) -> None:
+	file_name = os.path.basename(archive_file)
+	frappe.get_doc(
+		{
+			"doctype": "File",
+			"file_name": file_name,
+			"file_url": f"/private/files/{file_name}",
+			"is_private": 1,
+		}
+	).insert(ignore_permissions=True)
 
 
 def create_log(
@@ -50,20 +156,27 @@ def create_log(
 ):
 	make_new = make_new or not bool(frappe.flags.request_id)
 
+	# set when caller processes multiple jobs in one transaction, see shopify.order_queue
+	savepoint = frappe.flags.integration_log_savepoint
+	session = frappe.flags.integration_log_session
+
 	if rollback:
-		frappe.db.rollback()
+		_rollback(savepoint)
 
-	if make_new:
+	if session:
+		log = session.get_log(None if make_new else frappe.flags.request_id, module_def)
+	elif make_new:
 		log = frappe.get_doc({"doctype": "Ecommerce Integration Log", "integration": cstr(module_def)})
 		log.insert(ignore_permissions=True)
 	else:
 		log = frappe.get_doc("Ecommerce Integration Log", frappe.flags.request_id)
 
+	# stored compact, payloads are formatted when log is opened.
 	if response_data and not isinstance(response_data, str):
-		response_data = json.dumps(response_data, sort_keys=True, indent=4)
+		response_data = json.dumps(response_data, sort_keys=True)
 
 	if request_data and not isinstance(request_data, str):
-		request_data = json.dumps(request_data, sort_keys=True, indent=4)
+		request_data = json.dumps(request_data, sort_keys=True)
 
 	log.message = message or _get_message(exception)
 	log.method = log.method or method
@@ -71,13 +184,145 @@ def create_log(
 	log.request_data = request_data or log.request_data
 	log.traceback = log.traceback or frappe.get_traceback()
 	log.status = status
+
+	if session:
+		# written when session ends
+		return log
+
 	log.save(ignore_permissions=True)
 
-	frappe.db.commit()
+	if not savepoint:
+		frappe.db.commit()
 
 	return log
 
 
+class LogSession:
+	"""Logs changed during a unit of work, kept in memory until `flush`."""
+
+	def __init__(self):
+		self.logs: Dict[str, EcommerceIntegrationLog] = {}
+		self.new_logs: Set[str] = set()
+
+	def get_log(self, name: Optional[str] = None, module_def=None) -> EcommerceIntegrationLog:
+		"""Get log being changed, new log is created if name is not specified."""
+		if name in self.logs:
+			return self.logs[name]
+
+		if name:
+			log = frappe.get_doc("Ecommerce Integration Log", name)
+		else:
+			log = frappe.get_doc({"doctype": "Ecommerce Integration Log", "integration": cstr(module_def)})
+			# named upfront, so that callers can refer to log before it is inserted.
+			log.name = frappe.generate_hash(length=10)
+			self.new_logs.add(log.name)
+
+		self.logs[log.name] = log
+		return log
+
+	def flush(self) -> None:
+		for name, log in self.logs.items():
+			if name in self.new_logs:
+				log.insert(ignore_permissions=True, set_name=name)
+			else:
+				log.save(ignore_permissions=True)
+
+		self.logs.clear()
+		self.new_logs.clear()
+
+
+@contextmanager
+def log_session():
+	"""Buffer `create_log` calls of a unit of work, e.g. a webhook or an order.
+
+	Logs are written and committed together with the work once the block ends.
+	If block raises, the work is rolled back but logs are still written.
+	`rollback=True` in `create_log` rolls back the whole unit of work, so a
+	session should not span work which is committed independently."""
+	if frappe.flags.integration_log_session:
+		# nested session, outer session writes the logs
+		yield frappe.flags.integration_log_session
+		return
+
+	savepoint = frappe.flags.integration_log_savepoint
+	session = frappe.flags.integration_log_session = LogSession()
+	try:
+		yield session
+	except Exception:
+		_rollback(savepoint)
+		raise
+	finally:
+		frappe.flags.integration_log_session = None
+		session.flush()
+		if not savepoint:
+			frappe.db.commit()
+
+
+def set_savepoint(savepoint: str) -> None:
+	"""Create savepoint, commit callbacks registered after it are dropped if it's rolled back."""
+	frappe.db.savepoint(savepoint)
+	frappe.flags.integration_log_callbacks = [len(callbacks) for callbacks in _get_commit_callbacks()]
+
+
+def clear_on_rollback(flag: str) -> None:
+	"""Clear job level cache kept in `frappe.flags[flag]` whenever `create_log` or
+	`log_session` rolls back work, cached documents might not exist anymore."""
+	frappe.flags.setdefault("integration_log_rollback_caches", set()).add(flag)
+
+
+def _rollback(savepoint: Optional[str] = None) -> None:
+	frappe.db.rollback(save_point=savepoint)
+
+	for flag in frappe.flags.integration_log_rollback_caches or ():
+		frappe.flags.pop(flag, None)
+
+	if not savepoint:
+		return
+
+	# rolling back to a savepoint doesn't touch callbacks, work they refer to is gone though.
+	counts = frappe.flags.integration_log_callbacks or []
+	for callbacks, count in zip(_get_commit_callbacks(), counts):
+		while len(callbacks) > count:
+			callbacks.pop()
+
+
+def _get_commit_callbacks() -> list:
+	callbacks = [frappe.db.after_commit._functions]
+	# older frappe versions queue `enqueue_after_commit` jobs separately
+	if frappe.flags.enqueue_after_commit is not None:
+		callbacks.append(frappe.flags.enqueue_after_commit)
+	return callbacks
+
+
+def compress_payload(data: Optional[str]) -> Optional[str]:
+	"""Compress payload for storage, short or already compressed payloads are returned as is."""
+	if not data or len(data) < COMPRESSION_THRESHOLD or data.startswith(COMPRESSED_PREFIX):
+		return data
+
+	compressed = zlib.compress(data.encode(), level=1)
+	return COMPRESSED_PREFIX + base64.b64encode(compressed).decode()
+
+
+def decompress_payload(data: Optional[str]) -> Optional[str]:
+	if not data or not data.startswith(COMPRESSED_PREFIX):
+		return data
+
+	compressed = base64.b64decode(data[len(COMPRESSED_PREFIX) :])
+	return zlib.decompress(compressed).decode()
+
+
+def get_request_data(log_name: str) -> Optional[str]:
+	"""Get decompressed request data of log without loading the document."""
+	return decompress_payload(frappe.db.get_value("Ecommerce Integration Log", log_name, "request_data"))
+
+
+def _format_payload(data: Optional[str]) -> Optional[str]:
+	try:
+		return json.dumps(json.loads(data), sort_keys=True, indent=4)
+	except (TypeError, ValueError):
+		return data
+
+
 def _get_message(exception):
 	if hasattr(exception, "message"):
 		return strip_html(exception.message)
@@ -107,7 +352,7 @@ def _retry_job(job: str):
 		queue="short",
 		timeout=300,
 		is_async=True,
-		payload=json.loads(doc.request_data),
+		payload=json.loads(decompress_payload(doc.request_data)),
 		request_id=doc.name,
 		enqueue_after_commit=True,
 	)
@@ -1,9 +1,114 @@
 # Copyright (c) 2021, Frappe and Contributors
 # See LICENSE
 
-# import frappe
+import gzip
+import json
 import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import add_days, now_datetime
+
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_integration_log import (
+	ecommerce_integration_log,
+)
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_integration_log.ecommerce_integration_log import (
+	COMPRESSED_PREFIX,
+	clear_logs,
+	clear_on_rollback,
+	create_log,
+	get_request_data,
+	log_session,
+	set_savepoint,
+)
 
 
 class TestEcommerceIntegrationLog(unittest.TestCase):
-	pass
+	def test_compressed_payload(self):
+		payload = {"line_items": [{"id": i, "title": f"Item {i}"} for i in range(100)]}
+
+		log = create_log(status="Error", request_data=payload, make_new=True)
+
+		stored = frappe.db.get_value("Ecommerce Integration Log", log.name, "request_data")
+		self.assertTrue(stored.startswith(COMPRESSED_PREFIX))
+		self.assertLess(len(stored), len(json.dumps(payload)))
+		self.assertEqual(json.loads(get_request_data(log.name)), payload)
+
+		# form shows formatted payload
+		doc = frappe.get_doc("Ecommerce Integration Log", log.name)
+		doc.run_method("onload")
+		self.assertEqual(doc.request_data, json.dumps(payload, sort_keys=True, indent=4))
+
+	def test_short_payload_is_not_compressed(self):
+		log = create_log(status="Error", request_data={"id": 1}, make_new=True)
+		self.assertEqual(get_request_data(log.name), '{"id": 1}')
+
+	def test_log_session(self):
+		with log_session():
+			log = create_log(status="Queued", make_new=True)
+			frappe.flags.request_id = log.name
+			create_log(status="Error", message="failed")
+			create_log(status="Success")
+			frappe.flags.request_id = None
+
+			self.assertFalse(frappe.db.exists("Ecommerce Integration Log", log.name))
+
+		self.assertEqual(frappe.db.get_value("Ecommerce Integration Log", log.name, "status"), "Success")
+
+	def test_log_session_written_on_error(self):
+		with self.assertRaises(ZeroDivisionError):
+			with log_session():
+				log = create_log(status="Queued", make_new=True)
+				1 / 0
+
+		self.assertEqual(frappe.db.get_value("Ecommerce Integration Log", log.name, "status"), "Queued")
+
+	def test_rollback_drops_commit_callbacks_of_savepoint(self):
+		def callback():
+			pass
+
+		frappe.db.after_commit.add(callback)
+		frappe.flags.integration_log_savepoint = "_test_log_savepoint"
+		self.addCleanup(setattr, frappe.flags, "integration_log_savepoint", None)
+
+		set_savepoint("_test_log_savepoint")
+		frappe.db.after_commit.add(lambda: frappe.throw("Callback of rolled back work"))
+		create_log(status="Error", rollback=True, make_new=True)
+
+		self.assertEqual(frappe.db.after_commit._functions[-1], callback)
+		frappe.db.after_commit.reset()
+
+	def test_rollback_clears_job_caches(self):
+		frappe.flags.integration_log_savepoint = "_test_log_savepoint"
+		self.addCleanup(setattr, frappe.flags, "integration_log_savepoint", None)
+		set_savepoint("_test_log_savepoint")
+
+		frappe.flags._test_integration_cache = {"customer": "_Test Customer"}
+		clear_on_rollback("_test_integration_cache")
+		create_log(status="Error", rollback=True, make_new=True)
+
+		self.assertIsNone(frappe.flags._test_integration_cache)
+
+	@patch.object(ecommerce_integration_log, "RETENTION_CHUNK_SIZE", 2)
+	@patch.object(ecommerce_integration_log, "RETENTION_PAUSE", 0)
+	def test_clear_logs_with_archive(self):
+		logs = {
+			(status, age): create_log(status=status, request_data={"age": age}, make_new=True).name
+			for status in ("Success", "Error")
+			for age in (10, 100, 400)
+		}
+		for (_status, age), name in logs.items():
+			frappe.db.set_value(
+				"Ecommerce Integration Log", name, "modified", add_days(now_datetime(), -age), update_modified=False
+			)
+
+		with patch.dict(frappe.conf, {"ecommerce_log_archive": 1}):
+			clear_logs(days=90)
+
+		remaining = {key for key, name in logs.items() if frappe.db.exists("Ecommerce Integration Log", name)}
+		self.assertEqual(remaining, {("Success", 10), ("Error", 10), ("Error", 100)})
+
+		archive = frappe.get_last_doc("File", {"file_name": ("like", "ecommerce_integration_log_%")})
+		with gzip.open(archive.get_full_path(), "rt") as f:
+			archived = {json.loads(line)["name"] for line in f}
+		self.assertEqual(archived, {logs[("Success", 100)], logs[("Success", 400)], logs[("Error", 400)]})
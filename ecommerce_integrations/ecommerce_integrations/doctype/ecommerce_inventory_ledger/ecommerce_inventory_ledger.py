@@ -0,0 +1,21 @@
+# Copyright (c) 2026, Frappe and contributors
+# For license information, please see LICENSE
+
+from frappe.model.document import Document
+
+
+class EcommerceInventoryLedger(Document):
+	"""Quantity of an Ecommerce Item last pushed to a warehouse of integration."""
+
+	ecommerce_item: str
+	integration: str
+	integration_warehouse: str
+	qty: float
+	synced_on: str
+
+	def autoname(self):
+		self.name = get_ledger_name(self.ecommerce_item, self.integration_warehouse)
+
+
+def get_ledger_name(ecommerce_item: str, integration_warehouse: str) -> str:
+	return f"{ecommerce_item}:{integration_warehouse}"
@@ -18,6 +18,8 @@ class EcommerceItem(Document):
 	has_variants: int  # is the product a template, i.e. does it have varients
 	variant_of: str  # template id of ERPNext item
 	sku: str  # SKU
+	inventory_item_id: str  # id used for inventory updates, if different from variant_id
+	last_synced_cost: float  # cost last pushed to integration
 
 	def validate(self):
 		self.set_defaults()
@@ -25,6 +27,9 @@ class EcommerceItem(Document):
 	def before_insert(self):
 		self.check_unique_constraints()
 
+	def on_trash(self):
+		frappe.db.delete("Ecommerce Inventory Ledger", {"ecommerce_item": self.name})
+
 	def check_unique_constraints(self) -> None:
 		filters = []
 
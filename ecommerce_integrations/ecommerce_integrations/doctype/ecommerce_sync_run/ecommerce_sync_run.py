@@ -0,0 +1,99 @@
+# Copyright (c) 2026, Frappe and contributors
+# For license information, please see LICENSE
+
+import json
+from typing import Any, Optional
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, cint, flt, get_datetime, now, time_diff_in_seconds
+
+# a running run without checkpoint for this long is considered dead and can be resumed.
+STALE_AFTER = 15 * 60
+
+
+class EcommerceSyncRun(Document):
+	"""Persistent progress of a long running sync, used to resume it after interruption."""
+
+	integration: str
+	sync_type: str
+	status: str
+	total_rows: int
+	rows_done: int
+	cursor: str
+
+	def get_data(self) -> Any:
+		return json.loads(self.run_data) if self.run_data else None
+
+	def is_interrupted(self) -> bool:
+		"""Check if run failed or stopped making progress, i.e. it should be resumed."""
+		if self.status == "Failed":
+			return True
+
+		last_activity = self.last_checkpoint_on or self.started_on
+		return get_datetime(last_activity) < get_datetime(add_to_date(now(), seconds=-STALE_AFTER))
+
+	def checkpoint(self, rows_done: int = 0, cursor=None, data=None) -> None:
+		"""Record progress, caller is expected to commit it together with the work done."""
+		timestamp = now()
+		self.rows_done = cint(self.rows_done) + rows_done
+		values = {
+			"rows_done": self.rows_done,
+			"rows_remaining": max(cint(self.total_rows) - self.rows_done, 0),
+			"rate": self._get_rate(timestamp),
+			"last_checkpoint_on": timestamp,
+		}
+		if cursor is not None:
+			values["cursor"] = str(cursor)
+		if data is not None:
+			values["run_data"] = json.dumps(data)
+
+		self.db_set(values)
+
+	def complete(self) -> None:
+		self.db_set(
+			{"status": "Completed", "completed_on": now(), "rows_remaining": 0, "run_data": None},
+			commit=True,
+		)
+
+	def fail(self, exception: Exception) -> None:
+		self.db_set(
+			{"status": "Failed", "error": frappe.get_traceback() or str(exception)}, commit=True
+		)
+
+	def _get_rate(self, timestamp) -> float:
+		minutes = time_diff_in_seconds(timestamp, self.started_on) / 60
+		return flt(self.rows_done / minutes, 2) if minutes > 0 else 0
+
+
+def start_sync_run(
+	integration: str, sync_type: str, total_rows: int = 0, data=None, cursor=None, rows_done: int = 0
+) -> EcommerceSyncRun:
+	run = frappe.get_doc(
+		{
+			"doctype": "Ecommerce Sync Run",
+			"integration": integration,
+			"sync_type": sync_type,
+			"status": "Running",
+			"started_on": now(),
+			"total_rows": total_rows,
+			"rows_done": rows_done,
+			"rows_remaining": max(total_rows - rows_done, 0),
+			"cursor": None if cursor is None else str(cursor),
+			"run_data": None if data is None else json.dumps(data),
+		}
+	).insert(ignore_permissions=True)
+	frappe.db.commit()
+	return run
+
+
+def get_unfinished_sync_run(integration: str, sync_type: str) -> Optional[EcommerceSyncRun]:
+	"""Get latest run if it is either still running or was interrupted."""
+	name, status = frappe.db.get_value(
+		"Ecommerce Sync Run",
+		{"integration": integration, "sync_type": sync_type},
+		["name", "status"],
+		order_by="creation desc",
+	) or (None, None)
+	if name and status != "Completed":
+		return frappe.get_doc("Ecommerce Sync Run", name)
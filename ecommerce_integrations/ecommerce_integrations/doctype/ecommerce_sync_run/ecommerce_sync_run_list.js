@@ -0,0 +1,12 @@
+frappe.listview_settings["Ecommerce Sync Run"] = {
+	add_fields: ["status"],
+	get_indicator: function (doc) {
+		if (doc.status === "Completed") {
+			return [__("Completed"), "green", "status,=,Completed"];
+		} else if (doc.status === "Failed") {
+			return [__("Failed"), "red", "status,=,Failed"];
+		} else if (doc.status === "Running") {
+			return [__("Running"), "orange", "status,=,Running"];
+		}
+	},
+};
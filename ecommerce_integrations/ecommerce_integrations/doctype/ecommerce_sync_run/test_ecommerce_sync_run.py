@@ -0,0 +1,37 @@
+# Copyright (c) 2026, Frappe and Contributors
+# See LICENSE
+
+import unittest
+
+import frappe
+
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_sync_run.ecommerce_sync_run import (
+	get_unfinished_sync_run,
+	start_sync_run,
+)
+
+SYNC_TYPE = "_Test Sync"
+
+
+class TestEcommerceSyncRun(unittest.TestCase):
+	def tearDown(self):
+		frappe.db.delete("Ecommerce Sync Run", {"sync_type": SYNC_TYPE})
+
+	def test_resume_interrupted_run(self):
+		run = start_sync_run("shopify", SYNC_TYPE, total_rows=4, data=["a", "b", "c", "d"], cursor=0)
+		run.checkpoint(rows_done=2, cursor=2)
+
+		# still running
+		resumed = get_unfinished_sync_run("shopify", SYNC_TYPE)
+		self.assertEqual(resumed.name, run.name)
+		self.assertFalse(resumed.is_interrupted())
+
+		run.fail(Exception("worker timeout"))
+
+		resumed = get_unfinished_sync_run("shopify", SYNC_TYPE)
+		self.assertTrue(resumed.is_interrupted())
+		self.assertEqual(resumed.rows_remaining, 2)
+		self.assertEqual(resumed.get_data()[int(resumed.cursor) :], ["c", "d"])
+
+		resumed.complete()
+		self.assertIsNone(get_unfinished_sync_run("shopify", SYNC_TYPE))
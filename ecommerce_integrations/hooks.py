@@ -105,6 +105,17 @@ before_uninstall = "ecommerce_integrations.uninstall.before_uninstall"
 # ---------------
 # Hook on document methods and events
 
+# keeps Shopify Order Link in sync with documents created for Shopify orders
+_order_link_hook = (
+	"ecommerce_integrations.shopify.doctype.shopify_order_link.shopify_order_link.update_order_link"
+)
+_order_link_events = {
+	"on_update": _order_link_hook,
+	"on_submit": _order_link_hook,
+	"on_cancel": _order_link_hook,
+	"on_trash": _order_link_hook,
+}
+
 doc_events = {
 	"Item": {
 		"after_insert": "ecommerce_integrations.shopify.product.upload_erpnext_item",
@@ -115,19 +126,30 @@ doc_events = {
 		],
 	},
 	"Sales Order": {
+		**_order_link_events,
 		"on_update_after_submit": "ecommerce_integrations.unicommerce.order.update_shipping_info",
-		"on_cancel": "ecommerce_integrations.unicommerce.status_updater.ignore_pick_list_on_sales_order_cancel",
+		"on_cancel": [
+			"ecommerce_integrations.unicommerce.status_updater.ignore_pick_list_on_sales_order_cancel",
+			_order_link_hook,
+		],
 	},
+	"Delivery Note": _order_link_events,
+	"Payment Entry": _order_link_events,
 	"Stock Entry": {
 		"validate": "ecommerce_integrations.unicommerce.grn.validate_stock_entry_for_grn",
 		"on_submit": "ecommerce_integrations.unicommerce.grn.upload_grn",
 		"on_cancel": "ecommerce_integrations.unicommerce.grn.prevent_grn_cancel",
 	},
+	"Stock Ledger Entry": {
+		"on_submit": "ecommerce_integrations.shopify.inventory_queue.mark_inventory_dirty",
+		"on_cancel": "ecommerce_integrations.shopify.inventory_queue.mark_inventory_dirty",
+	},
 	"Item Price": {"on_change": "ecommerce_integrations.utils.price_list.discard_item_prices"},
 	"Pick List": {"validate": "ecommerce_integrations.unicommerce.pick_list.validate"},
 	"Sales Invoice": {
-		"on_submit": "ecommerce_integrations.unicommerce.invoice.on_submit",
-		"on_cancel": "ecommerce_integrations.unicommerce.invoice.on_cancel",
+		**_order_link_events,
+		"on_submit": ["ecommerce_integrations.unicommerce.invoice.on_submit", _order_link_hook],
+		"on_cancel": ["ecommerce_integrations.unicommerce.invoice.on_cancel", _order_link_hook],
 	},
 }
 
@@ -142,6 +164,8 @@ scheduler_events = {
 	],
 	"hourly": [
 		"ecommerce_integrations.shopify.order.sync_old_orders",
+		"ecommerce_integrations.shopify.order_queue.process_parked_orders",
+		"ecommerce_integrations.shopify.order_queue.requeue_stale_events",
 		"ecommerce_integrations.amazon.doctype.amazon_sp_api_settings.amazon_sp_api_settings.schedule_get_order_details",
 	],
 	"hourly_long": [
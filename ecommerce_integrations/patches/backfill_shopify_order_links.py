@@ -0,0 +1,47 @@
+import frappe
+
+from ecommerce_integrations.shopify.constants import FULLFILLMENT_ID_FIELD, ORDER_ID_FIELD
+
+LINK_DOCTYPE = "Shopify Order Link"
+
+
+def execute():
+	"""Create Shopify Order Link for documents created before link was maintained by hooks."""
+	frappe.reload_doc("shopify", "doctype", "shopify_order_link")
+
+	for doctype in ("Sales Order", "Sales Invoice", "Delivery Note"):
+		if not frappe.db.has_column(doctype, ORDER_ID_FIELD):
+			continue
+
+		is_return = "is_return" if frappe.db.has_column(doctype, "is_return") else "0"
+		fulfillment_id = (
+			f"`{FULLFILLMENT_ID_FIELD}`" if frappe.db.has_column(doctype, FULLFILLMENT_ID_FIELD) else "NULL"
+		)
+
+		frappe.db.sql(
+			f"""
+				INSERT IGNORE INTO `tab{LINK_DOCTYPE}`
+					(name, creation, modified, owner, modified_by, shopify_order_id,
+					link_doctype, link_name, link_docstatus, is_return, fulfillment_id)
+				SELECT CONCAT(%(doctype)s, ':', name), creation, modified, owner, modified_by,
+					`{ORDER_ID_FIELD}`, %(doctype)s, name, docstatus, {is_return}, {fulfillment_id}
+				FROM `tab{doctype}`
+				WHERE `{ORDER_ID_FIELD}` IS NOT NULL AND `{ORDER_ID_FIELD}` != ''
+			""",
+			{"doctype": doctype},
+		)
+
+	# payment entries against invoices of Shopify orders
+	frappe.db.sql(
+		f"""
+			INSERT IGNORE INTO `tab{LINK_DOCTYPE}`
+				(name, creation, modified, owner, modified_by, shopify_order_id,
+				link_doctype, link_name, link_docstatus, is_return, against_name)
+			SELECT CONCAT('Payment Entry:', pe.name), pe.creation, pe.modified, pe.owner, pe.modified_by,
+				link.shopify_order_id, 'Payment Entry', pe.name, pe.docstatus, 0, ref.reference_name
+			FROM `tabPayment Entry Reference` ref
+				JOIN `tabPayment Entry` pe ON pe.name = ref.parent
+				JOIN `tab{LINK_DOCTYPE}` link ON link.name = CONCAT('Sales Invoice:', ref.reference_name)
+			WHERE ref.reference_doctype = 'Sales Invoice'
+		"""
+	)
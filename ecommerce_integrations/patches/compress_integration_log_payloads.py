@@ -0,0 +1,48 @@
+import frappe
+
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_integration_log.ecommerce_integration_log import (
+	COMPRESSED_PREFIX,
+	COMPRESSION_THRESHOLD,
+	PAYLOAD_FIELDS,
+	compress_payload,
+)
+
+BATCH_SIZE = 1000
+
+
+def execute():
+	"""Compress request and response data of existing logs, in batches ordered by name."""
+	last_name = ""
+
+	while True:
+		logs = frappe.db.sql(
+			f"""
+				SELECT name, request_data, response_data
+				FROM `tabEcommerce Integration Log`
+				WHERE name > %(last_name)s
+				ORDER BY name
+				LIMIT {BATCH_SIZE}
+			""",
+			{"last_name": last_name},
+			as_dict=True,
+		)
+		if not logs:
+			break
+
+		updates = {}
+		for log in logs:
+			values = {
+				field: compress_payload(log[field])
+				for field in PAYLOAD_FIELDS
+				if log[field]
+				and len(log[field]) >= COMPRESSION_THRESHOLD
+				and not log[field].startswith(COMPRESSED_PREFIX)
+			}
+			if values:
+				updates[log.name] = values
+
+		if updates:
+			frappe.db.bulk_update("Ecommerce Integration Log", updates, update_modified=False)
+		frappe.db.commit()
+
+		last_name = logs[-1].name
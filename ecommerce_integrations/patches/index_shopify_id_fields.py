@@ -0,0 +1,79 @@
+import frappe
+
+from ecommerce_integrations.shopify.constants import (
+	CUSTOMER_ID_FIELD,
+	FULLFILLMENT_ID_FIELD,
+	ORDER_ID_FIELD,
+	ORDER_NUMBER_FIELD,
+)
+
+# fields used for looking up documents by Shopify ids
+ID_FIELDS = {
+	"Sales Order": (ORDER_ID_FIELD, ORDER_NUMBER_FIELD),
+	"Sales Invoice": (ORDER_ID_FIELD, ORDER_NUMBER_FIELD),
+	"Delivery Note": (ORDER_ID_FIELD, ORDER_NUMBER_FIELD, FULLFILLMENT_ID_FIELD),
+	"Customer": (CUSTOMER_ID_FIELD,),
+}
+
+VARCHAR_LENGTH = 140
+# MariaDB: "LOCK=NONE is not supported for this operation"
+ER_ALTER_OPERATION_NOT_SUPPORTED_REASON = 1846
+
+
+def execute():
+	"""Convert Shopify id fields from Small Text to indexed Data columns.
+
+	ALTERs are done here instead of through Custom Field, so that they can be
+	run without locking the tables for writes where database supports it."""
+	for doctype, fieldnames in ID_FIELDS.items():
+		for fieldname in fieldnames:
+			if not frappe.db.has_column(doctype, fieldname):
+				continue
+
+			if not _convert_to_varchar(doctype, fieldname):
+				continue
+
+			_add_index(doctype, fieldname)
+			frappe.db.set_value(
+				"Custom Field",
+				{"dt": doctype, "fieldname": fieldname},
+				{"fieldtype": "Data", "search_index": 1},
+				update_modified=False,
+			)
+			frappe.clear_cache(doctype=doctype)
+
+
+def _convert_to_varchar(doctype, fieldname) -> bool:
+	table = f"tab{doctype}"
+	data_type = frappe.db.sql(
+		"""select data_type from information_schema.columns
+		where table_schema = database() and table_name = %s and column_name = %s""",
+		(table, fieldname),
+	)[0][0]
+	if data_type.lower() == "varchar":
+		return True
+
+	max_length = frappe.db.sql(f"select max(char_length(`{fieldname}`)) from `{table}`")[0][0]
+	if (max_length or 0) > VARCHAR_LENGTH:
+		print(f"Skipping {doctype}.{fieldname}, values are longer than {VARCHAR_LENGTH} characters.")
+		return False
+
+	_alter_online(table, f"MODIFY COLUMN `{fieldname}` varchar({VARCHAR_LENGTH})")
+	return True
+
+
+def _add_index(doctype, fieldname) -> None:
+	if frappe.db.get_column_index(f"tab{doctype}", fieldname, unique=False):
+		return
+
+	_alter_online(f"tab{doctype}", f"ADD INDEX `{fieldname}_index`(`{fieldname}`)")
+
+
+def _alter_online(table, alter) -> None:
+	"""Run ALTER without blocking writes if possible, otherwise blocking only writes."""
+	try:
+		frappe.db.sql_ddl(f"ALTER TABLE `{table}` {alter}, LOCK=NONE")
+	except Exception as e:
+		if not e.args or e.args[0] != ER_ALTER_OPERATION_NOT_SUPPORTED_REASON:
+			raise
+		frappe.db.sql_ddl(f"ALTER TABLE `{table}` {alter}, LOCK=SHARED")
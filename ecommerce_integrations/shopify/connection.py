@@ -10,13 +10,20 @@ from frappe import _
 from shopify.resources import Webhook
 from shopify.session import Session
 
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_integration_log.ecommerce_integration_log import (
+	decompress_payload,
+	log_session,
+)
 from ecommerce_integrations.shopify.constants import (
 	API_VERSION,
+	DUPLICATE_WEBHOOK_COUNTER,
 	EVENT_MAPPER,
+	MODULE_NAME,
 	SETTING_DOCTYPE,
 	WEBHOOK_EVENTS,
+	WEBHOOK_ID_TTL,
 )
-from ecommerce_integrations.shopify.utils import create_shopify_log
+from ecommerce_integrations.shopify.utils import create_shopify_log, get_worker_cached
 
 
 def temp_shopify_session(func):
@@ -29,16 +36,28 @@ def temp_shopify_session(func):
 		if frappe.flags.in_test:
 			return func(*args, **kwargs)
 
-		setting = frappe.get_doc(SETTING_DOCTYPE)
-		if setting.is_enabled():
-			auth_details = (setting.shopify_url, API_VERSION, setting.get_password("password"))
+		# nested call, session is already active
+		if frappe.flags.in_shopify_session:
+			return func(*args, **kwargs)
 
-			with Session.temp(*auth_details):
-				return func(*args, **kwargs)
+		auth_details = get_worker_cached("session", _get_session_details)
+		if auth_details:
+			frappe.flags.in_shopify_session = True
+			try:
+				with Session.temp(*auth_details):
+					return func(*args, **kwargs)
+			finally:
+				frappe.flags.in_shopify_session = False
 
 	return wrapper
 
 
+def _get_session_details():
+	setting = frappe.get_doc(SETTING_DOCTYPE)
+	if setting.is_enabled():
+		return (setting.shopify_url, API_VERSION, setting.get_password("password"))
+
+
 def register_webhooks(shopify_url: str, password: str) -> List[Webhook]:
 	"""Register required webhooks with shopify and return registered webhooks."""
 	new_webhooks = []
@@ -99,33 +118,110 @@ def store_request_data() -> None:
 
 		_validate_request(frappe.request, hmac_header)
 
-		data = json.loads(frappe.request.data)
+		webhook_id = frappe.get_request_header("X-Shopify-Webhook-Id")
+		if _is_duplicate_webhook(webhook_id):
+			return
+
 		event = frappe.request.headers.get("X-Shopify-Topic")
 
-		process_request(data, event)
+		try:
+			process_request(frappe.request.data, event)
+		except Exception:
+			# let shopify retry this delivery
+			_forget_webhook(webhook_id)
+			raise
 
 
 def process_request(data, event):
+	"""Store webhook body as received and enqueue the background job.
+
+	This runs while Shopify waits for a response, so the body is stored
+	(compressed) in a single insert. Formatting is done when log is opened."""
+	# local import to avoid circular dependencies
+	from ecommerce_integrations.shopify import order_queue
+
+	if not isinstance(data, (str, bytes)):
+		data = json.dumps(data)
+
+	log = frappe.get_doc(
+		{
+			"doctype": "Ecommerce Integration Log",
+			"integration": MODULE_NAME,
+			"status": "Queued",
+			"method": EVENT_MAPPER[event],
+			"request_data": frappe.safe_decode(data),
+		}
+	)
+	log.insert(ignore_permissions=True)
 
-	# create log
-	log = create_shopify_log(method=EVENT_MAPPER[event], request_data=data)
+	order_id = order_queue.get_order_id(json.loads(data), event)
+	if order_id:
+		# events of same order are processed sequentially, see `order_queue`
+		frappe.db.after_commit.add(lambda: order_queue.push_event(order_id, event, log.name))
+		return
 
 	# enqueue backround job
 	frappe.enqueue(
-		method=EVENT_MAPPER[event],
+		method="ecommerce_integrations.shopify.connection.process_queued_request",
 		queue="short",
 		timeout=300,
 		is_async=True,
-		**{"payload": data, "request_id": log.name},
+		enqueue_after_commit=True,
+		**{"request_id": log.name},
 	)
 
 
+def process_queued_request(request_id):
+	"""Background job: parse stored webhook body and call the mapped event handler."""
+	log = frappe.db.get_value(
+		"Ecommerce Integration Log", request_id, ["method", "request_data"], as_dict=True
+	)
+	payload = json.loads(decompress_payload(log.request_data))
+
+	# log changes of the handler are written once, together with its work
+	with log_session():
+		frappe.get_attr(log.method)(payload, request_id=request_id)
+
+
+def _is_duplicate_webhook(webhook_id) -> bool:
+	"""Shopify delivers webhooks at least once, check and remember seen webhook ids.
+
+	Duplicates are counted and dropped before any log or job is created."""
+	if not webhook_id:
+		return False
+
+	cache = frappe.cache()
+	is_new = cache.set(_get_webhook_key(webhook_id), 1, nx=True, ex=WEBHOOK_ID_TTL)
+	if is_new:
+		return False
+
+	cache.incr(cache.make_key(DUPLICATE_WEBHOOK_COUNTER))
+	return True
+
+
+def _forget_webhook(webhook_id) -> None:
+	if webhook_id:
+		frappe.cache().delete(_get_webhook_key(webhook_id))
+
+
+def _get_webhook_key(webhook_id) -> str:
+	return frappe.cache().make_key(f"shopify_webhook_id:{webhook_id}")
+
+
+@frappe.whitelist()
+def get_duplicate_webhook_count() -> int:
+	"""Number of duplicate webhook deliveries dropped so far."""
+	frappe.only_for("System Manager")
+
+	cache = frappe.cache()
+	return int(cache.get(cache.make_key(DUPLICATE_WEBHOOK_COUNTER)) or 0)
+
+
 def _validate_request(req, hmac_header):
-	settings = frappe.get_doc(SETTING_DOCTYPE)
-	secret_key = settings.shared_secret
+	secret_key = frappe.db.get_single_value(SETTING_DOCTYPE, "shared_secret", cache=True)
 
 	sig = base64.b64encode(hmac.new(secret_key.encode("utf8"), req.data, hashlib.sha256).digest())
 
-	if sig != bytes(hmac_header.encode()):
-		create_shopify_log(status="Error", request_data=req.data)
+	if not hmac_header or not hmac.compare_digest(sig, hmac_header.encode()):
+		create_shopify_log(status="Error", request_data=frappe.safe_decode(req.data))
 		frappe.throw(_("Unverified Webhook Data"))
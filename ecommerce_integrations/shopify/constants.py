@@ -7,6 +7,8 @@ SETTING_DOCTYPE = "Shopify Setting"
 OLD_SETTINGS_DOCTYPE = "Shopify Settings"
 
 API_VERSION = "2023-04"
+# bulk inventory push uses `inventorySetQuantities` mutation which is not available in API_VERSION
+GRAPHQL_API_VERSION = "2024-04"
 
 WEBHOOK_EVENTS = [
 	"orders/create",
@@ -28,6 +30,13 @@ EVENT_MAPPER = {
 	"orders/updated": "ecommerce_integrations.shopify.order.order_update",
 }
 
+# changes whenever Shopify Setting is saved, used to invalidate worker level caches.
+SETTING_VERSION_KEY = "shopify_setting_version"
+
+# Shopify retries failed webhook deliveries for 48 hours.
+WEBHOOK_ID_TTL = 48 * 60 * 60
+DUPLICATE_WEBHOOK_COUNTER = "shopify_duplicate_webhooks"
+
 SHOPIFY_VARIANTS_ATTR_LIST = ["option1", "option2", "option3"]
 
 # custom fields
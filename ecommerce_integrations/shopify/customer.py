@@ -14,8 +14,23 @@ from ecommerce_integrations.shopify.constants import (
 
 
 class ShopifyCustomer(EcommerceCustomer):
+	# fields set by `_map_address_fields`
+	address_fields = (
+		"address_title",
+		"address_type",
+		ADDRESS_ID_FIELD,
+		"address_line1",
+		"address_line2",
+		"city",
+		"state",
+		"pincode",
+		"country",
+		"email_id",
+		"phone",
+	)
+
 	def __init__(self, customer_id: str):
-		self.setting = frappe.get_doc(SETTING_DOCTYPE)
+		self.setting = frappe.get_cached_doc(SETTING_DOCTYPE)
 		super().__init__(customer_id, CUSTOMER_ID_FIELD, MODULE_NAME)
 
 	def sync_customer(self, customer: Dict[str, Any]) -> None:
@@ -72,17 +87,13 @@ class ShopifyCustomer(EcommerceCustomer):
 		address_type: str = "Billing",
 		email: Optional[str] = None,
 	) -> None:
-		old_address = self.get_customer_address_doc(address_type)
+		exclude_in_update = ["address_title", "address_type"]
+		new_values = _map_address_fields(shopify_address, customer_name, address_type, email)
+		new_values = {k: v for k, v in new_values.items() if k not in exclude_in_update}
 
-		if not old_address:
+		# saved only if any of the mapped fields changed since last order
+		if not self.update_customer_address(address_type, new_values):
 			self.create_customer_address(customer_name, shopify_address, address_type, email)
-		else:
-			exclude_in_update = ["address_title", "address_type"]
-			new_values = _map_address_fields(shopify_address, customer_name, address_type, email)
-
-			old_address.update({k: v for k, v in new_values.items() if k not in exclude_in_update})
-			old_address.flags.ignore_mandatory = True
-			old_address.save()
 
 	def create_customer_contact(self, shopify_customer: Dict[str, Any]) -> None:
 
@@ -0,0 +1,140 @@
+# Copyright (c) 2026, Frappe and contributors
+# For license information, please see LICENSE
+
+from typing import List, Optional, Tuple
+
+import frappe
+from frappe import _dict
+from frappe.model.document import Document
+from frappe.utils import cint, cstr, now
+
+from ecommerce_integrations.shopify.constants import FULLFILLMENT_ID_FIELD, ORDER_ID_FIELD
+
+LINK_DOCTYPE = "Shopify Order Link"
+LINKED_DOCTYPES = ("Sales Order", "Sales Invoice", "Delivery Note", "Payment Entry")
+
+
+class ShopifyOrderLink(Document):
+	"""ERPNext document created for a Shopify order.
+
+	Maintained by document hooks (see `update_order_link`), used for finding all
+	documents of a Shopify order with a single query."""
+
+	shopify_order_id: str
+	link_doctype: str
+	link_name: str
+	link_docstatus: int
+	is_return: int
+	fulfillment_id: str
+	against_name: str
+
+
+class ShopifyOrderDocuments(_dict):
+	"""All ERPNext documents linked to a Shopify order, returned by `get_order_documents`."""
+
+	def get_names(
+		self, doctype: str, is_return: Optional[int] = 0, docstatus: Tuple[int, ...] = (0, 1)
+	) -> List[str]:
+		"""Get names of linked documents of a doctype, `is_return=None` includes both returns and others."""
+		return [
+			d.link_name
+			for d in self.links
+			if d.link_doctype == doctype
+			and (is_return is None or cint(d.is_return) == is_return)
+			and d.link_docstatus in docstatus
+		]
+
+	@property
+	def sales_order(self) -> Optional[str]:
+		# cancelled order is returned only if there is no other
+		orders = self.get_names("Sales Order") or self.get_names("Sales Order", docstatus=(2,))
+		return orders[0] if orders else None
+
+	@property
+	def fulfillment_ids(self):
+		return {d.fulfillment_id for d in self.links if d.fulfillment_id}
+
+	def get_payment_entries(self, against: List[str]) -> List[str]:
+		return [
+			d.link_name
+			for d in self.links
+			if d.link_doctype == "Payment Entry" and d.link_docstatus == 1 and d.against_name in against
+		]
+
+
+def get_order_documents(order_id) -> ShopifyOrderDocuments:
+	links = frappe.get_all(
+		LINK_DOCTYPE,
+		filters={"shopify_order_id": cstr(order_id)},
+		fields=["link_doctype", "link_name", "link_docstatus", "is_return", "fulfillment_id", "against_name"],
+		order_by="creation asc",
+	)
+	return ShopifyOrderDocuments(order_id=cstr(order_id), links=links)
+
+
+def update_order_link(doc, method=None):
+	"""Keep link of Shopify order and ERPNext document up to date.
+
+	Called by hooks of linked doctypes on update, submit, cancel and trash."""
+	name = get_link_name(doc.doctype, doc.name)
+
+	if method == "on_trash":
+		frappe.db.delete(LINK_DOCTYPE, {"name": name})
+		return
+
+	order_id, against_name = _get_order_id(doc)
+	if not order_id:
+		return
+
+	timestamp = now()
+	user = frappe.session.user
+	frappe.db.sql(
+		f"""
+			INSERT INTO `tab{LINK_DOCTYPE}`
+				(name, creation, modified, owner, modified_by, shopify_order_id,
+				link_doctype, link_name, link_docstatus, is_return, fulfillment_id, against_name)
+			VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+			ON DUPLICATE KEY UPDATE
+				modified = VALUES(modified), shopify_order_id = VALUES(shopify_order_id),
+				link_docstatus = VALUES(link_docstatus), is_return = VALUES(is_return),
+				fulfillment_id = VALUES(fulfillment_id), against_name = VALUES(against_name)
+		""",
+		(
+			name,
+			timestamp,
+			timestamp,
+			user,
+			user,
+			order_id,
+			doc.doctype,
+			doc.name,
+			cint(doc.docstatus),
+			cint(doc.get("is_return")),
+			doc.get(FULLFILLMENT_ID_FIELD),
+			against_name,
+		),
+	)
+
+
+def get_link_name(doctype: str, name: str) -> str:
+	return f"{doctype}:{name}"
+
+
+def _get_order_id(doc):
+	if doc.doctype != "Payment Entry":
+		return cstr(doc.get(ORDER_ID_FIELD)), None
+
+	invoices = [
+		get_link_name("Sales Invoice", ref.reference_name)
+		for ref in doc.get("references") or []
+		if ref.reference_doctype == "Sales Invoice"
+	]
+	if not invoices:
+		return None, None
+
+	link = frappe.db.get_value(
+		LINK_DOCTYPE, {"name": ("in", invoices)}, ["shopify_order_id", "link_name"], as_dict=True
+	)
+	if link:
+		return link.shopify_order_id, link.link_name
+	return None, None
@@ -0,0 +1,42 @@
+# Copyright (c) 2026, Frappe and Contributors
+# See LICENSE
+
+import unittest
+
+import frappe
+
+from ecommerce_integrations.shopify.constants import FULLFILLMENT_ID_FIELD, ORDER_ID_FIELD
+from ecommerce_integrations.shopify.doctype.shopify_order_link.shopify_order_link import (
+	LINK_DOCTYPE,
+	get_order_documents,
+	update_order_link,
+)
+
+ORDER_ID = "_test_shopify_order"
+
+
+def make_doc(doctype, name, docstatus=1, **kwargs):
+	return frappe._dict(doctype=doctype, name=name, docstatus=docstatus, **{ORDER_ID_FIELD: ORDER_ID}, **kwargs)
+
+
+class TestShopifyOrderLink(unittest.TestCase):
+	def tearDown(self):
+		frappe.db.delete(LINK_DOCTYPE, {"shopify_order_id": ORDER_ID})
+
+	def test_order_documents(self):
+		update_order_link(make_doc("Sales Order", "_T-SO-1", docstatus=2), "on_cancel")
+		update_order_link(make_doc("Sales Order", "_T-SO-2", docstatus=0), "on_update")
+		update_order_link(make_doc("Sales Order", "_T-SO-2"), "on_submit")
+		update_order_link(make_doc("Sales Invoice", "_T-SI-1"), "on_submit")
+		update_order_link(make_doc("Sales Invoice", "_T-SI-2", is_return=1), "on_submit")
+		update_order_link(make_doc("Delivery Note", "_T-DN-1", **{FULLFILLMENT_ID_FIELD: "42"}), "on_submit")
+		update_order_link(make_doc("Delivery Note", "_T-DN-2"), "on_update")
+		update_order_link(make_doc("Delivery Note", "_T-DN-2"), "on_trash")
+
+		order_documents = get_order_documents(ORDER_ID)
+
+		self.assertEqual(order_documents.sales_order, "_T-SO-2")
+		self.assertEqual(order_documents.get_names("Sales Invoice"), ["_T-SI-1"])
+		self.assertEqual(order_documents.get_names("Sales Invoice", is_return=1), ["_T-SI-2"])
+		self.assertEqual(order_documents.get_names("Delivery Note"), ["_T-DN-1"])
+		self.assertEqual(order_documents.fulfillment_ids, {"42"})
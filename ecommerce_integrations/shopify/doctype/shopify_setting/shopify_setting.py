@@ -28,6 +28,7 @@ from ecommerce_integrations.shopify.constants import (
 	SUPPLIER_ID_FIELD,
 )
 from ecommerce_integrations.shopify.utils import (
+	bump_setting_version,
 	ensure_old_connector_is_disabled,
 	migrate_from_old_connector,
 )
@@ -50,6 +51,8 @@ class ShopifySetting(SettingController):
 			setup_custom_fields()
 
 	def on_update(self):
+		frappe.db.after_commit.add(bump_setting_version)
+
 		if self.is_enabled() and not self.is_old_data_migrated:
 			migrate_from_old_connector()
 
@@ -125,6 +128,7 @@ def setup_custom_fields():
 				fieldname=CUSTOMER_ID_FIELD,
 				label="Shopify Customer Id",
 				fieldtype="Data",
+				search_index=1,
 				insert_after="series",
 				read_only=1,
 				print_hide=1,
@@ -154,7 +158,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_ID_FIELD,
 				label="Shopify Order Id",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after="title",
 				read_only=1,
 				print_hide=1,
@@ -162,7 +167,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_NUMBER_FIELD,
 				label="Shopify Order Number",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after=ORDER_ID_FIELD,
 				read_only=1,
 				print_hide=1,
@@ -189,7 +195,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_ID_FIELD,
 				label="Shopify Order Id",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after="title",
 				read_only=1,
 				print_hide=1,
@@ -197,7 +204,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_NUMBER_FIELD,
 				label="Shopify Order Number",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after=ORDER_ID_FIELD,
 				read_only=1,
 				print_hide=1,
@@ -213,7 +221,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=FULLFILLMENT_ID_FIELD,
 				label="Shopify Fulfillment Id",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after="title",
 				read_only=1,
 				print_hide=1,
@@ -223,7 +232,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_ID_FIELD,
 				label="Shopify Order Id",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after="title",
 				read_only=1,
 				print_hide=1,
@@ -231,7 +241,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_NUMBER_FIELD,
 				label="Shopify Order Number",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after=ORDER_ID_FIELD,
 				read_only=1,
 				print_hide=1,
@@ -58,3 +58,24 @@ class TestShopifySetting(unittest.TestCase):
 		created_fields_set = {d[0] for d in created_fields}
 
 		self.assertEqual(created_fields_set, required_fields)
+
+	def test_id_fields_are_indexed(self):
+		setup_custom_fields()
+
+		lookups = [
+			("Sales Order", ORDER_ID_FIELD),
+			("Sales Order", ORDER_NUMBER_FIELD),
+			("Sales Invoice", ORDER_ID_FIELD),
+			("Delivery Note", ORDER_ID_FIELD),
+			("Delivery Note", FULLFILLMENT_ID_FIELD),
+			("Customer", CUSTOMER_ID_FIELD),
+		]
+
+		for doctype, fieldname in lookups:
+			query_plan = frappe.db.sql(
+				f"EXPLAIN SELECT name FROM `tab{doctype}` WHERE `{fieldname}` = %s", "1234", as_dict=True,
+			)[0]
+			index = frappe.db.get_column_index(f"tab{doctype}", fieldname, unique=False)
+
+			self.assertTrue(index, f"{doctype}.{fieldname} is not indexed")
+			self.assertIn(index.Key_name, (query_plan.possible_keys or "").split(","))
@@ -1,4 +1,6 @@
-from copy import deepcopy
+from collections import defaultdict, deque
+from types import MappingProxyType
+from typing import Mapping, Tuple
 
 import frappe
 from erpnext.selling.doctype.sales_order.sales_order import make_delivery_note
@@ -10,8 +12,12 @@ from ecommerce_integrations.shopify.constants import (
 	ORDER_NUMBER_FIELD,
 	SETTING_DOCTYPE,
 )
+from ecommerce_integrations.shopify.doctype.shopify_order_link.shopify_order_link import (
+	get_order_documents,
+)
 from ecommerce_integrations.shopify.order import get_sales_order
-from ecommerce_integrations.shopify.utils import create_shopify_log
+from ecommerce_integrations.shopify.product import ItemResolver, get_item_resolver
+from ecommerce_integrations.shopify.utils import create_shopify_log, get_worker_cached
 
 
 def prepare_delivery_note(payload, request_id=None):
@@ -22,9 +28,10 @@ def prepare_delivery_note(payload, request_id=None):
 	order = payload
 
 	try:
-		sales_order = get_sales_order(cstr(order["id"]))
+		order_documents = get_order_documents(order["id"])
+		sales_order = get_sales_order(cstr(order["id"]), order_documents)
 		if sales_order:
-			create_delivery_note(order, setting, sales_order)
+			create_delivery_note(order, setting, sales_order, order_documents)
 			create_shopify_log(status="Success")
 		else:
 			create_shopify_log(status="Invalid", message="Sales Order not found for syncing delivery note.")
@@ -32,15 +39,16 @@ def prepare_delivery_note(payload, request_id=None):
 		create_shopify_log(status="Error", exception=e, rollback=True)
 
 
-def create_delivery_note(shopify_order, setting, so):
+def create_delivery_note(shopify_order, setting, so, order_documents=None):
 	if not cint(setting.sync_delivery_note):
 		return
 
+	if order_documents is None:
+		order_documents = get_order_documents(shopify_order.get("id"))
+	synced_fulfillments = order_documents.fulfillment_ids
+
 	for fulfillment in shopify_order.get("fulfillments"):
-		if (
-			not frappe.db.get_value("Delivery Note", {FULLFILLMENT_ID_FIELD: fulfillment.get("id")}, "name")
-			and so.docstatus == 1
-		):
+		if cstr(fulfillment.get("id")) not in synced_fulfillments and so.docstatus == 1:
 
 			dn = make_delivery_note(so.name)
 			setattr(dn, ORDER_ID_FIELD, fulfillment.get("order_id"))
@@ -50,40 +58,49 @@ def create_delivery_note(shopify_order, setting, so):
 			dn.posting_date = getdate(fulfillment.get("created_at"))
 			dn.naming_series = setting.delivery_note_series or "DN-Shopify-"
 			dn.items = get_fulfillment_items(
-				dn.items, fulfillment.get("line_items"), fulfillment.get("location_id")
+				dn.items,
+				fulfillment.get("line_items"),
+				fulfillment.get("location_id"),
+				item_resolver=get_item_resolver(shopify_order.get("id"), shopify_order.get("line_items")),
 			)
 			dn.flags.ignore_mandatory = True
 			dn.save()
 			dn.submit()
+			synced_fulfillments.add(cstr(fulfillment.get("id")))
 
 			if shopify_order.get("note"):
 				dn.add_comment(text=f"Order Note: {shopify_order.get('note')}")
 
 
-def get_fulfillment_items(dn_items, fulfillment_items, location_id=None):
-	# local import to avoid circular imports
-	from ecommerce_integrations.shopify.product import get_item_code
+def get_fulfillment_items(dn_items, fulfillment_items, location_id=None, item_resolver=None):
+	item_resolver = item_resolver or ItemResolver()
+	item_resolver.fetch(fulfillment_items)
 
-	fulfillment_items = deepcopy(fulfillment_items)
+	wh_map, default_warehouse = _get_warehouse_map()
+	warehouse = wh_map.get(str(location_id)) or default_warehouse
 
-	setting = frappe.get_cached_doc(SETTING_DOCTYPE)
-	wh_map = setting.get_integration_to_erpnext_wh_mapping()
-	warehouse = wh_map.get(str(location_id)) or setting.warehouse
+	# fulfillment lines of every item code, matched to delivery note items in order.
+	lines_by_item_code = defaultdict(deque)
+	for item in fulfillment_items:
+		lines_by_item_code[item_resolver.get_item_code(item)].append(item)
 
 	final_items = []
-
-	def find_matching_fullfilement_item(dn_item):
-		nonlocal fulfillment_items
-
-		for item in fulfillment_items:
-			if get_item_code(item) == dn_item.item_code:
-				fulfillment_items.remove(item)
-				return item
-
 	for dn_item in dn_items:
-		if shopify_item := find_matching_fullfilement_item(dn_item):
+		lines = lines_by_item_code.get(dn_item.item_code)
+		if lines:
+			shopify_item = lines.popleft()
 			final_items.append(
 				dn_item.update({"qty": shopify_item.get("quantity"), "warehouse": warehouse})
 			)
 
 	return final_items
+
+
+def _get_warehouse_map() -> Tuple[Mapping[str, str], str]:
+	"""Get Shopify location to ERPNext warehouse mapping and default warehouse."""
+
+	def build():
+		setting = frappe.get_doc(SETTING_DOCTYPE)
+		return MappingProxyType(setting.get_integration_to_erpnext_wh_mapping()), setting.warehouse
+
+	return get_worker_cached("fulfillment_warehouse_map", build)
@@ -1,100 +1,494 @@
+import time
 from collections import Counter
 
 import frappe
-from frappe.utils import cint, create_batch, now
+from frappe.utils import cint, create_batch, cstr, flt, now
 from pyactiveresource.connection import ResourceNotFound
-from shopify.resources import InventoryLevel, Variant
+from shopify.resources import InventoryLevel, Product, Variant
 import requests
 
 from ecommerce_integrations.controllers.inventory import (
+	bulk_update_inventory_sync_status,
+	filter_unchanged_inventory,
 	get_inventory_levels,
-	update_inventory_sync_status,
+	get_inventory_levels_of_items,
+	update_inventory_ledger,
 )
 from ecommerce_integrations.controllers.scheduling import need_to_run
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_sync_run.ecommerce_sync_run import (
+	get_unfinished_sync_run,
+	start_sync_run,
+)
 from ecommerce_integrations.shopify.connection import temp_shopify_session
-from ecommerce_integrations.shopify.constants import MODULE_NAME, SETTING_DOCTYPE
-from ecommerce_integrations.shopify.utils import create_shopify_log
+from ecommerce_integrations.shopify.constants import (
+	GRAPHQL_API_VERSION,
+	MODULE_NAME,
+	SETTING_DOCTYPE,
+)
+from ecommerce_integrations.shopify.rate_limiter import call_with_rate_limit
+from ecommerce_integrations.shopify.utils import (
+	create_shopify_log,
+	get_setting_version,
+	get_worker_cached,
+)
+
+INVENTORY_SYNC_GATE_KEY = "shopify_inventory_sync_gate"
+INVENTORY_SYNC_TYPE = "Inventory"
+
+# max number of quantities accepted by `inventorySetQuantities` in one call
+GRAPHQL_BATCH_SIZE = 250
+MAX_GRAPHQL_RETRIES = 5
+
+COST_API_VERSION = "2024-01"
+# Shopify stores cost as money amount
+COST_PRECISION = 2
+
+# user errors which mean that inventory item or location doesn't exist (anymore)
+NOT_FOUND_ERROR_CODES = ("INVALID_INVENTORY_ITEM", "INVALID_LOCATION", "ITEM_NOT_STOCKED_AT_LOCATION")
+
+INVENTORY_SET_QUANTITIES_MUTATION = """
+mutation inventorySetQuantities($input: InventorySetQuantitiesInput!) {
+	inventorySetQuantities(input: $input) {
+		userErrors {
+			code
+			field
+			message
+		}
+	}
+}
+"""
 
 
 def update_inventory_on_shopify() -> None:
 	"""Upload stock levels from ERPNext to Shopify.
 
-	Called by scheduler on configured interval.
+	Called by scheduler every minute, runs on configured interval. Most changes
+	are pushed as they happen by `inventory_queue`, this catches up on the rest.
 	"""
+	cache = frappe.cache()
+	gate_key = cache.make_key(INVENTORY_SYNC_GATE_KEY)
+	setting_version = get_setting_version()
+
+	# avoid touching database in between intervals, gate is reset if setting changes.
+	if frappe.safe_decode(cache.get(gate_key)) == setting_version:
+		return
+
 	setting = frappe.get_doc(SETTING_DOCTYPE)
 
 	if not setting.is_enabled() or not setting.update_erpnext_stock_levels_to_shopify:
+		cache.set(gate_key, setting_version)
 		return
 
 	if not need_to_run(SETTING_DOCTYPE, "inventory_sync_frequency", "last_inventory_sync"):
 		return
 
+	interval = cint(setting.inventory_sync_frequency, default=10)
+	# expire a bit early so that next interval isn't skipped by need_to_run
+	cache.set(gate_key, setting_version, ex=max(interval * 60 - 30, 30))
+
+	run = get_unfinished_sync_run(MODULE_NAME, INVENTORY_SYNC_TYPE)
+	if run and not run.is_interrupted():
+		# previous run is still pushing
+		return
+
 	warehous_map = setting.get_erpnext_to_integration_wh_mapping()
-	inventory_levels = get_inventory_levels(tuple(warehous_map.keys()), MODULE_NAME)
+	if run:
+		inventory_levels = _get_pending_inventory_levels(run, warehous_map)
+	else:
+		inventory_levels = get_inventory_levels(
+			tuple(warehous_map.keys()), MODULE_NAME, include_cost=True
+		)
+
+	sync_inventory_levels(setting, warehous_map, inventory_levels, run=run, track_run=True)
+
+
+def sync_inventory_levels(
+	setting, warehous_map, inventory_levels, run=None, track_run=False
+) -> None:
+	"""Push inventory levels to Shopify, skipping the ones with unchanged quantity.
+
+	If `track_run` is set, progress is checkpointed in an Ecommerce Sync Run after
+	every batch, so that an interrupted sync can be resumed (see `update_inventory_on_shopify`).
+	Rows which don't need a push, e.g. unchanged ones, are counted as done.
+	Costs of all rows are pushed once at the end, see `sync_product_costs`."""
+	total_rows = len(inventory_levels)
+	unchanged = []
+	if inventory_levels:
+		inventory_levels, unchanged = filter_unchanged_inventory(inventory_levels, warehous_map)
+		if unchanged:
+			_skip_unchanged_inventory(unchanged, changed=inventory_levels)
+
+	if run:
+		# resumed run, pending levels are re-fetched and can differ from recorded ones.
+		pending_rows = max(len(run.get_data() or []) - cint(run.cursor), 0)
+		run.checkpoint(
+			rows_done=max(pending_rows - len(inventory_levels), 0),
+			cursor=0,
+			data=_get_run_data(inventory_levels),
+		)
+		frappe.db.commit()
+	elif track_run and inventory_levels:
+		run = start_sync_run(
+			MODULE_NAME,
+			INVENTORY_SYNC_TYPE,
+			total_rows=total_rows,
+			rows_done=total_rows - len(inventory_levels),
+			data=_get_run_data(inventory_levels),
+			cursor=0,
+		)
 
 	if inventory_levels:
-		upload_inventory_data_to_shopify(inventory_levels, warehous_map)
+		try:
+			if setting.bulk_inventory_sync:
+				bulk_upload_inventory_data_to_shopify(inventory_levels, warehous_map, run=run)
+			else:
+				upload_inventory_data_to_shopify(inventory_levels, warehous_map, run=run)
+		except Exception as e:
+			if run:
+				frappe.db.rollback()
+				run.fail(e)
+			raise
+
+	# cost can change without any change in quantity, e.g. on reposting.
+	sync_product_costs(unchanged + inventory_levels)
+
+	if run:
+		run.complete()
+
+
+def _get_run_data(inventory_levels):
+	return [[d.item_code, d.warehouse] for d in inventory_levels]
+
+
+def _get_pending_inventory_levels(run, warehous_map):
+	"""Get current inventory levels of items not yet pushed by an interrupted run, in original order."""
+	pending = [tuple(d) for d in (run.get_data() or [])[cint(run.cursor) :]]
+	pending = [d for d in pending if d[1] in warehous_map]
+	position = {d: idx for idx, d in enumerate(pending)}
+
+	inventory_levels = get_inventory_levels_of_items(pending, MODULE_NAME, include_cost=True)
+	return sorted(inventory_levels, key=lambda d: position[(d.item_code, d.warehouse)])
 
 
 @temp_shopify_session
-def upload_inventory_data_to_shopify(inventory_levels, warehous_map) -> None:
+def upload_inventory_data_to_shopify(inventory_levels, warehous_map, run=None) -> None:
 	synced_on = now()
 
+	_set_missing_inventory_item_ids(inventory_levels)
+
 	for inventory_sync_batch in create_batch(inventory_levels, 50):
 		for d in inventory_sync_batch:
 			d.shopify_location_id = warehous_map[d.warehouse]
 
 			try:
-				variant = Variant.find(d.variant_id)
-				inventory_id = variant.inventory_item_id
+				try:
+					_set_inventory_level(d)
+				except ResourceNotFound:
+					# stored inventory item id might be outdated, fetch it again from variant.
+					# If variant is deleted this raises ResourceNotFound again.
+					_update_inventory_item_id(d, _fetch_inventory_item_id(d.variant_id))
+					_set_inventory_level(d)
 
-				InventoryLevel.set(
-					location_id=d.shopify_location_id,
-					inventory_item_id=inventory_id,
-					# shopify doesn't support fractional quantity
-					#available=cint(d.actual_qty) - cint(d.reserved_qty),
-					available=cint(d.actual_qty),
-					cost=d.cost,
-				)
-				update_inventory_sync_status(d.ecom_item, time=synced_on)
 				d.status = "Success"
-				if d.cost > 0:
-					update_shopify_product_cost(inventory_id, d.cost, d.variant_id)
 			except ResourceNotFound:
 				# Variant or location is deleted, mark as last synced and ignore.
-				update_inventory_sync_status(d.ecom_item, time=synced_on)
 				d.status = "Not Found"
 			except Exception as e:
 				d.status = "Failed"
 				d.failure_reason = str(e)
 
+		_update_sync_status(inventory_sync_batch, warehous_map, synced_on, run)
+		if run:
+			# checkpoint is committed together with the work of batch
 			frappe.db.commit()
+		_log_inventory_update_status(inventory_sync_batch)
+
+
+@temp_shopify_session
+def bulk_upload_inventory_data_to_shopify(inventory_levels, warehous_map, run=None) -> None:
+	"""Upload stock levels using GraphQL `inventorySetQuantities` mutation.
+
+	Up to `GRAPHQL_BATCH_SIZE` levels are pushed per API call. Errors reported by
+	Shopify for individual levels are mapped back to their rows."""
+	synced_on = now()
+
+	_set_missing_inventory_item_ids(inventory_levels)
+
+	for inventory_sync_batch in create_batch(inventory_levels, GRAPHQL_BATCH_SIZE):
+		quantities = []
+		for d in inventory_sync_batch:
+			d.shopify_location_id = warehous_map[d.warehouse]
+			if d.inventory_item_id:
+				quantities.append(d)
+			else:
+				d.status = "Not Found"
+
+		if quantities:
+			_set_inventory_quantities(quantities)
 
+		_update_sync_status(inventory_sync_batch, warehous_map, synced_on, run)
+		if run:
+			# checkpoint is committed together with the work of batch
+			frappe.db.commit()
 		_log_inventory_update_status(inventory_sync_batch)
 
-def update_shopify_product_cost(inventory_id, new_cost,variant_id)-> None:
-	setting = frappe.get_doc('Shopify Setting')
-	shopify_api_key = setting.shared_secret
-	shopify_api_password = setting.get_password('password')
-	shopify_store_url = setting.shopify_url
-	data = {
-		"inventory_item": {
-			"cost": new_cost
+
+def _skip_unchanged_inventory(unchanged, changed) -> None:
+	"""Mark levels with same quantity as last push as synced without calling Shopify."""
+	synced_on = now()
+
+	# timestamp is per item, items with any changed level are marked after their push.
+	changed_items = {d.ecom_item for d in changed}
+	bulk_update_inventory_sync_status(
+		[d.ecom_item for d in unchanged if d.ecom_item not in changed_items], time=synced_on
+	)
+	frappe.db.commit()
+
+	for d in unchanged:
+		d.status = "Success"
+
+	create_shopify_log(
+		method="update_inventory_on_shopify",
+		status="Success",
+		message=f"Skipped pushing {len(unchanged)} inventory levels with unchanged quantity.",
+	)
+
+
+def _update_sync_status(inventory_levels, warehous_map, synced_on, run=None) -> None:
+	"""Mark pushed and not found levels as synced, along with checkpoint of run."""
+	bulk_update_inventory_sync_status(
+		[d.ecom_item for d in inventory_levels if d.status in ("Success", "Not Found")],
+		time=synced_on,
+	)
+	synced = [d for d in inventory_levels if d.status == "Success"]
+	update_inventory_ledger(synced, MODULE_NAME, warehous_map, time=synced_on)
+	if run:
+		run.checkpoint(rows_done=len(inventory_levels), cursor=cint(run.cursor) + len(inventory_levels))
+
+
+def _set_inventory_quantities(inventory_levels) -> None:
+	"""Set available quantity of all levels in one mutation, sets `status` on each row."""
+	variables = {
+		"input": {
+			"name": "available",
+			"reason": "correction",
+			"ignoreCompareQuantity": True,
+			"quantities": [
+				{
+					"inventoryItemId": f"gid://shopify/InventoryItem/{d.inventory_item_id}",
+					"locationId": f"gid://shopify/Location/{d.shopify_location_id}",
+					# shopify doesn't support fractional quantity
+					"quantity": cint(d.actual_qty),
+				}
+				for d in inventory_levels
+			],
 		}
 	}
-	api_endpoint = f"https://{shopify_store_url}/admin/api/2024-01/inventory_items/{inventory_id}.json"
-	headers = {
-		"Content-Type": "application/json",
-		"X-Shopify-Access-Token": shopify_api_password
-		}
+
 	try:
-		response = requests.put(api_endpoint, json=data, headers=headers)
+		data = execute_graphql(INVENTORY_SET_QUANTITIES_MUTATION, variables)
+	except Exception as e:
+		for d in inventory_levels:
+			d.status = "Failed"
+			d.failure_reason = str(e)
+		return
+
+	for d in inventory_levels:
+		d.status = "Success"
+
+	for error in data["inventorySetQuantities"]["userErrors"]:
+		# field is path to invalid input e.g. ["input", "quantities", "3", "locationId"]
+		field = error.get("field") or []
+		if len(field) > 2 and field[1] == "quantities" and cstr(field[2]).isdigit():
+			rows = [inventory_levels[cint(field[2])]]
+		else:
+			rows = inventory_levels
+
+		for d in rows:
+			d.status = "Not Found" if error.get("code") in NOT_FOUND_ERROR_CODES else "Failed"
+			d.failure_reason = error.get("message")
+
+
+def execute_graphql(query: str, variables=None):
+	"""Execute GraphQL Admin API query and return `data` of response.
+
+	Retries when query is throttled, raises on any other top level error."""
+	session = _get_http_session()
+	url = _get_admin_url(f"{GRAPHQL_API_VERSION}/graphql.json")
+
+	for attempt in range(MAX_GRAPHQL_RETRIES + 1):
+		response = call_with_rate_limit(
+			session.post,
+			url,
+			json={"query": query, "variables": variables or {}},
+			timeout=60,
+			caller="inventory",
+		)
 		response.raise_for_status()
-		response_data = response.json()
-		create_shopify_log(method="update_cost_on_shopify", status='Success', message=str(response_data))
-	except requests.exceptions.RequestException as e:
-		ermsg=str(api_endpoint)+str(headers)+str(data)+str(e)
-		create_shopify_log(method="update_cost_on_shopify", status='Error', message=ermsg)
+		result = response.json()
+
+		errors = result.get("errors") or []
+		throttled = any(e.get("extensions", {}).get("code") == "THROTTLED" for e in errors)
+		if throttled and attempt < MAX_GRAPHQL_RETRIES:
+			time.sleep(_get_graphql_throttle_wait(result))
+			continue
+		if errors:
+			frappe.throw(", ".join(cstr(e.get("message")) for e in errors))
+
+		return result["data"]
+
+
+def _get_graphql_throttle_wait(result) -> float:
+	cost = result.get("extensions", {}).get("cost", {})
+	requested = cost.get("requestedQueryCost") or 0
+	status = cost.get("throttleStatus") or {}
+	available = status.get("currentlyAvailable") or 0
+	restore_rate = status.get("restoreRate") or 50
+
+	return max(requested - available, 0) / restore_rate + 1
+
+
+def _set_inventory_level(d) -> None:
+	if not d.inventory_item_id:
+		raise ResourceNotFound()
+
+	call_with_rate_limit(
+		InventoryLevel.set,
+		caller="inventory",
+		location_id=d.shopify_location_id,
+		inventory_item_id=d.inventory_item_id,
+		# shopify doesn't support fractional quantity
+		#available=cint(d.actual_qty) - cint(d.reserved_qty),
+		available=cint(d.actual_qty),
+		cost=d.cost,
+	)
+
+
+def _fetch_inventory_item_id(variant_id) -> str:
+	variant = call_with_rate_limit(Variant.find, variant_id, caller="inventory")
+	return cstr(variant.inventory_item_id)
+
+
+def _set_missing_inventory_item_ids(inventory_levels) -> None:
+	"""Fetch and store inventory item ids for rows that don't have one yet.
+
+	Variants are fetched through their products, 250 products per request."""
+	missing = [d for d in inventory_levels if not d.inventory_item_id and d.variant_id]
+	if not missing:
+		return
+
+	inventory_item_ids = {}
+	product_ids = list({cstr(d.integration_item_code) for d in missing})
+	for product_ids_batch in create_batch(product_ids, 250):
+		products = call_with_rate_limit(
+			Product.find,
+			ids=",".join(product_ids_batch),
+			fields="id,variants",
+			limit=250,
+			caller="inventory",
+		)
+		for product in products:
+			for variant in product.variants:
+				inventory_item_ids[cstr(variant.id)] = cstr(variant.inventory_item_id)
+
+	for d in missing:
+		if inventory_item_id := inventory_item_ids.get(cstr(d.variant_id)):
+			_update_inventory_item_id(d, inventory_item_id)
+
+	frappe.db.commit()
+
+
+def _update_inventory_item_id(d, inventory_item_id) -> None:
+	d.inventory_item_id = inventory_item_id
+	frappe.db.set_value(
+		"Ecommerce Item", d.ecom_item, "inventory_item_id", inventory_item_id, update_modified=False
+	)
+
+
+def sync_product_costs(inventory_levels) -> None:
+	"""Push cost of synced items to Shopify if it changed since last push.
+
+	Called once per sync with all its levels, one log summarizes all pushes."""
+	tolerance = flt(frappe.db.get_single_value(SETTING_DOCTYPE, "cost_sync_tolerance", cache=True))
+
+	# cost is per inventory item, not per location.
+	costs = {
+		d.inventory_item_id: d
+		for d in inventory_levels
+		if d.status == "Success" and flt(d.cost) > 0 and d.inventory_item_id
+	}
+	changed = [d for d in costs.values() if _is_cost_changed(d, tolerance)]
+	if not changed:
+		return
+
+	session = _get_http_session()
+	failures = []
+	for d in changed:
+		cost = flt(d.cost, COST_PRECISION)
+		try:
+			response = call_with_rate_limit(
+				session.put,
+				_get_admin_url(f"{COST_API_VERSION}/inventory_items/{d.inventory_item_id}.json"),
+				json={"inventory_item": {"cost": cost}},
+				timeout=60,
+				caller="product_cost",
+			)
+			response.raise_for_status()
+		except requests.exceptions.RequestException as e:
+			failures.append(f"{d.variant_id},{d.inventory_item_id},{cost},{e}")
+			continue
+
+		frappe.db.set_value(
+			"Ecommerce Item", d.ecom_item, "last_synced_cost", cost, update_modified=False
+		)
+
+	frappe.db.commit()
+
+	updated = len(changed) - len(failures)
+	message = (
+		f"Updated cost of {updated} items, {len(costs) - len(changed)} items had no change in cost."
+	)
+	if failures:
+		message += "\n\nvariant_id,inventory_item_id,cost,failure_reason\n" + "\n".join(failures)
+
+	if not updated:
+		status = "Error"
+	elif failures:
+		status = "Partial Success"
+	else:
+		status = "Success"
+
+	create_shopify_log(method="update_cost_on_shopify", status=status, message=message)
+
+
+def _is_cost_changed(d, tolerance: float) -> bool:
+	cost = flt(d.cost, COST_PRECISION)
+	last_synced_cost = flt(d.last_synced_cost, COST_PRECISION)
+	if not last_synced_cost:
+		return True
+
+	return abs(cost - last_synced_cost) > last_synced_cost * tolerance / 100
+
+
+def _get_http_session() -> requests.Session:
+	"""Get HTTP session with Shopify credentials, connections are reused across calls."""
+
+	def build_session():
+		session = requests.Session()
+		session.headers.update(
+			{
+				"Content-Type": "application/json",
+				"X-Shopify-Access-Token": frappe.get_doc(SETTING_DOCTYPE).get_password("password"),
+			}
+		)
+		return session
+
+	return get_worker_cached("http_session", build_session)
+
+
+def _get_admin_url(path: str) -> str:
+	shopify_url = frappe.db.get_single_value(SETTING_DOCTYPE, "shopify_url", cache=True)
+	return f"https://{shopify_url}/admin/api/{path}"
 
 
 def _log_inventory_update_status(inventory_levels) -> None:
@@ -0,0 +1,126 @@
+"""Change capture for Shopify inventory sync.
+
+Stock Ledger Entries of items synced with Shopify mark their (item, warehouse)
+as dirty once the transaction commits. A job drains the
+dirty set shortly after, so stock changes reach Shopify within seconds instead
+of on next scheduled sync. Scheduled sync (`update_inventory_on_shopify`) still
+runs on configured interval to catch up on anything missed here.
+"""
+
+from typing import List, Set, Tuple
+
+import frappe
+
+from ecommerce_integrations.controllers.inventory import get_inventory_levels_of_items
+from ecommerce_integrations.shopify.constants import MODULE_NAME, SETTING_DOCTYPE
+from ecommerce_integrations.shopify.inventory import sync_inventory_levels
+from ecommerce_integrations.shopify.utils import get_worker_cached
+
+DIRTY_KEY = "shopify_dirty_inventory"
+SCHEDULED_KEY = "shopify_dirty_inventory_scheduled"
+JOB_TIMEOUT = 25 * 60
+SEPARATOR = "::"
+
+
+def mark_inventory_dirty(doc, method=None) -> None:
+	"""Queue (item, warehouse) of doc for inventory sync after commit.
+
+	Called on submit/cancel of Stock Ledger Entry. Items not synced with Shopify
+	are filtered out once per transaction, see `_flush_dirty_inventory`."""
+	if doc.warehouse not in _get_synced_warehouses():
+		return
+
+	if frappe.flags.shopify_dirty_inventory is None:
+		frappe.flags.shopify_dirty_inventory = set()
+		frappe.db.after_commit.add(_flush_dirty_inventory)
+		frappe.db.after_rollback.add(_discard_dirty_inventory)
+
+	frappe.flags.shopify_dirty_inventory.add((doc.item_code, doc.warehouse))
+
+
+def sync_dirty_inventory() -> None:
+	"""Push inventory of all dirty (item, warehouse) pairs to Shopify."""
+	cache = frappe.cache()
+	# changes from now on should schedule another job.
+	cache.delete(cache.make_key(SCHEDULED_KEY))
+
+	item_warehouses = _pop_dirty_inventory()
+	if not item_warehouses:
+		return
+
+	setting = frappe.get_doc(SETTING_DOCTYPE)
+	if not setting.is_enabled() or not setting.update_erpnext_stock_levels_to_shopify:
+		return
+
+	warehous_map = setting.get_erpnext_to_integration_wh_mapping()
+	item_warehouses = [d for d in item_warehouses if d[1] in warehous_map]
+
+	inventory_levels = get_inventory_levels_of_items(item_warehouses, MODULE_NAME, include_cost=True)
+	sync_inventory_levels(setting, warehous_map, inventory_levels)
+
+
+def _get_synced_warehouses() -> Set[str]:
+	def get_warehouses():
+		setting = frappe.get_doc(SETTING_DOCTYPE)
+		if not setting.is_enabled() or not setting.update_erpnext_stock_levels_to_shopify:
+			return set()
+		return set(setting.get_erpnext_to_integration_wh_mapping())
+
+	return get_worker_cached("inventory_warehouses", get_warehouses)
+
+
+def _get_synced_items(item_codes: Set[str]) -> Set[str]:
+	return set(
+		frappe.get_all(
+			"Ecommerce Item",
+			filters={"integration": MODULE_NAME, "erpnext_item_code": ("in", list(item_codes))},
+			pluck="erpnext_item_code",
+		)
+	)
+
+
+def _flush_dirty_inventory() -> None:
+	item_warehouses = frappe.flags.shopify_dirty_inventory
+	frappe.flags.shopify_dirty_inventory = None
+	if not item_warehouses:
+		return
+
+	synced_items = _get_synced_items({item_code for item_code, _ in item_warehouses})
+	keys = [
+		f"{item_code}{SEPARATOR}{warehouse}"
+		for item_code, warehouse in item_warehouses
+		if item_code in synced_items
+	]
+	if not keys:
+		return
+
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	pipe.sadd(cache.make_key(DIRTY_KEY), *keys)
+	pipe.execute()
+
+	# set is deduplicated, one pending job is enough for any number of changes.
+	if cache.set(cache.make_key(SCHEDULED_KEY), 1, nx=True, ex=JOB_TIMEOUT):
+		frappe.enqueue(
+			method="ecommerce_integrations.shopify.inventory_queue.sync_dirty_inventory",
+			queue="short",
+			timeout=JOB_TIMEOUT,
+			is_async=True,
+		)
+
+
+def _discard_dirty_inventory() -> None:
+	frappe.flags.shopify_dirty_inventory = None
+
+
+def _pop_dirty_inventory() -> List[Tuple[str, str]]:
+	"""Atomically fetch and clear dirty set."""
+	cache = frappe.cache()
+	key = cache.make_key(DIRTY_KEY)
+
+	pipe = cache.pipeline()
+	pipe.smembers(key)
+	pipe.delete(key)
+	keys, _ = pipe.execute()
+
+	return [tuple(frappe.safe_decode(k).split(SEPARATOR, 1)) for k in keys]
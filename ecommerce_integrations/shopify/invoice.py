@@ -7,6 +7,9 @@ from ecommerce_integrations.shopify.constants import (
 	ORDER_NUMBER_FIELD,
 	SETTING_DOCTYPE,
 )
+from ecommerce_integrations.shopify.doctype.shopify_order_link.shopify_order_link import (
+	get_order_documents,
+)
 from ecommerce_integrations.shopify.utils import create_shopify_log
 
 
@@ -20,9 +23,10 @@ def prepare_sales_invoice(payload, request_id=None):
 	frappe.flags.request_id = request_id
 
 	try:
-		sales_order = get_sales_order(cstr(order["id"]))
+		order_documents = get_order_documents(order["id"])
+		sales_order = get_sales_order(cstr(order["id"]), order_documents)
 		if sales_order:
-			create_sales_invoice(order, setting, sales_order)
+			create_sales_invoice(order, setting, sales_order, order_documents)
 			create_shopify_log(status="Success")
 		else:
 			create_shopify_log(status="Invalid", message="Sales Order not found for syncing sales invoice.")
@@ -30,22 +34,21 @@ def prepare_sales_invoice(payload, request_id=None):
 		create_shopify_log(status="Error", exception=e, rollback=True)
 
 
-def create_sales_invoice(shopify_order, setting, so):
+def create_sales_invoice(shopify_order, setting, so, order_documents=None):
+	if order_documents is None:
+		order_documents = get_order_documents(shopify_order.get("id"))
+
 	if (
-		not frappe.db.get_value("Sales Invoice", {ORDER_ID_FIELD: shopify_order.get("id")}, "name")
+		not order_documents.get_names("Sales Invoice", is_return=None, docstatus=(0, 1, 2))
 		and so.docstatus == 1
 		and not so.per_billed
 		and cint(setting.sync_sales_invoice)
 	):
 
 		line_items = shopify_order.get("line_items")
-		
+
 		vcenter=''
-		for line_item in line_items:
-			vsett=frappe.db.get_value('Vendor Account Mapping', {'parent':'Shopify Setting','vendor':line_item.get("vendor")}, ['shipping_revenue_account','vendor_cost_center'], as_dict=1)
-			if not vsett:
-				vsett=frappe.db.get_value('Vendor Account Mapping', {'parent':'Shopify Setting','vendor':['is', 'null']}, ['shipping_revenue_account','vendor_cost_center'], as_dict=1)
-		
+		vsett = _get_vendor_accounts(line_items)
 		if vsett:
 			vcenter=vsett.vendor_cost_center
 		cost_center=vcenter or setting.cost_center
@@ -79,12 +82,7 @@ def set_shipping_account(shopify_order,items,setting):
 	
 	cost_center=setting.cost_center
 	shipping_charges_account=setting.default_shipping_charges_account
-	line_items = shopify_order.get("line_items")
-	for line_item in line_items:
-		vsett=frappe.db.get_value('Vendor Account Mapping', {'parent':'Shopify Setting','vendor':line_item.get("vendor")}, ['shipping_revenue_account','vendor_cost_center'], as_dict=1)
-		if not vsett:
-			vsett=frappe.db.get_value('Vendor Account Mapping', {'parent':'Shopify Setting','vendor':['is', 'null']}, ['shipping_revenue_account','vendor_cost_center'], as_dict=1)
-	
+	vsett = _get_vendor_accounts(shopify_order.get("line_items"))
 	if vsett:
 		shipping_charges_account=vsett.shipping_revenue_account or shipping_charges_account
 		cost_center=vsett.vendor_cost_center or cost_center
@@ -94,6 +92,16 @@ def set_shipping_account(shopify_order,items,setting):
 			item.cost_center = cost_center
 			item.income_account=shipping_charges_account
 
+def _get_vendor_accounts(line_items):
+	"""Accounts mapped to vendor of last line item."""
+	from ecommerce_integrations.shopify.order import get_lookup_context
+
+	context = get_lookup_context()
+	vsett = None
+	for line_item in line_items:
+		vsett = context.get_vendor_accounts(line_item.get("vendor"))
+	return vsett
+
 def set_cost_center(items, cost_center):
 	for item in items:
 		item.cost_center = cost_center
@@ -1,16 +1,15 @@
 import json
-from typing import Literal, Optional
+from types import MappingProxyType
+from typing import Literal, Mapping, NamedTuple, Optional
 
 import frappe
 from frappe import _
 from frappe.utils import cint, cstr, flt, get_datetime, getdate, nowdate
-from shopify.collection import PaginatedIterator
 from shopify.resources import Order 
 import requests
 
 from ecommerce_integrations.shopify.connection import temp_shopify_session
 from ecommerce_integrations.shopify.constants import (
-	CUSTOMER_ID_FIELD,
 	EVENT_MAPPER,
 	ORDER_ID_FIELD,
 	ORDER_ITEM_DISCOUNT_FIELD,
@@ -19,8 +18,16 @@ from ecommerce_integrations.shopify.constants import (
 	SETTING_DOCTYPE,
 )
 from ecommerce_integrations.shopify.customer import ShopifyCustomer
-from ecommerce_integrations.shopify.product import create_items_if_not_exist, get_item_code
-from ecommerce_integrations.shopify.utils import create_shopify_log
+from ecommerce_integrations.shopify.doctype.shopify_order_link.shopify_order_link import (
+	get_order_documents,
+)
+from ecommerce_integrations.shopify.product import (
+	create_items_if_not_exist,
+	get_item_code,
+	get_item_resolver,
+)
+from ecommerce_integrations.shopify.rate_limiter import call_with_rate_limit
+from ecommerce_integrations.shopify.utils import create_shopify_log, get_worker_cached
 from ecommerce_integrations.utils.price_list import get_dummy_price_list
 from ecommerce_integrations.utils.taxation import get_dummy_tax_category
 
@@ -30,12 +37,76 @@ DEFAULT_TAX_FIELDS = {
 }
 
 
+class VendorAccounts(NamedTuple):
+	shipping_revenue_account: Optional[str]
+	vendor_cost_center: Optional[str]
+
+
+class OrderLookupContext(NamedTuple):
+	"""Account mapping of Shopify Setting, see `get_lookup_context`.
+
+	Keys are normalized with `_lookup_key`, matching is case insensitive like
+	the database queries it replaces."""
+
+	tax_accounts: Mapping[str, str]
+	tax_descriptions: Mapping[str, str]
+	default_tax_accounts: Mapping[str, str]
+	vendor_accounts: Mapping[str, VendorAccounts]
+
+	def get_tax_account(self, tax_title) -> Optional[str]:
+		return self.tax_accounts.get(_lookup_key(tax_title))
+
+	def get_tax_description(self, tax_title) -> Optional[str]:
+		return self.tax_descriptions.get(_lookup_key(tax_title))
+
+	def get_vendor_accounts(self, vendor) -> Optional[VendorAccounts]:
+		"""Get accounts mapped to vendor, falls back to mapping without vendor."""
+		return self.vendor_accounts.get(_lookup_key(vendor)) or self.vendor_accounts.get("")
+
+
+def _lookup_key(value) -> str:
+	return cstr(value).strip().casefold()
+
+
+def get_lookup_context() -> OrderLookupContext:
+	"""Get account mapping of Shopify Setting.
+
+	Built once per worker and reused for every order, until Shopify Setting is modified."""
+	return get_worker_cached("order_lookup_context", _build_lookup_context)
+
+
+def _build_lookup_context() -> OrderLookupContext:
+	setting = frappe.get_doc(SETTING_DOCTYPE)
+
+	tax_accounts, tax_descriptions, vendor_accounts = {}, {}, {}
+	# first row wins for duplicate mappings, same as querying them.
+	for row in setting.taxes:
+		tax_accounts.setdefault(_lookup_key(row.shopify_tax), row.tax_account)
+		tax_descriptions.setdefault(_lookup_key(row.shopify_tax), row.tax_description)
+
+	for row in setting.vendor_account_mapping:
+		vendor_accounts.setdefault(
+			_lookup_key(row.vendor), VendorAccounts(row.shipping_revenue_account, row.vendor_cost_center)
+		)
+
+	default_tax_accounts = {
+		charge_type: setting.get(fieldname) for charge_type, fieldname in DEFAULT_TAX_FIELDS.items()
+	}
+
+	return OrderLookupContext(
+		tax_accounts=MappingProxyType(tax_accounts),
+		tax_descriptions=MappingProxyType(tax_descriptions),
+		default_tax_accounts=MappingProxyType(default_tax_accounts),
+		vendor_accounts=MappingProxyType(vendor_accounts),
+	)
+
+
 def sync_sales_order(payload, request_id=None):
 	order = payload
 	frappe.set_user("Administrator")
 	frappe.flags.request_id = request_id
 
-	if frappe.db.get_value("Sales Order", filters={ORDER_ID_FIELD: cstr(order["id"])}):
+	if get_order_documents(order["id"]).sales_order:
 		create_shopify_log(status="Invalid", message="Sales order already exists, not synced")
 		return
 	try:
@@ -78,9 +149,9 @@ def create_sales_order(shopify_order, setting, company=None):
 	customer = setting.default_customer
 	if shopify_order.get("customer", {}):
 		if customer_id := shopify_order.get("customer", {}).get("id"):
-			customer = frappe.db.get_value("Customer", {CUSTOMER_ID_FIELD: customer_id}, "name")
+			customer = ShopifyCustomer(customer_id=customer_id).get_customer_name()
 
-	so = frappe.db.get_value("Sales Order", {ORDER_ID_FIELD: shopify_order.get("id")}, "name")
+	so = get_order_documents(shopify_order.get("id")).sales_order
 
 	if not so:
 		items = get_order_items(
@@ -88,6 +159,7 @@ def create_sales_order(shopify_order, setting, company=None):
 			setting,
 			getdate(shopify_order.get("created_at")),
 			taxes_inclusive=shopify_order.get("taxes_included"),
+			item_resolver=get_item_resolver(shopify_order.get("id"), shopify_order.get("line_items")),
 		)
 
 		if not items:
@@ -143,7 +215,7 @@ def create_sales_order(shopify_order, setting, company=None):
 	return so
 
 
-def get_order_items(order_items, setting, delivery_date, taxes_inclusive):
+def get_order_items(order_items, setting, delivery_date, taxes_inclusive, item_resolver=None):
 	items = []
 	all_product_exists = True
 	product_not_exists = []
@@ -157,7 +229,7 @@ def get_order_items(order_items, setting, delivery_date, taxes_inclusive):
 			continue
 
 		if all_product_exists:
-			item_code = get_item_code(shopify_item)
+			item_code = get_item_code(shopify_item, item_resolver)
 			items.append(
 				{
 					"item_code": item_code,
@@ -203,15 +275,14 @@ def _get_total_discount(line_item) -> float:
 
 def get_order_taxes(shopify_order, setting, items):
 	taxes = []
+	context = get_lookup_context()
 	line_items = shopify_order.get("line_items")
+	item_resolver = get_item_resolver(shopify_order.get("id"), line_items)
 	vsaccount=''
 	vcenter=''
 	for line_item in line_items:
-		item_code = get_item_code(line_item)
-		vsett=frappe.db.get_value('Vendor Account Mapping', {'parent':'Shopify Setting','vendor':line_item.get("vendor")}, ['shipping_revenue_account','vendor_cost_center'], as_dict=1)
-		if not vsett:
-			vsett=frappe.db.get_value('Vendor Account Mapping', {'parent':'Shopify Setting','vendor':''}, ['shipping_revenue_account','vendor_cost_center'], as_dict=1)
-		
+		item_code = get_item_code(line_item, item_resolver)
+		vsett = context.get_vendor_accounts(line_item.get("vendor"))
 		if vsett:
 			vsaccount=vsett.shipping_revenue_account
 			vcenter=vsett.vendor_cost_center
@@ -219,9 +290,10 @@ def get_order_taxes(shopify_order, setting, items):
 			taxes.append(
 				{
 					"charge_type": "Actual",
-					"account_head": get_tax_account_head(tax, charge_type="sales_tax"),
+					"account_head": get_tax_account_head(tax, charge_type="sales_tax", context=context),
 					"description": (
-						get_tax_account_description(tax) or f"{tax.get('title')} - {tax.get('rate') * 100.0:.2f}%"
+						get_tax_account_description(tax, context=context)
+						or f"{tax.get('title')} - {tax.get('rate') * 100.0:.2f}%"
 					),
 					"tax_amount": tax.get("price"),
 					"included_in_print_rate": 0,
@@ -237,6 +309,7 @@ def get_order_taxes(shopify_order, setting, items):
 		setting,
 		items, vsaccount, vcenter,
 		taxes_inclusive=shopify_order.get("taxes_included"),
+		context=context,
 	)
 
 	if cint(setting.consolidate_taxes):
@@ -274,15 +347,16 @@ def consolidate_order_taxes(taxes):
 	return tax_account_wise_data.values()
 
 
-def get_tax_account_head(tax, charge_type: Optional[Literal["shipping", "sales_tax"]] = None):
-	tax_title = str(tax.get("title"))
-
-	tax_account = frappe.db.get_value(
-		"Shopify Tax Account", {"parent": SETTING_DOCTYPE, "shopify_tax": tax_title}, "tax_account",
-	)
+def get_tax_account_head(
+	tax,
+	charge_type: Optional[Literal["shipping", "sales_tax"]] = None,
+	context: Optional[OrderLookupContext] = None,
+):
+	context = context or get_lookup_context()
+	tax_account = context.get_tax_account(tax.get("title"))
 
 	if not tax_account and charge_type:
-		tax_account = frappe.db.get_single_value(SETTING_DOCTYPE, DEFAULT_TAX_FIELDS[charge_type])
+		tax_account = context.default_tax_accounts[charge_type]
 
 	if not tax_account:
 		frappe.throw(_("Tax Account not specified for Shopify Tax {0}").format(tax.get("title")))
@@ -290,19 +364,17 @@ def get_tax_account_head(tax, charge_type: Optional[Literal["shipping", "sales_t
 	return tax_account
 
 
-def get_tax_account_description(tax):
-	tax_title = tax.get("title")
+def get_tax_account_description(tax, context: Optional[OrderLookupContext] = None):
+	context = context or get_lookup_context()
+	return context.get_tax_description(tax.get("title"))
 
-	tax_description = frappe.db.get_value(
-		"Shopify Tax Account", {"parent": SETTING_DOCTYPE, "shopify_tax": tax_title}, "tax_description",
-	)
 
-	return tax_description
-
-
-def update_taxes_with_shipping_lines(taxes, shipping_lines, setting, items, vsaccount, vcenter, taxes_inclusive=False):
+def update_taxes_with_shipping_lines(
+	taxes, shipping_lines, setting, items, vsaccount, vcenter, taxes_inclusive=False, context=None
+):
 	"""Shipping lines represents the shipping details,
 	each such shipping detail consists of a list of tax_lines"""
+	context = context or get_lookup_context()
 	shipping_as_item = cint(setting.add_shipping_as_item) and setting.shipping_item
 	for shipping_charge in shipping_lines:
 		if shipping_charge.get("price"):
@@ -333,8 +405,12 @@ def update_taxes_with_shipping_lines(taxes, shipping_lines, setting, items, vsac
 				taxes.append(
 					{
 						"charge_type": "Actual",
-						"account_head": get_tax_account_head(shipping_charge, charge_type="shipping"),
-						"description": get_tax_account_description(shipping_charge) or shipping_charge["title"],
+						"account_head": get_tax_account_head(
+							shipping_charge, charge_type="shipping", context=context
+						),
+						"description": (
+							get_tax_account_description(shipping_charge, context=context) or shipping_charge["title"]
+						),
 						"tax_amount": shipping_charge_amount,
 						"cost_center": vcenter or setting.cost_center,
 					}
@@ -344,9 +420,11 @@ def update_taxes_with_shipping_lines(taxes, shipping_lines, setting, items, vsac
 			taxes.append(
 				{
 					"charge_type": "Actual",
-					"account_head": vsaccount or get_tax_account_head(tax, charge_type="sales_tax"),
+					"account_head": vsaccount
+					or get_tax_account_head(tax, charge_type="sales_tax", context=context),
 					"description": (
-						get_tax_account_description(tax) or f"{tax.get('title')} - {tax.get('rate') * 100.0:.2f}%"
+						get_tax_account_description(tax, context=context)
+						or f"{tax.get('title')} - {tax.get('rate') * 100.0:.2f}%"
 					),
 					"tax_amount": tax["price"],
 					"cost_center": vcenter or setting.cost_center,
@@ -360,11 +438,13 @@ def update_taxes_with_shipping_lines(taxes, shipping_lines, setting, items, vsac
 			)
 
 
-def get_sales_order(order_id):
+def get_sales_order(order_id, order_documents=None):
 	"""Get ERPNext sales order using shopify order id."""
-	sales_order = frappe.db.get_value("Sales Order", filters={ORDER_ID_FIELD: order_id})
-	if sales_order:
-		return frappe.get_doc("Sales Order", sales_order)
+	if order_documents is None:
+		order_documents = get_order_documents(order_id)
+
+	if order_documents.sales_order:
+		return frappe.get_doc("Sales Order", order_documents.sales_order)
 
 
 def cancel_order(payload, request_id=None):
@@ -385,20 +465,25 @@ def cancel_order(payload, request_id=None):
 		order_id = order["id"]
 		order_status = order["financial_status"]
 
-		sales_order = get_sales_order(order_id)
+		order_documents = get_order_documents(order_id)
+		sales_order = get_sales_order(order_id, order_documents)
 
 		if not sales_order:
 			create_shopify_log(status="Invalid", message="Sales Order does not exist")
 			return
 
-		sales_invoice = frappe.db.get_value("Sales Invoice", filters={ORDER_ID_FIELD: order_id})
-		delivery_notes = frappe.db.get_list("Delivery Note", filters={ORDER_ID_FIELD: order_id})
+		all_docstatus = (0, 1, 2)
+		sales_invoices = order_documents.get_names("Sales Invoice", is_return=None, docstatus=all_docstatus)
+		sales_invoice = sales_invoices[0] if sales_invoices else None
+		delivery_notes = order_documents.get_names(
+			"Delivery Note", is_return=None, docstatus=all_docstatus
+		)
 
 		if sales_invoice:
 			frappe.db.set_value("Sales Invoice", sales_invoice, ORDER_STATUS_FIELD, order_status)
 
 		for dn in delivery_notes:
-			frappe.db.set_value("Delivery Note", dn.name, ORDER_STATUS_FIELD, order_status)
+			frappe.db.set_value("Delivery Note", dn, ORDER_STATUS_FIELD, order_status)
 
 		if not sales_invoice and not delivery_notes and sales_order.docstatus == 1:
 			sales_order.cancel()
@@ -413,21 +498,10 @@ def cancel_order(payload, request_id=None):
 
 @temp_shopify_session
 def sync_old_orders():
-	shopify_setting = frappe.get_cached_doc(SETTING_DOCTYPE)
-	if not cint(shopify_setting.sync_old_orders):
-		return
-
-	orders = _fetch_old_orders(shopify_setting.old_orders_from, shopify_setting.old_orders_to)
-
-	for order in orders:
-		log = create_shopify_log(
-			method=EVENT_MAPPER["orders/create"], request_data=json.dumps(order), make_new=True
-		)
-		sync_sales_order(order, request_id=log.name)
+	"""Called by scheduler, see `order_backfill` for details."""
+	from ecommerce_integrations.shopify.order_backfill import schedule_backfill
 
-	shopify_setting = frappe.get_doc(SETTING_DOCTYPE)
-	shopify_setting.sync_old_orders = 0
-	shopify_setting.save()
+	schedule_backfill()
 
 
 def _fetch_old_orders(from_time, to_time):
@@ -435,21 +509,26 @@ def _fetch_old_orders(from_time, to_time):
 
 	from_time = get_datetime(from_time).astimezone().isoformat()
 	to_time = get_datetime(to_time).astimezone().isoformat()
-	orders_iterator = PaginatedIterator(
-		Order.find(created_at_min=from_time, created_at_max=to_time, limit=250)
+	orders = call_with_rate_limit(
+		Order.find, created_at_min=from_time, created_at_max=to_time, limit=250, caller="old_orders"
 	)
 
-	for orders in orders_iterator:
+	while True:
 		for order in orders:
 			# Using generator instead of fetching all at once is better for
 			# avoiding rate limits and reducing resource usage.
 			yield order.to_dict()
 
+		if not orders.has_next_page():
+			break
+		orders = call_with_rate_limit(orders.next_page, caller="old_orders")
+
 def refund(payload, request_id=None):
 	refunds = payload
 	frappe.set_user("Administrator")
 	frappe.flags.request_id = request_id
-	order_id=frappe.db.get_value("Sales Order", filters={ORDER_ID_FIELD: cstr(refunds["order_id"])})
+	order_documents = get_order_documents(refunds["order_id"])
+	order_id = order_documents.sales_order
 	setting = frappe.get_doc(SETTING_DOCTYPE)
 	ermsg=''
 	if not order_id:
@@ -477,6 +556,7 @@ def refund(payload, request_id=None):
 
 		rline_items=refunds.get("refund_line_items")
 		order=frappe.get_doc("Sales Order",order_id)
+		item_resolver = get_item_resolver(refunds["order_id"], [r.get("line_item") for r in rline_items])
 		
 		for rlinei in rline_items:
 			rline=rlinei.get("line_item")
@@ -484,9 +564,7 @@ def refund(payload, request_id=None):
 			subtotal=rlinei.get('subtotal') or 0
 			product_amt=subtotal-tax
 			qty=rline.get("quantity")
-			item_code=frappe.db.get_value('Ecommerce Item',{'integration_item_code':rline.get('product_id'),'variant_id':rline.get('variant_id')},'erpnext_item_code')
-			if not item_code and rline.get('sku'):
-				item_code=frappe.db.get_value('Ecommerce Item',{'integration_item_code':rline.get('product_id'),'sku':rline.get('sku')},'erpnext_item_code')
+			item_code = get_item_code(rline, item_resolver)
 			reitem.append(item_code)
 			refunditm.append({"item_code":item_code,"amt":product_amt,"tax":tax,"qty":qty})
 		
@@ -494,7 +572,8 @@ def refund(payload, request_id=None):
 		items=[]
 		taxes=[]
 
-		delivary_note=frappe.db.get_value("Delivery Note",{"is_return":0,"shopify_order_id":order.shopify_order_id,"shopify_order_number":order.shopify_order_number},'name')
+		delivery_notes = order_documents.get_names("Delivery Note")
+		delivary_note = delivery_notes[0] if delivery_notes else None
 		if delivary_note:
 			delivarynote_doc=frappe.get_doc("Delivery Note",delivary_note)
 			delivary_note_doc=frappe.copy_doc(delivarynote_doc)
@@ -578,10 +657,21 @@ def refund(payload, request_id=None):
 			#----------- credit note-------------------------------
 			items=[]
 			taxes=[]
-			sales_invoice=''
-			sinv=frappe.db.sql(""" select name from `tabSales Invoice` where status="Paid" and shopify_order_id="{0}" and shopify_order_number="{1}" """.format(order.shopify_order_id,order.shopify_order_number),as_dict=1)
-			if len(sinv):
-				sales_invoice=sinv[0].name
+			sales_invoices = frappe.get_all(
+				"Sales Invoice",
+				filters={
+					"name": ("in", order_documents.get_names("Sales Invoice", docstatus=(1,))),
+					"status": "Paid",
+				},
+				order_by="creation asc",
+				pluck="name",
+			)
+			if not sales_invoices:
+				create_shopify_log(
+					status="Invalid", message="Paid Sales Invoice not found, refund not synced", rollback=True
+				)
+				return
+			sales_invoice = sales_invoices[0]
 
 			posting_date = getdate(refunds.get("created_at")) or nowdate()
 			salesinv_doc=frappe.get_doc("Sales Invoice",sales_invoice)
@@ -667,10 +757,13 @@ def refund(payload, request_id=None):
 			from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
 			pentry=get_payment_entry('Sales Invoice',inv.name)
 			pentry.reference_no = str(order.shopify_order_number)+" Refund"
-			ordpay=frappe.db.sql(""" select paid_from,paid_to from `tabPayment Entry` where reference_no in (select s.name from `tabSales Invoice Item` i left join `tabSales Invoice` s on i.parent=s.name where s.status="Paid" and i.sales_order="{0}") """.format(order_id),as_dict=1)
-			if len(ordpay):
-				pentry.paid_from=ordpay[0].paid_to
-				pentry.paid_to=ordpay[0].paid_from
+			payment_entries = order_documents.get_payment_entries(against=sales_invoices)
+			if payment_entries:
+				ordpay = frappe.db.get_value(
+					"Payment Entry", payment_entries[0], ["paid_from", "paid_to"], as_dict=True
+				)
+				pentry.paid_from=ordpay.paid_to
+				pentry.paid_to=ordpay.paid_from
 			pentry.update({'reference_date': nowdate()})
 			ermsg=str(pentry.as_dict())
 			pentry.save()
@@ -0,0 +1,244 @@
+"""Resumable backfill of old Shopify orders.
+
+Date range configured in Shopify Setting is split into windows of
+`WINDOW_DAYS`. Every window is synced by its own background job and tracked by
+an Ecommerce Sync Run. Up to `MAX_PARALLEL_WINDOWS` windows are synced in
+parallel.
+
+Orders of a window are fetched in ascending order of id, the last synced id is
+checkpointed as cursor of the window run after every page. A window that was
+interrupted is resumed from its cursor by the next scheduling.
+
+"Sync Old Orders" is unchecked once all windows are completed.
+"""
+
+import json
+from datetime import timedelta
+from typing import Iterator, List, Optional, Tuple
+
+import frappe
+from frappe.utils import cint, flt, get_datetime, now, time_diff_in_seconds
+from shopify.resources import Order
+
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_integration_log.ecommerce_integration_log import (
+	log_session,
+)
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_sync_run.ecommerce_sync_run import (
+	EcommerceSyncRun,
+	start_sync_run,
+)
+from ecommerce_integrations.shopify.connection import temp_shopify_session
+from ecommerce_integrations.shopify.constants import EVENT_MAPPER, MODULE_NAME, SETTING_DOCTYPE
+from ecommerce_integrations.shopify.doctype.shopify_order_link.shopify_order_link import (
+	get_order_documents,
+)
+from ecommerce_integrations.shopify.rate_limiter import call_with_rate_limit
+from ecommerce_integrations.shopify.utils import create_shopify_log
+
+BACKFILL_SYNC_TYPE = "Order Backfill"
+SCHEDULE_LOCK_KEY = "shopify_order_backfill_lock"
+
+WINDOW_DAYS = 7
+MAX_PARALLEL_WINDOWS = 4
+PAGE_SIZE = 250
+JOB_TIMEOUT = 4 * 60 * 60
+
+
+def schedule_backfill() -> None:
+	"""Enqueue jobs for windows which are neither completed nor being synced.
+
+	Called by scheduler and by every window job once it ends."""
+	setting = frappe.get_cached_doc(SETTING_DOCTYPE)
+	if not cint(setting.sync_old_orders):
+		return
+
+	cache = frappe.cache()
+	lock_key = cache.make_key(SCHEDULE_LOCK_KEY)
+	if not cache.set(lock_key, 1, nx=True, ex=60):
+		return
+
+	try:
+		windows = get_backfill_windows(setting.old_orders_from, setting.old_orders_to)
+		runs = _get_window_runs(windows)
+
+		running = 0
+		pending = []
+		for window in windows:
+			run = runs.get(window)
+			if run and run.status == "Completed":
+				continue
+			if run and not run.is_interrupted():
+				running += 1
+				continue
+			pending.append((window, run))
+
+		if not pending and not running:
+			_finish_backfill(list(runs.values()))
+			return
+
+		for window, run in pending[: max(MAX_PARALLEL_WINDOWS - running, 0)]:
+			_enqueue_window(window, run)
+	finally:
+		cache.delete(lock_key)
+
+
+def get_backfill_windows(from_time, to_time) -> List[Tuple[str, str]]:
+	"""Split date range in windows of `WINDOW_DAYS`, windows are (from, to) datetime strings."""
+	start, end = get_datetime(from_time), get_datetime(to_time)
+
+	windows = []
+	while start < end:
+		window_end = min(start + timedelta(days=WINDOW_DAYS), end)
+		windows.append((str(start), str(window_end)))
+		start = window_end
+
+	return windows
+
+
+@temp_shopify_session
+def backfill_window(run_name: str) -> None:
+	run = frappe.get_doc("Ecommerce Sync Run", run_name)
+
+	try:
+		_sync_window(run)
+	except Exception as e:
+		frappe.db.rollback()
+		run.fail(e)
+		create_shopify_log(
+			status="Error",
+			exception=e,
+			method="ecommerce_integrations.shopify.order_backfill.backfill_window",
+			request_data=run.get_data(),
+			make_new=True,
+		)
+	else:
+		run.complete()
+
+	schedule_backfill()
+
+
+def _sync_window(run: EcommerceSyncRun) -> None:
+	# local import to avoid circular imports
+	from ecommerce_integrations.shopify.order import sync_sales_order
+
+	window = run.get_data()
+
+	if not cint(run.total_rows):
+		total = call_with_rate_limit(
+			Order.count,
+			created_at_min=_iso(window["from"]),
+			created_at_max=_iso(window["to"]),
+			caller="old_orders",
+		)
+		run.db_set({"total_rows": total, "rows_remaining": max(total - cint(run.rows_done), 0)})
+
+	for orders in _fetch_order_pages(window["from"], window["to"], since_id=cint(run.cursor)):
+		for order in orders:
+			# windows overlap at their boundary and resumed pages can be partially synced.
+			if get_order_documents(order["id"]).sales_order:
+				continue
+
+			with log_session():
+				log = create_shopify_log(
+					method=EVENT_MAPPER["orders/create"], request_data=json.dumps(order), make_new=True
+				)
+				sync_sales_order(order, request_id=log.name)
+
+		run.checkpoint(rows_done=len(orders), cursor=orders[-1]["id"])
+		frappe.db.commit()
+
+
+def _fetch_order_pages(from_time, to_time, since_id: int = 0) -> Iterator[List[dict]]:
+	"""Fetch orders created in range with id greater than `since_id`, one page at a time."""
+	orders = call_with_rate_limit(
+		Order.find,
+		created_at_min=_iso(from_time),
+		created_at_max=_iso(to_time),
+		since_id=since_id,
+		limit=PAGE_SIZE,
+		caller="old_orders",
+	)
+
+	while orders:
+		yield [order.to_dict() for order in orders]
+
+		if not orders.has_next_page():
+			break
+		orders = call_with_rate_limit(orders.next_page, caller="old_orders")
+
+
+def _enqueue_window(window: Tuple[str, str], run: Optional[EcommerceSyncRun]) -> None:
+	if run:
+		# mark as active again, so that it isn't counted as interrupted while job is queued.
+		run.db_set({"status": "Running", "error": None, "last_checkpoint_on": now()}, commit=True)
+	else:
+		run = start_sync_run(
+			MODULE_NAME, _get_sync_type(window), data={"from": window[0], "to": window[1]}
+		)
+
+	frappe.enqueue(
+		method="ecommerce_integrations.shopify.order_backfill.backfill_window",
+		queue="long",
+		timeout=JOB_TIMEOUT,
+		is_async=True,
+		job_id=f"shopify_order_backfill::{run.name}",
+		deduplicate=True,
+		run_name=run.name,
+	)
+
+
+def _get_window_runs(windows: List[Tuple[str, str]]) -> dict:
+	"""Get latest sync run of each window, {window: run}."""
+	sync_types = {_get_sync_type(window): window for window in windows}
+	runs = frappe.get_all(
+		"Ecommerce Sync Run",
+		filters={"integration": MODULE_NAME, "sync_type": ("in", list(sync_types))},
+		fields=["name", "sync_type"],
+		order_by="creation desc",
+	)
+
+	window_runs = {}
+	for run in runs:
+		window = sync_types[run.sync_type]
+		if window not in window_runs:
+			window_runs[window] = frappe.get_doc("Ecommerce Sync Run", run.name)
+	return window_runs
+
+
+def _finish_backfill(runs: List[EcommerceSyncRun]) -> None:
+	create_shopify_log(
+		status="Success",
+		method="ecommerce_integrations.shopify.order_backfill.schedule_backfill",
+		message=get_throughput_report(runs),
+		make_new=True,
+	)
+
+	setting = frappe.get_doc(SETTING_DOCTYPE)
+	setting.sync_old_orders = 0
+	setting.save()
+
+
+def get_throughput_report(runs: List[EcommerceSyncRun]) -> str:
+	total_orders = sum(cint(run.rows_done) for run in runs)
+	started_on = min((get_datetime(run.started_on) for run in runs), default=None)
+	completed_on = max((get_datetime(run.completed_on) for run in runs if run.completed_on), default=None)
+
+	minutes = time_diff_in_seconds(completed_on, started_on) / 60 if started_on and completed_on else 0
+	rate = flt(total_orders / minutes, 2) if minutes > 0 else 0
+
+	lines = [
+		f"Synced {total_orders} orders in {len(runs)} windows and {flt(minutes, 1)} minutes"
+		f" ({rate} orders/minute)."
+	]
+	lines.extend(
+		f"{run.sync_type}: {cint(run.rows_done)} orders, {flt(run.rate)} orders/minute" for run in runs
+	)
+	return "\n".join(lines)
+
+
+def _get_sync_type(window: Tuple[str, str]) -> str:
+	return f"{BACKFILL_SYNC_TYPE}: {window[0]} - {window[1]}"
+
+
+def _iso(timestamp) -> str:
+	return get_datetime(timestamp).astimezone().isoformat()
@@ -0,0 +1,426 @@
+"""Per order sequencing of Shopify webhook events.
+
+Shopify sends every change of an order (create, paid, fulfilled, refund...) as
+an independent webhook. If each of them runs as an independent job they run
+concurrently and out of order, e.g. payment before the order itself is synced.
+
+Events are instead queued per Shopify order and only one job drains the queue
+of an order at a time. Different orders are still processed in parallel.
+
+If "Webhook Batch Size" is set, ready orders are not processed by a job of their
+own but collected and processed in batches by a few consumer jobs. Every event
+of a batch runs inside its own savepoint and the batch is committed once. Orders
+can wait in the ready list longer than the lock timeout, so their lock is only
+taken once a consumer pops them.
+
+Popped events are moved to an in-flight list of the order and only removed from
+it once their changes are committed. Events left in-flight or queued by a job
+that died are picked up again by the `requeue_stale_events` sweep.
+"""
+
+import json
+import time
+from typing import Iterable, Iterator, List, Set
+
+import frappe
+from frappe.utils import add_to_date, cint, cstr, now_datetime
+
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_integration_log.ecommerce_integration_log import (
+	decompress_payload,
+	set_savepoint,
+)
+from ecommerce_integrations.shopify.connection import process_queued_request
+from ecommerce_integrations.shopify.constants import EVENT_MAPPER, MODULE_NAME, SETTING_DOCTYPE
+from ecommerce_integrations.shopify.doctype.shopify_order_link.shopify_order_link import (
+	get_order_documents,
+)
+from ecommerce_integrations.shopify.utils import create_shopify_log
+
+EVENTS_KEY = "shopify_order_events:{}"
+PARKED_EVENTS_KEY = "shopify_order_parked_events:{}"
+INFLIGHT_EVENTS_KEY = "shopify_order_inflight_events:{}"
+LOCK_KEY = "shopify_order_lock:{}"
+PARKED_ORDERS_KEY = "shopify_parked_orders"
+READY_ORDERS_KEY = "shopify_ready_orders"
+READY_KEY = "shopify_order_ready:{}"
+CONSUMER_KEY = "shopify_order_consumer:{}"
+
+JOB_TIMEOUT = 25 * 60
+# events of an order are processed in a single job, lock is refreshed after every event.
+LOCK_TIMEOUT = JOB_TIMEOUT
+
+# max number of batch consumer jobs running in parallel
+MAX_CONSUMERS = 4
+
+# events which can't be processed without the sales order
+DEPENDENT_EVENTS = {
+	"orders/paid",
+	"orders/fulfilled",
+	"orders/partially_fulfilled",
+	"orders/cancelled",
+	"refunds/create",
+}
+# consecutive events of these types are collapsed into the newest one
+COALESCED_EVENTS = {"orders/updated"}
+
+# dependent events wait at most this long for `orders/create` before running anyway
+MAX_PARKING_TIME = 60 * 60
+
+# "Queued" logs older than this which aren't queued anywhere are queued again
+STALE_LOG_TIME = 15 * 60
+
+
+def get_order_id(payload, event):
+	if event.startswith("refunds/"):
+		return cstr(payload.get("order_id"))
+	if event.startswith("orders/"):
+		return cstr(payload.get("id"))
+
+
+def push_event(order_id: str, event: str, request_id: str) -> None:
+	"""Add event to queue of order and make sure the queue is being processed."""
+	cache = frappe.cache()
+	cache.rpush(EVENTS_KEY.format(order_id), json.dumps({"event": event, "request_id": request_id}))
+	_schedule(order_id)
+
+
+def _schedule(order_id: str, force: bool = False) -> None:
+	if _get_batch_size() and not force:
+		_mark_ready(order_id)
+		return
+
+	if not _acquire_lock(order_id):
+		# another job is processing this order, it will pick up new events.
+		return
+
+	frappe.enqueue(
+		method="ecommerce_integrations.shopify.order_queue.process_order_events",
+		queue="short",
+		timeout=JOB_TIMEOUT,
+		is_async=True,
+		order_id=order_id,
+		force=force,
+	)
+
+
+def process_order_events(order_id: str, force: bool = False) -> None:
+	"""Process all queued events of an order one by one.
+
+	Expects the order lock to be held by caller (see `_schedule`)."""
+	try:
+		for events in _iter_events(order_id):
+			_process_events(order_id, events, force=force)
+			# handlers commit their own changes
+			_ack_events(order_id)
+			force = False
+	finally:
+		_release_lock(order_id)
+
+	# events queued after last pop but before releasing lock
+	if frappe.cache().llen(EVENTS_KEY.format(order_id)):
+		_schedule(order_id)
+
+
+def consume_ready_orders(slot: int) -> None:
+	"""Process ready orders in batches, committing once per batch.
+
+	Expects the consumer slot to be held by caller (see `_ensure_consumer`)."""
+	batch_size = _get_batch_size()
+	cache = frappe.cache()
+
+	try:
+		while order_ids := _pop_ready_orders(batch_size or 1):
+			_process_batch(order_ids)
+			cache.expire(cache.make_key(CONSUMER_KEY.format(slot)), LOCK_TIMEOUT)
+	finally:
+		cache.delete(cache.make_key(CONSUMER_KEY.format(slot)))
+
+		# orders marked ready after last pop but before releasing slot, or left by a failed batch
+		if cache.llen(READY_ORDERS_KEY):
+			_ensure_consumer()
+
+
+def _mark_ready(order_id: str) -> None:
+	"""Add order to ready list, its lock is taken by the consumer popping it (see `_process_batch`)."""
+	if _is_locked(order_id):
+		# another job is processing this order, it will pick up new events.
+		return
+
+	cache = frappe.cache()
+	# marker makes sure that an order is in ready list only once, duplicates left after
+	# it expires are harmless as the lock is taken on pop.
+	if cache.set(cache.make_key(READY_KEY.format(order_id)), 1, nx=True, ex=LOCK_TIMEOUT):
+		cache.rpush(READY_ORDERS_KEY, order_id)
+		_ensure_consumer()
+
+
+def _process_batch(order_ids: List[str]) -> None:
+	# orders locked by another job are skipped, that job schedules them again if needed.
+	order_ids = [order_id for order_id in order_ids if _acquire_lock(order_id)]
+
+	frappe.flags.integration_log_savepoint = "shopify_webhook"
+	try:
+		for order_id in order_ids:
+			for events in _iter_events(order_id):
+				_process_events(order_id, events)
+		frappe.db.commit()
+
+		for order_id in order_ids:
+			_ack_events(order_id)
+	except Exception:
+		# nothing of the batch is committed, popped events are still in-flight and
+		# are processed again once their orders are scheduled, see `requeue_stale_events`.
+		frappe.db.rollback()
+		raise
+	finally:
+		frappe.flags.integration_log_savepoint = None
+		frappe.flags.integration_log_callbacks = None
+		# release only after commit, so next job can see the changes.
+		for order_id in order_ids:
+			_release_lock(order_id)
+
+	for order_id in order_ids:
+		if frappe.cache().llen(EVENTS_KEY.format(order_id)):
+			_schedule(order_id)
+
+
+def _pop_ready_orders(count: int) -> List[str]:
+	cache = frappe.cache()
+	key = cache.make_key(READY_ORDERS_KEY)
+
+	pipe = cache.pipeline()
+	pipe.lrange(key, 0, count - 1)
+	pipe.ltrim(key, count, -1)
+	order_ids, _ = pipe.execute()
+
+	order_ids = [frappe.safe_decode(order_id) for order_id in order_ids]
+	if order_ids:
+		cache.delete(*[cache.make_key(READY_KEY.format(order_id)) for order_id in order_ids])
+	return order_ids
+
+
+def _ensure_consumer() -> None:
+	cache = frappe.cache()
+	for slot in range(MAX_CONSUMERS):
+		if cache.set(cache.make_key(CONSUMER_KEY.format(slot)), 1, nx=True, ex=LOCK_TIMEOUT):
+			frappe.enqueue(
+				method="ecommerce_integrations.shopify.order_queue.consume_ready_orders",
+				queue="short",
+				timeout=JOB_TIMEOUT,
+				is_async=True,
+				slot=slot,
+			)
+			return
+
+
+def _get_batch_size() -> int:
+	return cint(frappe.db.get_single_value(SETTING_DOCTYPE, "webhook_batch_size", cache=True))
+
+
+def process_parked_orders() -> None:
+	"""Run events that waited too long for their sales order.
+
+	Called by scheduler. Events run anyway and are logged as invalid by their
+	handlers, so they can be retried from the log once the order is fixed."""
+	cache = frappe.cache()
+	cutoff = time.time() - MAX_PARKING_TIME
+
+	for order_id in cache.zrangebyscore(cache.make_key(PARKED_ORDERS_KEY), 0, cutoff):
+		_schedule(frappe.safe_decode(order_id), force=True)
+
+
+def requeue_stale_events() -> None:
+	"""Pick up events left behind by jobs that died, e.g. killed or timed out.
+
+	Called by scheduler. Orders with queued or in-flight events that no job holds
+	the lock of are scheduled again. Webhook logs still "Queued" long after they
+	were received, but not queued anywhere, are pushed to their order again."""
+	for order_id in _get_orders_with_events():
+		if not _is_locked(order_id):
+			_schedule(order_id)
+
+	methods = {method: event for event, method in EVENT_MAPPER.items()}
+	logs = frappe.get_all(
+		"Ecommerce Integration Log",
+		filters={
+			"integration": MODULE_NAME,
+			"status": "Queued",
+			"method": ("in", list(methods)),
+			"modified": ("<", add_to_date(now_datetime(), seconds=-STALE_LOG_TIME)),
+		},
+		fields=["name", "method", "request_data"],
+		order_by="modified asc",
+		limit=500,
+	)
+
+	for log in logs:
+		event = methods[log.method]
+		order_id = get_order_id(json.loads(decompress_payload(log.request_data)), event)
+		if not order_id or _is_locked(order_id) or log.name in _get_queued_request_ids(order_id):
+			continue
+		push_event(order_id, event, log.name)
+
+
+def _process_events(order_id: str, events: List[dict], force: bool = False) -> None:
+	events = _coalesce_events(events)
+	order_exists = _sales_order_exists(order_id)
+
+	if not order_exists:
+		# process order creation first if it arrived after dependent events.
+		events.sort(key=lambda e: e["event"] != "orders/create")
+
+	for idx, event in enumerate(events):
+		if event["event"] in DEPENDENT_EVENTS and not order_exists and not force:
+			_park_events(order_id, events[idx:])
+			return
+
+		_run_event(event)
+		_refresh_lock(order_id)
+
+		if event["event"] == "orders/create":
+			order_exists = _sales_order_exists(order_id)
+
+	frappe.cache().zrem(frappe.cache().make_key(PARKED_ORDERS_KEY), order_id)
+
+
+def _coalesce_events(events: List[dict]) -> List[dict]:
+	coalesced = []
+	for event in events:
+		previous = coalesced[-1] if coalesced else None
+		if previous and previous["event"] == event["event"] and event["event"] in COALESCED_EVENTS:
+			_mark_superseded(previous)
+			coalesced[-1] = event
+		else:
+			coalesced.append(event)
+	return coalesced
+
+
+def _run_event(event: dict) -> None:
+	status = frappe.db.get_value("Ecommerce Integration Log", event["request_id"], "status")
+	if status != "Queued":
+		# processed by a job that died before its events were acknowledged
+		return
+
+	frappe.flags.request_id = event["request_id"]
+
+	savepoint = frappe.flags.integration_log_savepoint
+	if savepoint:
+		set_savepoint(savepoint)
+
+	try:
+		process_queued_request(event["request_id"])
+	except Exception as e:
+		# handlers log their own errors, this is for failures outside of them.
+		create_shopify_log(status="Error", exception=e, rollback=True)
+	finally:
+		frappe.flags.request_id = None
+
+
+def _mark_superseded(event: dict) -> None:
+	frappe.db.set_value(
+		"Ecommerce Integration Log",
+		event["request_id"],
+		{"status": "Success", "message": "Skipped, superseded by a newer event"},
+	)
+	if not frappe.flags.integration_log_savepoint:
+		frappe.db.commit()
+
+
+def _sales_order_exists(order_id: str) -> bool:
+	return bool(get_order_documents(order_id).sales_order)
+
+
+def _iter_events(order_id: str) -> Iterator[List[dict]]:
+	"""Yield events of an order until its queue is empty.
+
+	Events left in-flight by a job that died are yielded first."""
+	if events := _get_inflight_events(order_id):
+		yield events
+
+	while events := _pop_events(order_id):
+		yield events
+
+
+def _pop_events(order_id: str) -> List[dict]:
+	"""Move parked and queued events of an order to its in-flight list and return them.
+
+	Every move is atomic, an event is always either queued or in-flight."""
+	cache = frappe.cache()
+	inflight_key = cache.make_key(INFLIGHT_EVENTS_KEY.format(order_id))
+
+	events = []
+	for key in (PARKED_EVENTS_KEY, EVENTS_KEY):
+		source_key = cache.make_key(key.format(order_id))
+		while event := cache.lmove(source_key, inflight_key, "LEFT", "RIGHT"):
+			events.append(event)
+
+	return _unique_events(json.loads(e) for e in events)
+
+
+def _get_inflight_events(order_id: str) -> List[dict]:
+	events = frappe.cache().lrange(INFLIGHT_EVENTS_KEY.format(order_id), 0, -1)
+	return _unique_events(json.loads(e) for e in events)
+
+
+def _ack_events(order_id: str) -> None:
+	"""Forget in-flight events of an order, once their changes are committed."""
+	cache = frappe.cache()
+	cache.delete(cache.make_key(INFLIGHT_EVENTS_KEY.format(order_id)))
+
+
+def _unique_events(events: Iterable[dict]) -> List[dict]:
+	# an event can be both parked and in-flight if job died after parking it.
+	unique, seen = [], set()
+	for event in events:
+		if event["request_id"] not in seen:
+			seen.add(event["request_id"])
+			unique.append(event)
+	return unique
+
+
+def _get_orders_with_events() -> Set[str]:
+	cache = frappe.cache()
+
+	order_ids = set()
+	for key in (EVENTS_KEY, INFLIGHT_EVENTS_KEY):
+		for name in cache.scan_iter(match=cache.make_key(key.format("*"))):
+			order_ids.add(frappe.safe_decode(name).rsplit(":", 1)[-1])
+	return order_ids
+
+
+def _get_queued_request_ids(order_id: str) -> Set[str]:
+	cache = frappe.cache()
+
+	request_ids = set()
+	for key in (PARKED_EVENTS_KEY, EVENTS_KEY, INFLIGHT_EVENTS_KEY):
+		events = cache.lrange(key.format(order_id), 0, -1)
+		request_ids.update(json.loads(e)["request_id"] for e in events)
+	return request_ids
+
+
+def _park_events(order_id: str, events: List[dict]) -> None:
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	pipe.rpush(cache.make_key(PARKED_EVENTS_KEY.format(order_id)), *[json.dumps(e) for e in events])
+	pipe.zadd(cache.make_key(PARKED_ORDERS_KEY), {order_id: time.time()}, nx=True)
+	pipe.execute()
+
+
+def _acquire_lock(order_id: str) -> bool:
+	cache = frappe.cache()
+	return bool(cache.set(cache.make_key(LOCK_KEY.format(order_id)), 1, nx=True, ex=LOCK_TIMEOUT))
+
+
+def _is_locked(order_id: str) -> bool:
+	cache = frappe.cache()
+	return bool(cache.exists(cache.make_key(LOCK_KEY.format(order_id))))
+
+
+def _refresh_lock(order_id: str) -> None:
+	cache = frappe.cache()
+	cache.expire(cache.make_key(LOCK_KEY.format(order_id)), LOCK_TIMEOUT)
+
+
+def _release_lock(order_id: str) -> None:
+	cache = frappe.cache()
+	cache.delete(cache.make_key(LOCK_KEY.format(order_id)))
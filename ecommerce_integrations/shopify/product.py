@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import frappe
 from frappe import _, msgprint
@@ -6,6 +6,9 @@ from frappe.utils import cint, cstr
 from frappe.utils.nestedset import get_root_of
 from shopify.resources import Product, Variant
 
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_integration_log.ecommerce_integration_log import (
+	clear_on_rollback,
+)
 from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_item import ecommerce_item
 from ecommerce_integrations.shopify.connection import temp_shopify_session
 from ecommerce_integrations.shopify.constants import (
@@ -16,8 +19,12 @@ from ecommerce_integrations.shopify.constants import (
 	SUPPLIER_ID_FIELD,
 	WEIGHT_TO_ERPNEXT_UOM_MAP,
 )
+from ecommerce_integrations.shopify.rate_limiter import call_with_rate_limit
 from ecommerce_integrations.shopify.utils import create_shopify_log
 
+# max page size of Shopify REST API, also used for number of ids per request
+PRODUCT_FETCH_BATCH_SIZE = 250
+
 
 class ShopifyProduct:
 	def __init__(
@@ -26,12 +33,16 @@ class ShopifyProduct:
 		variant_id: Optional[str] = None,
 		sku: Optional[str] = None,
 		has_variants: Optional[int] = 0,
+		setting=None,
+		batch_cache: Optional[Dict] = None,
 	):
 		self.product_id = str(product_id)
 		self.variant_id = str(variant_id) if variant_id else None
 		self.sku = str(sku) if sku else None
 		self.has_variants = has_variants
-		self.setting = frappe.get_doc(SETTING_DOCTYPE)
+		self.setting = setting or frappe.get_doc(SETTING_DOCTYPE)
+		# records created or loaded while syncing, shared by products synced together.
+		self.batch_cache = batch_cache if batch_cache is not None else {}
 
 		if not self.setting.is_enabled():
 			frappe.throw(_("Can not create Shopify product when integration is disabled."))
@@ -53,7 +64,7 @@ class ShopifyProduct:
 	@temp_shopify_session
 	def sync_product(self):
 		if not self.is_synced():
-			shopify_product = Product.find(self.product_id)
+			shopify_product = call_with_rate_limit(Product.find, self.product_id, caller="product")
 			product_dict = shopify_product.to_dict()
 			self._make_item(product_dict)
 
@@ -74,9 +85,12 @@ class ShopifyProduct:
 
 	def _create_attribute(self, product_dict):
 		attribute = []
+		attributes_cache = self.batch_cache.setdefault("Item Attribute", {})
+
 		for attr in product_dict.get("options"):
-			if not frappe.db.get_value("Item Attribute", attr.get("name"), "name"):
-				frappe.get_doc(
+			item_attr = attributes_cache.get(attr.get("name"))
+			if not item_attr and not frappe.db.get_value("Item Attribute", attr.get("name"), "name"):
+				item_attr = frappe.get_doc(
 					{
 						"doctype": "Item Attribute",
 						"attribute_name": attr.get("name"),
@@ -85,14 +99,16 @@ class ShopifyProduct:
 						],
 					}
 				).insert()
+				attributes_cache[item_attr.name] = item_attr
 				attribute.append({"attribute": attr.get("name")})
 
 			else:
 				# check for attribute values
-				item_attr = frappe.get_doc("Item Attribute", attr.get("name"))
+				item_attr = item_attr or frappe.get_doc("Item Attribute", attr.get("name"))
+				attributes_cache[item_attr.name] = item_attr
 				if not item_attr.numeric_values:
-					self._set_new_attribute_values(item_attr, attr.get("values"))
-					item_attr.save()
+					if self._set_new_attribute_values(item_attr, attr.get("values")):
+						item_attr.save()
 					attribute.append({"attribute": attr.get("name")})
 
 				else:
@@ -108,13 +124,17 @@ class ShopifyProduct:
 
 		return attribute
 
-	def _set_new_attribute_values(self, item_attr, values):
+	def _set_new_attribute_values(self, item_attr, values) -> bool:
+		"""Add missing values to attribute, returns True if any value was added."""
+		added = False
 		for attr_value in values:
 			if not any(
 				(d.abbr.lower() == attr_value.lower() or d.attribute_value.lower() == attr_value.lower())
 				for d in item_attr.item_attribute_values
 			):
 				item_attr.append("item_attribute_values", {"attribute_value": attr_value, "abbr": attr_value})
+				added = True
+		return added
 
 	def _create_item(self, product_dict, warehouse, has_variant=0, attributes=None, variant_of=None):
 		
@@ -195,6 +215,12 @@ class ShopifyProduct:
 		return attribute_value[0][0] if len(attribute_value) > 0 else cint(variant_attr_val)
 
 	def _get_item_group(self, product_type=None):
+		item_groups = self.batch_cache.setdefault("Item Group", {})
+		if product_type not in item_groups:
+			item_groups[product_type] = self._get_or_create_item_group(product_type)
+		return item_groups[product_type]
+
+	def _get_or_create_item_group(self, product_type=None):
 		parent_item_group = get_root_of("Item Group")
 
 		if not product_type:
@@ -213,6 +239,13 @@ class ShopifyProduct:
 		return item_group.name
 
 	def _get_supplier(self, product_dict):
+		suppliers = self.batch_cache.setdefault("Supplier", {})
+		vendor = product_dict.get("vendor")
+		if vendor not in suppliers:
+			suppliers[vendor] = self._get_or_create_supplier(product_dict)
+		return suppliers[vendor]
+
+	def _get_or_create_supplier(self, product_dict):
 		if product_dict.get("vendor"):
 			supplier = frappe.db.sql(
 				f"""select name from tabSupplier
@@ -236,6 +269,11 @@ class ShopifyProduct:
 			return ""
 
 	def _get_supplier_group(self):
+		if "Supplier Group" not in self.batch_cache:
+			self.batch_cache["Supplier Group"] = self._get_or_create_supplier_group()
+		return self.batch_cache["Supplier Group"]
+
+	def _get_or_create_supplier_group(self):
 		supplier_group = frappe.db.get_value("Supplier Group", _("Shopify Supplier"))
 		if not supplier_group:
 			supplier_group = frappe.get_doc(
@@ -301,32 +339,149 @@ def _match_sku_and_link_item(
 			return False
 
 
+@temp_shopify_session
 def create_items_if_not_exist(order):
-	"""Using shopify order, sync all items that are not already synced."""
-	for item in order.get("line_items", []):
+	"""Using shopify order, sync all items that are not already synced.
+
+	Missing products are fetched together and created in the current transaction."""
+	line_items = order.get("line_items", [])
+	item_resolver = get_item_resolver(order.get("id"), line_items)
+
+	product_ids = []
+	for item in line_items:
+		product_id = cstr(item["product_id"])
+		if product_id not in product_ids and not item_resolver.get_item_code(item):
+			product_ids.append(product_id)
+
+	if not product_ids:
+		return
+
+	setting = frappe.get_doc(SETTING_DOCTYPE)
+	if not setting.is_enabled():
+		frappe.throw(_("Can not create Shopify product when integration is disabled."))
+
+	batch_cache = {}
+	for shopify_product in _fetch_products(product_ids):
+		product = ShopifyProduct(shopify_product.id, setting=setting, batch_cache=batch_cache)
+		product._make_item(shopify_product.to_dict())
+
+	clear_item_resolver(order.get("id"))
+
+
+def _fetch_products(product_ids: List[str]) -> List[Product]:
+	products = []
+	for start in range(0, len(product_ids), PRODUCT_FETCH_BATCH_SIZE):
+		batch = product_ids[start : start + PRODUCT_FETCH_BATCH_SIZE]
+		products.extend(
+			call_with_rate_limit(
+				Product.find, ids=",".join(batch), limit=PRODUCT_FETCH_BATCH_SIZE, caller="product"
+			)
+		)
+
+	missing = set(product_ids) - {cstr(p.id) for p in products}
+	if missing:
+		frappe.throw(_("Shopify products not found: {0}").format(", ".join(sorted(missing))))
+
+	return products
+
+
+class ItemResolver:
+	"""Resolve ERPNext item codes of Shopify line items.
+
+	Ecommerce Items of all known line items are fetched with a single query,
+	line items which weren't known upfront are fetched on first lookup.
+	Lookup order is the same as `ecommerce_item.get_erpnext_item`: SKU first,
+	then product and variant id."""
+
+	def __init__(self, line_items: Optional[Iterable[Dict]] = None):
+		self._by_sku: Dict[str, str] = {}
+		self._by_variant: Dict[Tuple[str, str], str] = {}
+		self._by_product: Dict[str, str] = {}
+		self._fetched_skus = set()
+		self._fetched_products = set()
+
+		self.fetch(line_items or [])
+
+	def fetch(self, line_items: Iterable[Dict]) -> None:
+		"""Fetch Ecommerce Items of line items which aren't fetched yet."""
+		line_items = list(line_items)
+		skus = {cstr(d.get("sku")) for d in line_items if d.get("sku")} - self._fetched_skus
+		product_ids = {
+			cstr(d.get("product_id")) for d in line_items if d.get("product_id")
+		} - self._fetched_products
+
+		if not skus and not product_ids:
+			return
+
+		or_filters = {}
+		if skus:
+			or_filters["sku"] = ("in", list(skus))
+		if product_ids:
+			or_filters["integration_item_code"] = ("in", list(product_ids))
+
+		ecommerce_items = frappe.get_all(
+			"Ecommerce Item",
+			filters={"integration": MODULE_NAME},
+			or_filters=or_filters,
+			fields=["integration_item_code", "variant_id", "sku", "erpnext_item_code"],
+			order_by="modified desc",
+		)
+
+		# first match wins, same as `frappe.db.get_value`
+		for d in ecommerce_items:
+			if d.sku:
+				self._by_sku.setdefault(d.sku, d.erpnext_item_code)
+			self._by_variant.setdefault((d.integration_item_code, cstr(d.variant_id)), d.erpnext_item_code)
+			self._by_product.setdefault(d.integration_item_code, d.erpnext_item_code)
 
-		product_id = item["product_id"]
-		variant_id = item.get("variant_id")
-		sku = item.get("sku")
-		product = ShopifyProduct(product_id, variant_id=variant_id, sku=sku)
+		self._fetched_skus |= skus
+		self._fetched_products |= product_ids
+
+	def get_item_code(self, shopify_item) -> Optional[str]:
+		self.fetch([shopify_item])
+
+		sku = cstr(shopify_item.get("sku"))
+		product_id = cstr(shopify_item.get("product_id"))
+		variant_id = cstr(shopify_item.get("variant_id"))
+
+		item_code = self._by_sku.get(sku) if sku else None
+		if not item_code:
+			if variant_id:
+				item_code = self._by_variant.get((product_id, variant_id))
+			else:
+				item_code = self._by_product.get(product_id)
 
-		if not product.is_synced():
-			product.sync_product()
+		return item_code
 
 
-def get_item_code(shopify_item):
+def get_item_resolver(order_id, line_items: Optional[Iterable[Dict]] = None) -> ItemResolver:
+	"""Get item resolver of a Shopify order.
+
+	Resolver is kept for the rest of the job, so order, invoice, fulfillment and
+	refund handling of an order share it. It's dropped if work is rolled back."""
+	resolvers = frappe.flags.setdefault("shopify_item_resolvers", {})
+	clear_on_rollback("shopify_item_resolvers")
+	order_id = cstr(order_id)
+
+	if order_id not in resolvers:
+		resolvers[order_id] = ItemResolver()
+
+	resolver = resolvers[order_id]
+	resolver.fetch(line_items or [])
+	return resolver
+
+
+def clear_item_resolver(order_id) -> None:
+	(frappe.flags.shopify_item_resolvers or {}).pop(cstr(order_id), None)
+
+
+def get_item_code(shopify_item, item_resolver: Optional[ItemResolver] = None):
 	"""Get item code using shopify_item dict.
 
 	Item should contain both product_id and variant_id."""
 
-	item = ecommerce_item.get_erpnext_item(
-		integration=MODULE_NAME,
-		integration_item_code=shopify_item.get("product_id"),
-		variant_id=shopify_item.get("variant_id"),
-		sku=shopify_item.get("sku"),
-	)
-	if item:
-		return item.item_code
+	item_resolver = item_resolver or ItemResolver()
+	return item_resolver.get_item_code(shopify_item)
 
 
 @temp_shopify_session
@@ -376,7 +531,7 @@ def upload_erpnext_item(doc, method=None):
 		product.status = "active" if setting.sync_new_item_as_active else "draft"
 
 		map_erpnext_item_to_shopify(shopify_product=product, erpnext_item=template_item)
-		is_successful = product.save()
+		is_successful = call_with_rate_limit(product.save, caller="product")
 
 		if is_successful:
 			update_default_variant_properties(
@@ -410,7 +565,7 @@ def upload_erpnext_item(doc, method=None):
 						frappe.throw(_("Shopify Error: Missing value for attribute {}").format(attr.attribute))
 				product.variants.append(Variant(variant_attributes))
 
-			product.save()  # push variant
+			call_with_rate_limit(product.save, caller="product")  # push variant
 
 			ecom_items = list(set([item, template_item]))
 			for d in ecom_items:
@@ -430,7 +585,7 @@ def upload_erpnext_item(doc, method=None):
 
 		write_upload_log(status=is_successful, product=product, item=item)
 	elif setting.update_shopify_item_on_update:
-		product = Product.find(product_id)
+		product = call_with_rate_limit(Product.find, product_id, caller="product")
 		if product:
 			map_erpnext_item_to_shopify(shopify_product=product, erpnext_item=template_item)
 			if not item.variant_of:
@@ -457,7 +612,7 @@ def upload_erpnext_item(doc, method=None):
 						frappe.throw(_("Shopify Error: Missing value for attribute {}").format(attr.attribute))
 				product.variants.append(Variant(variant_attributes))
 
-			is_successful = product.save()
+			is_successful = call_with_rate_limit(product.save, caller="product")
 			if is_successful and item.variant_of:
 				map_erpnext_variant_to_shopify_variant(product, item, variant_attributes)
 
@@ -576,7 +731,7 @@ def get_product():
 			break
 		frappe.db.sql("update `tabEcommerce Item` set variant_id_new='0' where erpnext_item_code='{0}' and integration_item_code='{1}'".format(pd.erpnext_item_code,pd.integration_item_code))
 		product_id=pd.integration_item_code
-		shopify_product = Product.find(product_id)
+		shopify_product = call_with_rate_limit(Product.find, product_id, caller="product")
 		for variant in shopify_product.variants:
 			if variant.sku:
 				frappe.db.sql("update `tabEcommerce Item` set variant_id_new='{0}' where sku='{1}' and integration_item_code='{2}'".format(variant.id,variant.sku,product_id))
@@ -0,0 +1,173 @@
+"""Leaky bucket rate limiter for Shopify API calls, shared by all workers of a site.
+
+Shopify gives each store a bucket of API calls (40 on standard plans) which
+leaks 2 calls per second. Fill level of the bucket is returned with every
+response in `X-Shopify-Shop-Api-Call-Limit` header, e.g. "32/40".
+
+Bucket state is kept in redis so that concurrent jobs (inventory sync, product
+imports, webhooks) throttle themselves before Shopify starts responding with 429.
+"""
+
+import random
+import time
+from typing import Any, Callable, Dict, Optional
+
+import frappe
+import requests
+from pyactiveresource.connection import ClientError
+from shopify import ShopifyResource
+
+BUCKET_KEY = "shopify_api_bucket"
+WAIT_TIME_KEY = "shopify_api_wait_time"
+
+CALL_LIMIT_HEADER = "X-Shopify-Shop-Api-Call-Limit"
+DEFAULT_BUCKET_SIZE = 40
+LEAK_RATE = 2  # calls per second
+# room left in bucket for calls which don't go through the limiter
+BUCKET_MARGIN = 2
+MAX_RETRIES = 5
+
+# Leak the bucket and take one slot if possible.
+# returns 0 if slot was taken, otherwise seconds to wait before next attempt.
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local leak_rate = tonumber(ARGV[2])
+local margin = tonumber(ARGV[3])
+local level = tonumber(redis.call('HGET', KEYS[1], 'level') or '0')
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated') or ARGV[1])
+local size = tonumber(redis.call('HGET', KEYS[1], 'size') or ARGV[4])
+
+level = math.max(0, level - math.max(0, now - updated) * leak_rate)
+local wait = 0
+if level + 1 > size - margin then
+	wait = (level + 1 - size + margin) / leak_rate
+else
+	level = level + 1
+end
+
+redis.call('HSET', KEYS[1], 'level', level, 'updated', now)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+
+def call_with_rate_limit(func: Callable, *args, caller: str = "shopify", **kwargs) -> Any:
+	"""Call Shopify API function after acquiring a slot in the shared bucket.
+
+	Works with ShopifyAPI resource calls (e.g. `Variant.find`) and plain
+	`requests` calls. Calls rejected with 429 are retried with backoff.
+	Time spent waiting is recorded per `caller`."""
+
+	for attempt in range(MAX_RETRIES + 1):
+		_acquire(caller)
+
+		try:
+			response = func(*args, **kwargs)
+		except ClientError as e:
+			if _get_status_code(e.response) != 429 or attempt == MAX_RETRIES:
+				raise
+			_sync_bucket(_get_headers(e.response), throttled=True)
+			_backoff(attempt, _get_headers(e.response), caller)
+			continue
+
+		if isinstance(response, requests.Response):
+			_sync_bucket(response.headers, throttled=response.status_code == 429)
+			if response.status_code == 429 and attempt < MAX_RETRIES:
+				_backoff(attempt, response.headers, caller)
+				continue
+		else:
+			_sync_bucket(_get_headers(getattr(ShopifyResource.connection, "response", None)))
+
+		return response
+
+
+@frappe.whitelist()
+def get_wait_time_stats() -> Dict[str, Dict[str, float]]:
+	"""Get total time spent waiting for rate limit, per caller."""
+	frappe.only_for("System Manager")
+
+	cache = frappe.cache()
+	# raw redis commands are used via pipeline, cache wrapper pickles hash values.
+	pipe = cache.pipeline()
+	pipe.hgetall(cache.make_key(WAIT_TIME_KEY))
+	(wait_times,) = pipe.execute()
+
+	stats = {}
+	for field, value in wait_times.items():
+		caller, metric = frappe.safe_decode(field).rsplit(":", 1)
+		stats.setdefault(caller, {})[metric] = float(value)
+
+	return stats
+
+
+def _acquire(caller: str) -> None:
+	cache = frappe.cache()
+	key = cache.make_key(BUCKET_KEY)
+	waited = 0.0
+
+	while True:
+		wait = float(
+			cache.eval(_ACQUIRE_SCRIPT, 1, key, time.time(), LEAK_RATE, BUCKET_MARGIN, DEFAULT_BUCKET_SIZE)
+		)
+		if not wait:
+			break
+		time.sleep(wait)
+		waited += wait
+
+	_record_wait(caller, waited)
+
+
+def _backoff(attempt: int, headers, caller: str) -> None:
+	retry_after = _get_header(headers, "Retry-After")
+	wait = float(retry_after) if retry_after else 2 ** attempt
+	wait += random.random()  # jitter, so that waiting workers don't retry together
+
+	time.sleep(wait)
+	_record_wait(caller, wait)
+
+
+def _sync_bucket(headers, throttled: bool = False) -> None:
+	"""Update bucket level with what Shopify reports."""
+	call_limit = _get_header(headers, CALL_LIMIT_HEADER)
+	if not call_limit and not throttled:
+		return
+
+	if call_limit:
+		used, size = (int(v) for v in call_limit.split("/"))
+	else:
+		# throttled without header, consider bucket full.
+		used = size = DEFAULT_BUCKET_SIZE
+
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	pipe.hset(cache.make_key(BUCKET_KEY), mapping={"level": used, "size": size, "updated": time.time()})
+	pipe.execute()
+
+
+def _record_wait(caller: str, wait: float) -> None:
+	cache = frappe.cache()
+	key = cache.make_key(WAIT_TIME_KEY)
+
+	pipe = cache.pipeline()
+	pipe.hincrbyfloat(key, f"{caller}:calls", 1)
+	if wait:
+		pipe.hincrbyfloat(key, f"{caller}:wait_time", wait)
+	pipe.execute()
+
+
+def _get_headers(response) -> Optional[Dict]:
+	return getattr(response, "headers", None)
+
+
+def _get_header(headers, header: str) -> Optional[str]:
+	if not headers:
+		return None
+
+	header = header.lower()
+	for key, value in headers.items():
+		if key.lower() == header:
+			return value
+
+
+def _get_status_code(response) -> Optional[int]:
+	return getattr(response, "code", None) or getattr(response, "status_code", None)
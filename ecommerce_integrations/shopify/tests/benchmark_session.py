@@ -0,0 +1,47 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+"""Micro-benchmark of session setup done by `temp_shopify_session` on every call.
+
+Run on a site with Shopify Setting configured:
+
+	bench --site <site> execute ecommerce_integrations.shopify.tests.benchmark_session.run
+"""
+
+import time
+from typing import Callable, Dict
+from unittest.mock import patch
+
+import frappe
+
+from ecommerce_integrations.shopify.connection import _get_session_details
+from ecommerce_integrations.shopify.utils import get_worker_cached
+
+CALLS = 1000
+
+
+def run(calls: int = CALLS) -> Dict[str, Dict[str, float]]:
+	"""Compare loading session details on every call (uncached) with worker cache (cached)."""
+	# warm up worker cache, like any job after the first one in a worker
+	get_worker_cached("session", _get_session_details)
+
+	results = {
+		"uncached": _measure(_get_session_details, calls),
+		"cached": _measure(lambda: get_worker_cached("session", _get_session_details), calls),
+	}
+	for name, result in results.items():
+		print(f"{name}: {result['us_per_call']:.1f} µs/call, {result['queries_per_call']:.1f} queries/call")
+	return results
+
+
+def _measure(func: Callable, calls: int) -> Dict[str, float]:
+	with patch.object(frappe.db, "sql", wraps=frappe.db.sql) as sql:
+		start = time.perf_counter()
+		for _ in range(calls):
+			func()
+		elapsed = time.perf_counter() - start
+
+	return {
+		"us_per_call": elapsed / calls * 1_000_000,
+		"queries_per_call": sql.call_count / calls,
+	}
@@ -1,14 +1,16 @@
 # Copyright (c) 2021, Frappe and Contributors
 # See LICENSE
 
+import json
 import unittest
+from unittest.mock import MagicMock, patch
 
 import frappe
 from shopify.resources import Webhook
 from shopify.session import Session
 
 from ecommerce_integrations.shopify import connection
-from ecommerce_integrations.shopify.constants import API_VERSION, SETTING_DOCTYPE
+from ecommerce_integrations.shopify.constants import API_VERSION, EVENT_MAPPER, SETTING_DOCTYPE
 
 
 class TestShopifyConnection(unittest.TestCase):
@@ -38,3 +40,43 @@ class TestShopifyConnection(unittest.TestCase):
 		with Session.temp(self.setting.shopify_url, API_VERSION, self.setting.get_password("password")):
 			for wh in Webhook.find():
 				self.assertNotEqual(wh.address, callback_url)
+
+	def test_process_request_stores_raw_body(self):
+		body = json.dumps({"id": 42, "line_items": []}).encode()
+
+		with patch("frappe.enqueue") as enqueue:
+			connection.process_request(body, "orders/create")
+
+		# order events are queued after commit
+		enqueue.assert_not_called()
+		log = frappe.get_last_doc("Ecommerce Integration Log")
+
+		self.assertEqual(log.status, "Queued")
+		self.assertEqual(log.method, EVENT_MAPPER["orders/create"])
+		self.assertEqual(log.request_data, body.decode())
+
+	def test_duplicate_webhooks_are_dropped(self):
+		webhook_id = frappe.generate_hash()
+		duplicates = connection.get_duplicate_webhook_count()
+
+		self.assertFalse(connection._is_duplicate_webhook(webhook_id))
+		self.assertTrue(connection._is_duplicate_webhook(webhook_id))
+		self.assertEqual(connection.get_duplicate_webhook_count(), duplicates + 1)
+
+		connection._forget_webhook(webhook_id)
+		self.assertFalse(connection._is_duplicate_webhook(webhook_id))
+
+	def test_worker_cache_invalidated_on_setting_change(self):
+		from ecommerce_integrations.shopify.utils import bump_setting_version, get_worker_cached
+
+		builder = MagicMock(return_value="value")
+
+		get_worker_cached("test", builder)
+		# warm worker doesn't touch database
+		with patch.object(frappe.db, "sql", side_effect=AssertionError("unexpected query")):
+			get_worker_cached("test", builder)
+		self.assertEqual(builder.call_count, 1)
+
+		bump_setting_version()
+		get_worker_cached("test", builder)
+		self.assertEqual(builder.call_count, 2)
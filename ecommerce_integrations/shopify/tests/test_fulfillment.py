@@ -0,0 +1,35 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+import frappe
+
+from ecommerce_integrations.shopify.fulfillment import get_fulfillment_items
+
+
+class TestFulfillment(unittest.TestCase):
+	@patch(
+		"ecommerce_integrations.shopify.fulfillment._get_warehouse_map",
+		return_value=({"62279942297": "_Test Warehouse 1 - _TC"}, "_Test Warehouse - _TC"),
+	)
+	def test_fulfillment_items(self, _wh_map):
+		fulfillment_lines = [
+			{"sku": "A", "quantity": 1},
+			{"sku": "B", "quantity": 2},
+			{"sku": "A", "quantity": 3},
+		]
+		item_resolver = MagicMock()
+		item_resolver.get_item_code.side_effect = lambda line: f"ITEM-{line['sku']}"
+
+		dn_items = [frappe._dict(item_code=code) for code in ("ITEM-A", "ITEM-C", "ITEM-A", "ITEM-B")]
+
+		items = get_fulfillment_items(dn_items, fulfillment_lines, 62279942297, item_resolver=item_resolver)
+
+		self.assertEqual(
+			[(d.item_code, d.qty) for d in items], [("ITEM-A", 1), ("ITEM-A", 3), ("ITEM-B", 2)]
+		)
+		self.assertTrue(all(d.warehouse == "_Test Warehouse 1 - _TC" for d in items))
+		# every line is resolved once
+		self.assertEqual(item_resolver.get_item_code.call_count, len(fulfillment_lines))
@@ -0,0 +1,247 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import json
+from unittest.mock import patch
+
+import frappe
+import responses
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.utils import get_incoming_rate
+from frappe.utils import nowdate, nowtime
+
+from ecommerce_integrations.controllers.inventory import (
+	bulk_update_inventory_sync_status,
+	filter_unchanged_inventory,
+	get_inventory_levels,
+	update_inventory_ledger,
+)
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_sync_run.ecommerce_sync_run import (
+	start_sync_run,
+)
+from ecommerce_integrations.shopify.constants import GRAPHQL_API_VERSION, MODULE_NAME
+from ecommerce_integrations.shopify.inventory import (
+	COST_API_VERSION,
+	INVENTORY_SYNC_TYPE,
+	bulk_upload_inventory_data_to_shopify,
+	sync_inventory_levels,
+	sync_product_costs,
+)
+
+from .utils import TestCase
+
+GRAPHQL_URL = f"https://frappetest.myshopify.com/admin/api/{GRAPHQL_API_VERSION}/graphql.json"
+WAREHOUSE_MAP = {"_Test Warehouse 1 - _TC": "62279942297"}
+
+
+def make_inventory_levels(count):
+	return [
+		frappe._dict(
+			ecom_item=f"_Test Ecommerce Item {i}",
+			variant_id=str(1000 + i),
+			inventory_item_id=str(2000 + i),
+			warehouse="_Test Warehouse 1 - _TC",
+			actual_qty=i,
+			cost=0,
+		)
+		for i in range(count)
+	]
+
+
+def make_ecommerce_item(item_code, properties=None):
+	with patch("ecommerce_integrations.shopify.product.upload_erpnext_item"):
+		make_item(item_code, properties)
+
+	ecom_item = frappe.db.get_value("Ecommerce Item", {"erpnext_item_code": item_code})
+	if not ecom_item:
+		ecom_item = (
+			frappe.get_doc(
+				doctype="Ecommerce Item",
+				integration=MODULE_NAME,
+				erpnext_item_code=item_code,
+				integration_item_code=item_code,
+			)
+			.insert()
+			.name
+		)
+	return ecom_item
+
+
+class TestInventory(TestCase):
+	def setUp(self):
+		super().setUp()
+		self.mutations = []
+
+	def graphql_endpoint(self, request):
+		"""Stand-in for inventorySetQuantities, rejects inventory items ending with 3."""
+		quantities = json.loads(request.body)["variables"]["input"]["quantities"]
+		self.mutations.append(quantities)
+
+		user_errors = [
+			{
+				"code": "INVALID_INVENTORY_ITEM",
+				"field": ["input", "quantities", str(idx), "inventoryItemId"],
+				"message": "The specified inventory item could not be found.",
+			}
+			for idx, q in enumerate(quantities)
+			if q["inventoryItemId"].endswith("3")
+		]
+		body = {"data": {"inventorySetQuantities": {"userErrors": user_errors}}}
+		return 200, {}, json.dumps(body)
+
+	@responses.activate
+	@patch("ecommerce_integrations.shopify.inventory._log_inventory_update_status")
+	def test_bulk_inventory_push(self, log_status):
+		responses.add_callback(responses.POST, GRAPHQL_URL, callback=self.graphql_endpoint)
+		inventory_levels = make_inventory_levels(300)
+
+		bulk_upload_inventory_data_to_shopify(inventory_levels, WAREHOUSE_MAP)
+
+		self.assertEqual([len(m) for m in self.mutations], [250, 50])
+		self.assertEqual(self.mutations[0][5]["quantity"], 5)
+		self.assertEqual(self.mutations[0][5]["locationId"], "gid://shopify/Location/62279942297")
+		self.assertEqual(log_status.call_count, 2)
+
+		for d in inventory_levels:
+			expected_status = "Not Found" if d.inventory_item_id.endswith("3") else "Success"
+			self.assertEqual(d.status, expected_status)
+
+	@responses.activate
+	@patch("ecommerce_integrations.shopify.inventory._log_inventory_update_status")
+	def test_bulk_inventory_push_failure(self, log_status):
+		responses.add(
+			responses.POST, GRAPHQL_URL, json={"errors": [{"message": "Internal error"}]},
+		)
+		inventory_levels = make_inventory_levels(10)
+
+		bulk_upload_inventory_data_to_shopify(inventory_levels, WAREHOUSE_MAP)
+
+		self.assertTrue(all(d.status == "Failed" for d in inventory_levels))
+		self.assertEqual(inventory_levels[0].failure_reason, "Internal error")
+
+	@responses.activate
+	@patch("ecommerce_integrations.shopify.inventory.create_shopify_log")
+	def test_push_only_changed_cost(self, create_log):
+		inventory_levels = make_inventory_levels(3)
+		for d, (cost, last_synced_cost) in zip(inventory_levels, [(10, 10), (12, 10), (5, 0)]):
+			d.update(status="Success", cost=cost, last_synced_cost=last_synced_cost)
+
+		for d in inventory_levels[1:]:
+			responses.add(
+				responses.PUT,
+				f"https://frappetest.myshopify.com/admin/api/{COST_API_VERSION}/inventory_items/{d.inventory_item_id}.json",
+				json={"inventory_item": {"cost": str(d.cost)}},
+			)
+
+		sync_product_costs(inventory_levels)
+
+		self.assertEqual(len(responses.calls), 2)
+		self.assertEqual(create_log.call_count, 1)
+		self.assertEqual(create_log.call_args.kwargs["status"], "Success")
+
+	@responses.activate
+	@patch("ecommerce_integrations.shopify.inventory.create_shopify_log")
+	@patch("ecommerce_integrations.shopify.inventory.upload_inventory_data_to_shopify")
+	def test_one_cost_log_per_sync(self, upload, create_log):
+		inventory_levels = make_inventory_levels(2)
+		for d in inventory_levels:
+			d.update(cost=10 + d.actual_qty, last_synced_cost=5)
+			responses.add(
+				responses.PUT,
+				f"https://frappetest.myshopify.com/admin/api/{COST_API_VERSION}/inventory_items/{d.inventory_item_id}.json",
+				json={"inventory_item": {"cost": str(d.cost)}},
+			)
+
+		# first level is unchanged, second one is pushed
+		update_inventory_ledger(inventory_levels[:1], MODULE_NAME, WAREHOUSE_MAP)
+		upload.side_effect = lambda levels, *args, **kwargs: [d.update(status="Success") for d in levels]
+
+		sync_inventory_levels(frappe._dict(bulk_inventory_sync=0), WAREHOUSE_MAP, inventory_levels)
+
+		upload.assert_called_once_with(inventory_levels[1:], WAREHOUSE_MAP, run=None)
+		self.assertEqual(len(responses.calls), 2)
+		cost_logs = [
+			c for c in create_log.call_args_list if c.kwargs.get("method") == "update_cost_on_shopify"
+		]
+		self.assertEqual(len(cost_logs), 1)
+
+	def test_inventory_cost(self):
+		item_code = "_TestShopifyInventoryCostItem"
+		warehouse = "_Test Warehouse - _TC"
+		make_ecommerce_item(item_code, {"valuation_method": "FIFO"})
+
+		make_stock_entry(item_code=item_code, qty=10, to_warehouse=warehouse, rate=10)
+		make_stock_entry(item_code=item_code, qty=30, to_warehouse=warehouse, rate=20)
+
+		levels = get_inventory_levels((warehouse,), MODULE_NAME, include_cost=True)
+		level = next(d for d in levels if d.item_code == item_code)
+
+		expected_cost = get_incoming_rate(
+			{
+				"item_code": item_code,
+				"warehouse": warehouse,
+				"posting_date": nowdate(),
+				"posting_time": nowtime(),
+				"qty": -1 * level.actual_qty,
+				"company": "_Test Company",
+			}
+		)
+		self.assertAlmostEqual(level.cost, expected_cost)
+
+		levels = get_inventory_levels((warehouse,), MODULE_NAME)
+		self.assertTrue(all(d.cost == 0 for d in levels))
+
+	def test_skip_unchanged_inventory(self):
+		inventory_levels = make_inventory_levels(3)
+		update_inventory_ledger(inventory_levels[:2], MODULE_NAME, WAREHOUSE_MAP)
+
+		inventory_levels[1].actual_qty += 1
+		changed, unchanged = filter_unchanged_inventory(inventory_levels, WAREHOUSE_MAP)
+
+		self.assertEqual(unchanged, inventory_levels[:1])
+		self.assertEqual(changed, inventory_levels[1:])
+
+		update_inventory_ledger(changed, MODULE_NAME, WAREHOUSE_MAP)
+		changed, unchanged = filter_unchanged_inventory(inventory_levels, WAREHOUSE_MAP)
+		self.assertEqual(changed, [])
+
+	@patch("ecommerce_integrations.shopify.inventory.sync_product_costs")
+	@patch("ecommerce_integrations.shopify.inventory.upload_inventory_data_to_shopify")
+	def test_resumed_run_progress(self, upload, _sync_costs):
+		inventory_levels = make_inventory_levels(5)
+		run = start_sync_run(
+			MODULE_NAME,
+			INVENTORY_SYNC_TYPE,
+			total_rows=5,
+			data=[[d.ecom_item, d.warehouse] for d in inventory_levels],
+			cursor=2,
+			rows_done=2,
+		)
+
+		# of 3 pending rows one is unchanged and one isn't fetched anymore
+		pending = inventory_levels[2:4]
+		update_inventory_ledger(pending[:1], MODULE_NAME, WAREHOUSE_MAP)
+		sync_inventory_levels(
+			frappe._dict(bulk_inventory_sync=0), WAREHOUSE_MAP, pending, run=run, track_run=True
+		)
+
+		upload.assert_called_once_with(pending[1:], WAREHOUSE_MAP, run=run)
+		run.reload()
+		self.assertEqual((run.total_rows, run.rows_done, run.rows_remaining), (5, 4, 0))
+
+	def test_bulk_update_sync_status(self):
+		ecom_items = [make_ecommerce_item(f"_TestShopifySyncStatusItem{i}") for i in range(3)]
+		synced_on = "2021-01-01 10:00:00"
+		frappe.db.set_value(
+			"Ecommerce Item", {"name": ("in", ecom_items)}, "modified", synced_on, update_modified=False
+		)
+
+		bulk_update_inventory_sync_status(ecom_items[:2], time=synced_on)
+
+		for ecom_item, synced in zip(ecom_items, [True, True, False]):
+			inventory_synced_on, modified = frappe.db.get_value(
+				"Ecommerce Item", ecom_item, ["inventory_synced_on", "modified"]
+			)
+			self.assertEqual(str(inventory_synced_on) == synced_on, synced)
+			self.assertEqual(str(modified) != synced_on, synced)
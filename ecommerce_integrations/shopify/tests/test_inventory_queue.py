@@ -0,0 +1,41 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+
+from ecommerce_integrations.shopify import inventory_queue
+
+
+class TestInventoryQueue(unittest.TestCase):
+	def tearDown(self):
+		inventory_queue._pop_dirty_inventory()
+		frappe.flags.shopify_dirty_inventory = None
+
+	@patch("ecommerce_integrations.shopify.inventory_queue.frappe.enqueue")
+	@patch("ecommerce_integrations.shopify.inventory_queue._get_synced_items", return_value={"A"})
+	@patch(
+		"ecommerce_integrations.shopify.inventory_queue._get_synced_warehouses",
+		return_value={"Stores - _TC"},
+	)
+	def test_dirty_inventory_is_deduplicated(self, _warehouses, get_synced_items, enqueue):
+		frappe.cache().delete(frappe.cache().make_key(inventory_queue.SCHEDULED_KEY))
+		for item_code, warehouse in [
+			("A", "Stores - _TC"),
+			("A", "Stores - _TC"),
+			("B", "Other - _TC"),
+			("C", "Stores - _TC"),
+		]:
+			inventory_queue.mark_inventory_dirty(frappe._dict(item_code=item_code, warehouse=warehouse))
+
+		inventory_queue._flush_dirty_inventory()
+		# synced items are checked once per transaction, C isn't synced with Shopify
+		get_synced_items.assert_called_once_with({"A", "C"})
+		inventory_queue.mark_inventory_dirty(frappe._dict(item_code="A", warehouse="Stores - _TC"))
+		inventory_queue._flush_dirty_inventory()
+
+		# one job for all changes, until it starts
+		enqueue.assert_called_once()
+		self.assertEqual(inventory_queue._pop_dirty_inventory(), [("A", "Stores - _TC")])
@@ -3,10 +3,58 @@
 
 import json
 import unittest
+from types import MappingProxyType
+from unittest.mock import patch
 
-from ecommerce_integrations.shopify.order import sync_sales_order
+import frappe
+
+from ecommerce_integrations.shopify.order import (
+	OrderLookupContext,
+	VendorAccounts,
+	get_order_taxes,
+	sync_sales_order,
+)
+
+LOOKUP_CONTEXT = OrderLookupContext(
+	tax_accounts=MappingProxyType({"vat": "_Test Account VAT - _TC"}),
+	tax_descriptions=MappingProxyType({"vat": "Value Added Tax"}),
+	default_tax_accounts=MappingProxyType(
+		{"sales_tax": "_Test Account Excise Duty - _TC", "shipping": "_Test Account Shipping Charges - _TC"}
+	),
+	vendor_accounts=MappingProxyType(
+		{"": VendorAccounts(None, "_Test Cost Center - _TC"), "acme": VendorAccounts(None, "Main - _TC")}
+	),
+)
 
 
 class TestOrder(unittest.TestCase):
 	def test_sync_with_variants(self):
 		pass
+
+	@patch("ecommerce_integrations.shopify.order.get_item_resolver")
+	@patch("ecommerce_integrations.shopify.order.get_item_code", return_value="_Test Item")
+	@patch("ecommerce_integrations.shopify.order.get_lookup_context", return_value=LOOKUP_CONTEXT)
+	def test_order_taxes_from_lookup_context(self, get_context, get_item_code, get_item_resolver):
+		order = {
+			"line_items": [
+				# mapping is matched case insensitively
+				{"vendor": "ACME ", "tax_lines": [{"title": "Vat", "rate": 0.05, "price": "5.00"}]},
+				{"vendor": "Other", "tax_lines": [{"title": "GST", "rate": 0.1, "price": "1.00"}]},
+			],
+			"shipping_lines": [{"title": "Express", "price": "10.00", "tax_lines": []}],
+		}
+		setting = frappe._dict(cost_center="Main - _TC")
+
+		with patch.object(frappe.db, "sql", side_effect=AssertionError("unexpected query")):
+			taxes = get_order_taxes(order, setting, items=[])
+
+		self.assertEqual(get_context.call_count, 1)
+		self.assertEqual(
+			[(t["account_head"], t["description"], t["cost_center"]) for t in taxes],
+			[
+				("_Test Account VAT - _TC", "Value Added Tax", "Main - _TC"),
+				("_Test Account Excise Duty - _TC", "GST - 10.00%", "_Test Cost Center - _TC"),
+				("_Test Account Shipping Charges - _TC", "Express", "_Test Cost Center - _TC"),
+			],
+		)
+		self.assertEqual(json.loads(taxes[0]["item_wise_tax_detail"]), {"_Test Item": [5.0, 5.0]})
@@ -0,0 +1,53 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_sync_run.ecommerce_sync_run import (
+	start_sync_run,
+)
+from ecommerce_integrations.shopify import order_backfill
+from ecommerce_integrations.shopify.constants import MODULE_NAME
+
+
+class TestOrderBackfill(unittest.TestCase):
+	def test_backfill_windows(self):
+		windows = order_backfill.get_backfill_windows("2021-01-01 00:00:00", "2021-01-20 12:00:00")
+
+		self.assertEqual(
+			windows,
+			[
+				("2021-01-01 00:00:00", "2021-01-08 00:00:00"),
+				("2021-01-08 00:00:00", "2021-01-15 00:00:00"),
+				("2021-01-15 00:00:00", "2021-01-20 12:00:00"),
+			],
+		)
+
+	@patch("ecommerce_integrations.shopify.order_backfill.schedule_backfill")
+	@patch("ecommerce_integrations.shopify.order.sync_sales_order")
+	@patch("ecommerce_integrations.shopify.order_backfill._fetch_order_pages")
+	def test_resume_window_from_cursor(self, fetch_pages, sync_sales_order, _schedule):
+		run = start_sync_run(
+			MODULE_NAME,
+			"Order Backfill: _Test Window",
+			total_rows=3,
+			data={"from": "2021-01-01 00:00:00", "to": "2021-01-08 00:00:00"},
+			cursor=1001,
+		)
+		fetch_pages.return_value = iter([[{"id": 1002}, {"id": 1003}]])
+
+		order_backfill.backfill_window(run.name)
+
+		self.assertEqual(fetch_pages.call_args.kwargs["since_id"], 1001)
+		self.assertEqual(
+			[c.args[0]["id"] for c in sync_sales_order.call_args_list], [1002, 1003],
+		)
+
+		run.reload()
+		self.assertEqual(run.status, "Completed")
+		self.assertEqual(run.rows_done, 2)
+		self.assertEqual(run.cursor, "1003")
+		run.delete()
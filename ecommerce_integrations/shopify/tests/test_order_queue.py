@@ -0,0 +1,121 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import json
+import unittest
+from unittest.mock import patch
+
+import frappe
+
+from ecommerce_integrations.shopify import order_queue
+
+
+class TestOrderQueue(unittest.TestCase):
+	def test_get_order_id(self):
+		self.assertEqual(order_queue.get_order_id({"id": 42}, "orders/paid"), "42")
+		self.assertEqual(order_queue.get_order_id({"id": 7, "order_id": 42}, "refunds/create"), "42")
+
+	@patch("ecommerce_integrations.shopify.order_queue._mark_superseded")
+	def test_coalesce_consecutive_updates(self, mark_superseded):
+		events = [
+			{"event": "orders/create", "request_id": "1"},
+			{"event": "orders/updated", "request_id": "2"},
+			{"event": "orders/updated", "request_id": "3"},
+			{"event": "orders/paid", "request_id": "4"},
+			{"event": "orders/updated", "request_id": "5"},
+		]
+
+		coalesced = order_queue._coalesce_events(events)
+
+		self.assertEqual([e["request_id"] for e in coalesced], ["1", "3", "4", "5"])
+		mark_superseded.assert_called_once_with(events[1])
+
+	@patch("ecommerce_integrations.shopify.order_queue._refresh_lock")
+	@patch("ecommerce_integrations.shopify.order_queue._park_events")
+	@patch("ecommerce_integrations.shopify.order_queue._run_event")
+	@patch("ecommerce_integrations.shopify.order_queue._sales_order_exists", return_value=False)
+	def test_dependent_events_wait_for_order(self, _order_exists, run_event, park_events, _lock):
+		events = [
+			{"event": "orders/paid", "request_id": "1"},
+			{"event": "orders/fulfilled", "request_id": "2"},
+		]
+
+		order_queue._process_events("42", events)
+
+		run_event.assert_not_called()
+		park_events.assert_called_once_with("42", events)
+
+	def test_events_stay_inflight_until_acknowledged(self):
+		order_id = "_test_inflight_order"
+		self.addCleanup(order_queue._ack_events, order_id)
+
+		cache = frappe.cache()
+		cache.rpush(
+			order_queue.EVENTS_KEY.format(order_id),
+			json.dumps({"event": "orders/create", "request_id": "1"}),
+		)
+		cache.rpush(
+			order_queue.PARKED_EVENTS_KEY.format(order_id),
+			json.dumps({"event": "orders/paid", "request_id": "2"}),
+		)
+
+		popped = next(order_queue._iter_events(order_id))
+		self.assertEqual([e["request_id"] for e in popped], ["2", "1"])
+		self.assertEqual(cache.llen(order_queue.EVENTS_KEY.format(order_id)), 0)
+
+		# job died before acknowledging, events are processed again by next job
+		self.assertEqual(next(order_queue._iter_events(order_id)), popped)
+
+		order_queue._ack_events(order_id)
+		self.assertEqual(list(order_queue._iter_events(order_id)), [])
+
+	@patch("ecommerce_integrations.shopify.order_queue._schedule")
+	def test_requeue_orders_left_behind(self, schedule):
+		order_id = "_test_stale_order"
+		self.addCleanup(order_queue._ack_events, order_id)
+
+		frappe.cache().rpush(
+			order_queue.INFLIGHT_EVENTS_KEY.format(order_id),
+			json.dumps({"event": "orders/create", "request_id": "1"}),
+		)
+
+		with patch("ecommerce_integrations.shopify.order_queue._is_locked", return_value=True):
+			order_queue.requeue_stale_events()
+		self.assertNotIn(order_id, [c.args[0] for c in schedule.call_args_list])
+
+		order_queue.requeue_stale_events()
+		schedule.assert_any_call(order_id)
+
+	@patch("ecommerce_integrations.shopify.order_queue._ensure_consumer")
+	@patch("ecommerce_integrations.shopify.order_queue._get_batch_size", return_value=10)
+	def test_ready_order_locked_on_pop(self, _batch_size, _consumer):
+		order_id = "_test_ready_order"
+		cache = frappe.cache()
+		cache.delete(cache.make_key(order_queue.READY_ORDERS_KEY))
+		self.addCleanup(cache.delete, cache.make_key(order_queue.READY_ORDERS_KEY))
+		self.addCleanup(order_queue._release_lock, order_id)
+
+		order_queue._schedule(order_id)
+		# order waits in ready list longer than lock timeout, sweep or next webhook schedules it again
+		order_queue._release_lock(order_id)
+		order_queue._schedule(order_id)
+		self.assertEqual(cache.lrange(order_queue.READY_ORDERS_KEY, 0, -1), [order_id.encode()])
+
+		def process_events(order_id, events):
+			self.assertTrue(order_queue._is_locked(order_id))
+
+		with patch("ecommerce_integrations.shopify.order_queue._process_events") as process, patch(
+			"ecommerce_integrations.shopify.order_queue._iter_events", return_value=iter([[{}]])
+		):
+			process.side_effect = process_events
+			order_queue._process_batch(order_queue._pop_ready_orders(10))
+		process.assert_called_once_with(order_id, [{}])
+		self.assertFalse(order_queue._is_locked(order_id))
+
+		# popped while another job holds the lock
+		order_queue._schedule(order_id)
+		order_queue._acquire_lock(order_id)
+		with patch("ecommerce_integrations.shopify.order_queue._process_events") as process:
+			order_queue._process_batch(order_queue._pop_ready_orders(10))
+		process.assert_not_called()
+		self.assertTrue(order_queue._is_locked(order_id))
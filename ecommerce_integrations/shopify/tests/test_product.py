@@ -1,9 +1,19 @@
 # Copyright (c) 2021, Frappe and Contributors
 # See LICENSE
 
+import json
+from unittest.mock import patch
+
 import frappe
+from shopify.resources import Product
 
-from ecommerce_integrations.shopify.product import ShopifyProduct
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_item import ecommerce_item
+from ecommerce_integrations.shopify.constants import MODULE_NAME
+from ecommerce_integrations.shopify.product import (
+	ItemResolver,
+	ShopifyProduct,
+	create_items_if_not_exist,
+)
 
 from .utils import TestCase
 
@@ -117,6 +127,50 @@ class TestProduct(TestCase):
 			"39845261541529",
 		)
 
+	def test_item_resolver(self):
+		self.fake("products/6704435495065", body=self.load_fixture("variant_product"))
+		ShopifyProduct(product_id="6704435495065").sync_product()
+
+		line_items = [
+			{"product_id": 6704435495065, "variant_id": variant_id, "sku": None}
+			for variant_id in (39845261705369, 39845261639833, 39845261607065)
+		]
+
+		with patch.object(frappe.db, "sql", wraps=frappe.db.sql) as sql:
+			resolver = ItemResolver(line_items)
+			item_codes = [resolver.get_item_code(d) for d in line_items]
+			self.assertEqual(sql.call_count, 1)
+
+		for line_item, item_code in zip(line_items, item_codes):
+			item = ecommerce_item.get_erpnext_item(
+				MODULE_NAME, str(line_item["product_id"]), variant_id=str(line_item["variant_id"])
+			)
+			self.assertEqual(item_code, item.item_code)
+
+		self.assertIsNone(resolver.get_item_code({"product_id": 1, "variant_id": 2}))
+
+	def test_create_items_in_one_request(self):
+		products = json.loads(self.load_fixture("bulk_products"))["products"]
+		order = {
+			"id": "_test_batched_product_order",
+			"line_items": [
+				{"product_id": p["id"], "variant_id": v["id"], "sku": v.get("sku")}
+				for p in products
+				for v in p["variants"]
+			],
+		}
+
+		with patch.object(Product, "find", return_value=[Product(p) for p in products]) as find:
+			create_items_if_not_exist(order)
+
+		find.assert_called_once()
+		self.assertEqual(
+			sorted(find.call_args.kwargs["ids"].split(",")), sorted({str(p["id"]) for p in products})
+		)
+
+		resolver = ItemResolver(order["line_items"])
+		self.assertTrue(all(resolver.get_item_code(d) for d in order["line_items"]))
+
 
 def create_item_attributes():
 	if not frappe.db.exists("Item Attribute", "Test Sync Size"):
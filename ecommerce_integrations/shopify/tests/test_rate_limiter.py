@@ -0,0 +1,62 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from ecommerce_integrations.shopify import rate_limiter
+
+
+def make_response(status_code, call_limit="1/40"):
+	response = requests.Response()
+	response.status_code = status_code
+	response.headers[rate_limiter.CALL_LIMIT_HEADER] = call_limit
+	return response
+
+
+class FakeClock:
+	def __init__(self):
+		self.now = 1_600_000_000.0
+
+	def time(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+	def setUp(self):
+		# bucket leaks on this clock, limiter never waits for real time
+		self.clock = FakeClock()
+		patches = (
+			patch.object(rate_limiter.time, "time", self.clock.time),
+			patch.object(rate_limiter.time, "sleep", side_effect=self.clock.sleep),
+		)
+		for p in patches:
+			p.start()
+			self.addCleanup(p.stop)
+		self.sleep = rate_limiter.time.sleep
+
+	def test_retry_throttled_calls(self):
+		api_call = MagicMock(side_effect=[make_response(429, "40/40"), make_response(200)])
+
+		response = rate_limiter.call_with_rate_limit(api_call, "url", caller="test")
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(api_call.call_count, 2)
+		self.assertTrue(self.sleep.called)
+
+	def test_wait_when_bucket_is_full(self):
+		rate_limiter._sync_bucket({rate_limiter.CALL_LIMIT_HEADER: "40/40"})
+		waited = rate_limiter.get_wait_time_stats().get("full_bucket", {}).get("wait_time", 0)
+
+		rate_limiter.call_with_rate_limit(MagicMock(return_value=make_response(200)), caller="full_bucket")
+
+		# 3 calls over the limit (bucket margin included) leak in 1.5 seconds
+		self.sleep.assert_called_once_with(1.5)
+		self.assertAlmostEqual(
+			rate_limiter.get_wait_time_stats()["full_bucket"]["wait_time"], waited + 1.5
+		)
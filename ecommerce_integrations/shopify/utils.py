@@ -1,6 +1,6 @@
 # Copyright (c) 2021, Frappe and contributors
 # For license information, please see LICENSE
-from typing import List
+from typing import Any, Callable, Dict, List, Tuple
 
 import frappe
 from frappe import _, _dict
@@ -12,13 +12,49 @@ from ecommerce_integrations.shopify.constants import (
 	MODULE_NAME,
 	OLD_SETTINGS_DOCTYPE,
 	SETTING_DOCTYPE,
+	SETTING_VERSION_KEY,
 )
 
+# values derived from Shopify Setting, kept in worker memory across jobs.
+# {(site, key): (setting_version, value)}
+_worker_cache: Dict[Tuple[str, str], Tuple[str, Any]] = {}
+
 
 def create_shopify_log(**kwargs):
 	return create_log(module_def=MODULE_NAME, **kwargs)
 
 
+def get_setting_version() -> str:
+	"""Get token that changes whenever Shopify Setting is modified, see `bump_setting_version`."""
+	cache = frappe.cache()
+	version = cache.get_value(SETTING_VERSION_KEY)
+	if not version:
+		version = frappe.generate_hash()
+		cache.set_value(SETTING_VERSION_KEY, version)
+	return version
+
+
+def bump_setting_version() -> None:
+	"""Invalidate worker caches, called only after setting is committed.
+
+	Otherwise a worker could read the old setting after bump and cache it under new version."""
+	frappe.cache().set_value(SETTING_VERSION_KEY, frappe.generate_hash())
+
+
+def get_worker_cached(key: str, builder: Callable[[], Any]) -> Any:
+	"""Get value cached in worker memory, `builder` is called again only after Shopify Setting is modified."""
+	version = get_setting_version()
+	cache_key = (frappe.local.site, key)
+
+	cached = _worker_cache.get(cache_key)
+	if cached and cached[0] == version:
+		return cached[1]
+
+	value = builder()
+	_worker_cache[cache_key] = (version, value)
+	return value
+
+
 def migrate_from_old_connector(payload=None, request_id=None):
 	"""This function is called to migrate data from old connector to new connector."""
 
@@ -5,13 +5,16 @@ import frappe
 from frappe.utils import cint, now
 
 from ecommerce_integrations.controllers.inventory import (
+	bulk_update_inventory_sync_status,
+	filter_unchanged_inventory,
 	get_inventory_levels,
 	get_inventory_levels_of_group_warehouse,
-	update_inventory_sync_status,
+	update_inventory_ledger,
 )
 from ecommerce_integrations.controllers.scheduling import need_to_run
 from ecommerce_integrations.unicommerce.api_client import UnicommerceAPIClient
 from ecommerce_integrations.unicommerce.constants import MODULE_NAME, SETTINGS_DOCTYPE
+from ecommerce_integrations.unicommerce.utils import create_unicommerce_log
 
 # Note: Undocumented but currently handles ~1000 inventory changes in one request.
 # Remaining to be done in next interval.
@@ -47,6 +50,7 @@ def update_inventory_on_unicommerce(client=None, force=False):
 	# track which ecommerce item was updated successfully
 	success_map: Dict[str, bool] = defaultdict(lambda: True)
 	inventory_synced_on = now()
+	skipped = 0
 
 	for warehouse in warehouses:
 		is_group_warehouse = cint(frappe.db.get_value("Warehouse", warehouse, "is_group"))
@@ -58,6 +62,15 @@ def update_inventory_on_unicommerce(client=None, force=False):
 		else:
 			erpnext_inventory = get_inventory_levels(warehouses=(warehouse,), integration=MODULE_NAME)
 
+		if not erpnext_inventory:
+			continue
+
+		erpnext_inventory, unchanged = filter_unchanged_inventory(erpnext_inventory, wh_to_facility_map)
+		for d in unchanged:
+			# nothing to push, mark as synced unless sync fails for another warehouse.
+			success_map.setdefault(d.ecom_item, True)
+		skipped += len(unchanged)
+
 		if not erpnext_inventory:
 			continue
 
@@ -79,10 +92,20 @@ def update_inventory_on_unicommerce(client=None, force=False):
 				# Any one warehouse sync failure should be considered failure
 				success_map[ecom_item] = success_map[ecom_item] and status
 
+			synced = [d for d in erpnext_inventory if response.get(d.integration_item_code)]
+			update_inventory_ledger(synced, MODULE_NAME, wh_to_facility_map, time=inventory_synced_on)
+
 	_update_inventory_sync_status(success_map, inventory_synced_on)
 
+	if skipped:
+		create_unicommerce_log(
+			method="ecommerce_integrations.unicommerce.inventory.update_inventory_on_unicommerce",
+			status="Success",
+			message=f"Skipped pushing {skipped} inventory levels with unchanged quantity.",
+		)
+
 
 def _update_inventory_sync_status(ecom_item_success_map: Dict[str, bool], timestamp: str) -> None:
-	for ecom_item, status in ecom_item_success_map.items():
-		if status:
-			update_inventory_sync_status(ecom_item, timestamp)
+	synced_items = [ecom_item for ecom_item, status in ecom_item_success_map.items() if status]
+	bulk_update_inventory_sync_status(synced_items, timestamp)
+	frappe.db.commit()
@@ -6,6 +6,9 @@ import frappe
 from frappe.utils import add_to_date, flt
 
 from ecommerce_integrations.controllers.scheduling import need_to_run
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_integration_log.ecommerce_integration_log import (
+	log_session,
+)
 from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_item import ecommerce_item
 from ecommerce_integrations.unicommerce.api_client import UnicommerceAPIClient
 from ecommerce_integrations.unicommerce.constants import (
@@ -94,34 +97,36 @@ def _create_sales_invoices(unicommerce_order, sales_order, client: UnicommerceAP
 	facility_code = sales_order.get(FACILITY_CODE_FIELD)
 	shipping_packages = unicommerce_order["shippingPackages"]
 	for package in shipping_packages:
-		try:
-			# This code was added because the log statement below was being executed every time.
-			invoice_data = client.get_sales_invoice(
-				shipping_package_code=package["code"], facility_code=facility_code
-			)
-			existing_si = frappe.db.get_value(
-				"Sales Invoice", {INVOICE_CODE_FIELD: invoice_data["invoice"]["code"]}
-			)
-			if existing_si:
-				continue
-
-			log = create_unicommerce_log(method="create_sales_invoice", make_new=True)
-			frappe.flags.request_id = log.name
-
-			warehouse_allocations = _get_warehouse_allocations(sales_order)
-			create_sales_invoice(
-				invoice_data["invoice"],
-				sales_order.name,
-				update_stock=1,
-				so_data=unicommerce_order,
-				warehouse_allocations=warehouse_allocations,
-			)
-		except Exception as e:
-			create_unicommerce_log(status="Error", exception=e, rollback=True, request_data=invoice_data)
-			frappe.flags.request_id = None
-		else:
-			create_unicommerce_log(status="Success", request_data=invoice_data)
-			frappe.flags.request_id = None
+		# every package is committed on its own, together with its log.
+		with log_session():
+			try:
+				# This code was added because the log statement below was being executed every time.
+				invoice_data = client.get_sales_invoice(
+					shipping_package_code=package["code"], facility_code=facility_code
+				)
+				existing_si = frappe.db.get_value(
+					"Sales Invoice", {INVOICE_CODE_FIELD: invoice_data["invoice"]["code"]}
+				)
+				if existing_si:
+					continue
+
+				log = create_unicommerce_log(method="create_sales_invoice", make_new=True)
+				frappe.flags.request_id = log.name
+
+				warehouse_allocations = _get_warehouse_allocations(sales_order)
+				create_sales_invoice(
+					invoice_data["invoice"],
+					sales_order.name,
+					update_stock=1,
+					so_data=unicommerce_order,
+					warehouse_allocations=warehouse_allocations,
+				)
+			except Exception as e:
+				create_unicommerce_log(status="Error", exception=e, rollback=True, request_data=invoice_data)
+				frappe.flags.request_id = None
+			else:
+				create_unicommerce_log(status="Success", request_data=invoice_data)
+				frappe.flags.request_id = None
 
 
 def create_order(payload: UnicommerceOrder, request_id: Optional[str] = None, client=None) -> None:
@@ -133,29 +138,30 @@ def create_order(payload: UnicommerceOrder, request_id: Optional[str] = None, cl
 		so = frappe.get_doc("Sales Order", existing_so)
 		return so
 
-	# If a sales order already exists, then every time it's executed
-	if request_id is None:
-		log = create_unicommerce_log(
-			method="ecommerce_integrations.unicommerce.order.create_order", request_data=payload
-		)
-		request_id = log.name
+	with log_session():
+		# If a sales order already exists, then every time it's executed
+		if request_id is None:
+			log = create_unicommerce_log(
+				method="ecommerce_integrations.unicommerce.order.create_order", request_data=payload
+			)
+			request_id = log.name
 
-	if client is None:
-		client = UnicommerceAPIClient()
+		if client is None:
+			client = UnicommerceAPIClient()
 
-	frappe.set_user("Administrator")
-	frappe.flags.request_id = request_id
-	try:
-		_sync_order_items(order, client=client)
-		customer = sync_customer(order)
-		order = _create_order(order, customer)
-	except Exception as e:
-		create_unicommerce_log(status="Error", exception=e, rollback=True)
-		frappe.flags.request_id = None
-	else:
-		create_unicommerce_log(status="Success")
-		frappe.flags.request_id = None
-		return order
+		frappe.set_user("Administrator")
+		frappe.flags.request_id = request_id
+		try:
+			_sync_order_items(order, client=client)
+			customer = sync_customer(order)
+			order = _create_order(order, customer)
+		except Exception as e:
+			create_unicommerce_log(status="Error", exception=e, rollback=True)
+			frappe.flags.request_id = None
+		else:
+			create_unicommerce_log(status="Success")
+			frappe.flags.request_id = None
+			return order
 
 
 def _sync_order_items(order: UnicommerceOrder, client: UnicommerceAPIClient) -> Set[str]: